@@ -0,0 +1,231 @@
+"""
+End-to-end benchmark over a directory of Shift JSON ASTs.
+
+Measures encode and decode throughput, peak memory and output size against gzip and
+Brotli on the minified JSON, along with the time spent in each stage of the codec. Results
+are written as JSON, and can be compared with an earlier run to flag regressions. Run with
+``python -m bench.corpus DIR [-o results.json] [--baseline old.json]``. With ``--profile``,
+the time taken to prime a Compressor with the profile's dictionary is measured as well.
+Primed Compressors can't be copied, so every file encoded with the profile pays it.
+"""
+import os
+import sys
+import gzip
+import json
+import glob
+import timeit
+import argparse
+import platform
+import tracemalloc
+import brotli
+from io import BytesIO
+from bonsai import format
+from bonsai.profile import Profile
+from bonsai.codec.decoder import GraphDecoder
+from bonsai.codec.encoder import GraphEncoder
+from bonsai.stats import count_nodes
+from bonsai.stringsection import StringSection
+from bonsai.specs import shift_es5
+
+ENCODE_STAGES = ('parse', 'graphify', 'codebooks', 'bitstream', 'strings')
+DECODE_STAGES = ('strings', 'codebooks', 'bitstream')
+
+# metrics compared against a baseline, and whether higher values are better
+METRICS = {
+    'encode_mb_s': True,
+    'decode_mb_s': True,
+    'encode_peak_bytes': False,
+    'decode_peak_bytes': False,
+    'bonsai_bytes': False,
+}
+
+
+def best(fn, repeat):
+    return min(timeit.repeat(fn, number=1, repeat=repeat))
+
+
+def encode_stages(text, repeat):
+    """Times the stages of encoding a plain file, the same way as ``format.encode``."""
+    times = dict.fromkeys(ENCODE_STAGES, float('inf'))
+    for _ in range(repeat):
+        start = timeit.default_timer()
+        ast = json.loads(text, parse_int=str, parse_float=str)
+        t1 = timeit.default_timer()
+        e = GraphEncoder(shift_es5, ast, BytesIO())
+        type_stats = e.build_graph()
+        t2 = timeit.default_timer()
+        e.write_header(type_stats)
+        t3 = timeit.default_timer()
+        string_table = e.encode_node(shift_es5.root_type, e.nodes[-1])
+        t4 = timeit.default_timer()
+        format.compress_section(b'\0'.join(x.encode('utf-8') for x in string_table))
+        t5 = timeit.default_timer()
+
+        for stage, elapsed in zip(ENCODE_STAGES, (t1 - start, t2 - t1, t3 - t2, t4 - t3, t5 - t4)):
+            times[stage] = min(times[stage], elapsed)
+    return times
+
+
+def decode_stages(data, repeat):
+    """Times the stages of decoding a plain file, the same way as ``format.decode``."""
+    times = dict.fromkeys(DECODE_STAGES, float('inf'))
+    for _ in range(repeat):
+        view = memoryview(data)
+        start = timeit.default_timer()
+        header = format.read_header(view)
+        strings = header.section(format.SECTION_STRINGS)
+        string_table = StringSection(format.decompress_section(view[strings.offset:strings.end]))
+        t1 = timeit.default_timer()
+        graph = header.section(format.SECTION_GRAPH)
+        d = GraphDecoder(view[graph.offset:graph.end], shift_es5, string_table)
+        d.read_header()
+        t2 = timeit.default_timer()
+        d.decode_node(shift_es5.root_type)
+        t3 = timeit.default_timer()
+
+        for stage, elapsed in zip(DECODE_STAGES, (t1 - start, t2 - t1, t3 - t2)):
+            times[stage] = min(times[stage], elapsed)
+    return times
+
+
+def peak_memory(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def bench_file(path, repeat):
+    with open(path, 'rb') as fp:
+        text = fp.read().decode('utf-8')
+    ast = json.loads(text, parse_int=str, parse_float=str)
+    minified = json.dumps(ast, separators=(',', ':')).encode('utf-8')
+
+    def encode():
+        with BytesIO() as buf:
+            format.encode(shift_es5, json.loads(text, parse_int=str, parse_float=str), buf)
+            return buf.getvalue()
+
+    data = encode()
+
+    def decode():
+        format.decode(shift_es5, BytesIO(data))
+
+    # parsing is timed as a stage of its own, so it's left out of the encode time
+    encode_time = best(encode, repeat) - best(lambda: json.loads(text, parse_int=str, parse_float=str),
+                                              repeat)
+
+    return {
+        'path': path,
+        'input_bytes': len(minified),
+        'nodes': count_nodes(ast),
+        'bonsai_bytes': len(data),
+        'brotli_bytes': len(brotli.compress(minified)),
+        'gzip_bytes': len(gzip.compress(minified, 9)),
+        'encode_seconds': encode_time,
+        'decode_seconds': best(decode, repeat),
+        'encode_peak_bytes': peak_memory(encode),
+        'decode_peak_bytes': peak_memory(decode),
+        'encode_stages': encode_stages(text, repeat),
+        'decode_stages': decode_stages(data, repeat),
+    }
+
+
+def summarize(files):
+    total = {k: sum(f[k] for f in files)
+             for k in ('input_bytes', 'nodes', 'bonsai_bytes', 'brotli_bytes', 'gzip_bytes',
+                       'encode_seconds', 'decode_seconds')}
+    for mode in ('encode', 'decode'):
+        seconds = total[f'{mode}_seconds']
+        total[f'{mode}_mb_s'] = total['input_bytes'] / seconds / 1e6 if seconds else 0.0
+        total[f'{mode}_nodes_s'] = total['nodes'] / seconds if seconds else 0.0
+        total[f'{mode}_peak_bytes'] = max((f[f'{mode}_peak_bytes'] for f in files), default=0)
+        stages = ENCODE_STAGES if mode == 'encode' else DECODE_STAGES
+        total[f'{mode}_stages'] = {k: sum(f[f'{mode}_stages'][k] for f in files) for k in stages}
+    for name in ('bonsai', 'brotli', 'gzip'):
+        size = total[f'{name}_bytes']
+        total[f'{name}_ratio'] = size / total['input_bytes'] if total['input_bytes'] else 0.0
+    return total
+
+
+def compare(results, baseline, tolerance):
+    """Returns a description of each metric that got worse than the baseline by more than ``tolerance``."""
+    regressions = []
+    for metric, higher_is_better in METRICS.items():
+        old, new = baseline['total'].get(metric), results['total'][metric]
+        if not old:
+            continue
+        change = (new - old) / old
+        if (-change if higher_is_better else change) > tolerance:
+            regressions.append(f'{metric}: {old:,.2f} -> {new:,.2f} ({change:+.1%})')
+    return regressions
+
+
+def run(corpus, repeat=3, profile=None):
+    """
+    :param profile: A Profile to measure the priming of its dictionary with, which every
+                    file encoded with it pays for.
+    """
+    paths = sorted(glob.glob(os.path.join(corpus, '**', '*.json'), recursive=True))
+    files = [bench_file(path, repeat) for path in paths]
+    results = {
+        'corpus': corpus,
+        'python': platform.python_version(),
+        'repeat': repeat,
+        'total': summarize(files),
+        'files': files,
+    }
+    if profile is not None:
+        priming = best(profile.compressor, repeat)
+        results['total']['profile_priming_seconds'] = priming
+        results['total']['profile_priming_total_seconds'] = priming * len(files)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m bench.corpus', description=__doc__.strip().split('\n')[0])
+    parser.add_argument('corpus', help='Directory of Shift JSON ASTs.')
+    parser.add_argument('--output', '-o', help='Where to write the results as JSON.')
+    parser.add_argument('--baseline', help='Results of an earlier run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='Relative change in a metric that counts as a regression.')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per timing, the best is kept.')
+    parser.add_argument('--profile', help='A profile to measure the priming of.')
+    args = parser.parse_args(argv)
+
+    profile = None
+    if args.profile:
+        with open(args.profile, 'rb') as fp:
+            profile = Profile.loads(fp.read())
+
+    results = run(args.corpus, args.repeat, profile)
+    total = results['total']
+    print(f"{len(results['files'])} files, {total['input_bytes']:,} bytes, {total['nodes']:,} nodes")
+    for name in ('bonsai', 'brotli', 'gzip'):
+        print(f"{name:>7}: {total[f'{name}_bytes']:10,} bytes ({total[f'{name}_ratio']:.1%})")
+    for mode in ('encode', 'decode'):
+        stages = ', '.join(f'{k} {v * 1000:.1f}ms' for k, v in total[f'{mode}_stages'].items())
+        print(f"{mode}: {total[f'{mode}_mb_s']:.2f} MB/s, {total[f'{mode}_nodes_s']:,.0f} nodes/s, "
+              f"peak {total[f'{mode}_peak_bytes']:,} bytes ({stages})")
+    if profile is not None:
+        print(f"profile priming: {total['profile_priming_seconds'] * 1000:.2f}ms per file, "
+              f"{total['profile_priming_total_seconds']:.2f}s over the corpus "
+              f"({len(profile.dictionary):,} byte dictionary, paid by every encoded file)")
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=1)
+
+    if args.baseline:
+        with open(args.baseline) as fp:
+            regressions = compare(results, json.load(fp), args.tolerance)
+        for line in regressions:
+            print(f'regression: {line}')
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
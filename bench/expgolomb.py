@@ -0,0 +1,88 @@
+"""
+Micro-benchmark for exponential-Golomb coding.
+
+Compares the current ``BitsIOBase`` ue/se codecs against the original
+prefix-search loop and recursive writer. Run with ``python -m bench.expgolomb``.
+"""
+import random
+import itertools
+import timeit
+from io import BytesIO
+from bonsai.bits import BitsIO, BitsReader
+
+
+class LegacyMixin:
+    """The original implementations, kept here for comparison."""
+
+    __slots__ = ()
+
+    def write_ue(self, value, order=0):
+        if order:
+            q = value >> order
+            r = value & (1 << order) - 1
+            self.write_ue(q, 0)
+            self.write_uint(r, order)
+        else:
+            bits = (value + 1).bit_length() * 2 - 1
+            self.write_uint(value + 1, bits)
+
+    def read_ue(self, order=0):
+        if order:
+            q = self.read_ue(0)
+            r = self.read_uint(order)
+            return (q << order) | r
+        else:
+            for x in itertools.count():
+                bits = 1 << x
+                last = self.read_uint(bits)
+                if last:
+                    to_get = 2 * (bits - last.bit_length())
+                    break
+            return ((last << to_get) | self.read_uint(to_get)) - 1
+
+
+class LegacyBitsIO(LegacyMixin, BitsIO):
+    __slots__ = ()
+
+
+class LegacyBitsReader(LegacyMixin, BitsReader):
+    __slots__ = ()
+
+
+def sample_values(count=100000, seed=0):
+    # MTF ranks are mostly small with a long tail
+    rng = random.Random(seed)
+    return [int(rng.expovariate(0.05)) for _ in range(count)]
+
+
+def bench(writer_cls, reader_cls, values, order, repeat):
+    def write():
+        bio = writer_cls(BytesIO())
+        for v in values:
+            bio.write_ue(v, order)
+        bio.flush()
+        return bio.fp.getvalue()
+
+    data = write()
+
+    def read():
+        reader = reader_cls(data)
+        for _ in values:
+            reader.read_ue(order)
+
+    return min(timeit.repeat(write, number=1, repeat=repeat)), \
+        min(timeit.repeat(read, number=1, repeat=repeat))
+
+
+def main(repeat=5):
+    values = sample_values()
+    for order in (0, 2):
+        legacy = bench(LegacyBitsIO, LegacyBitsReader, values, order, repeat)
+        current = bench(BitsIO, BitsReader, values, order, repeat)
+        for name, old, new in zip(('write_ue', 'read_ue'), legacy, current):
+            print(f'{name}(order={order}): {old * 1000:8.2f}ms -> {new * 1000:8.2f}ms '
+                  f'({old / new:.2f}x)')
+
+
+if __name__ == '__main__':
+    main()
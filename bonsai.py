@@ -1,9 +1,12 @@
+import io
+import os
 import json
 import click
 import logging
 from time import perf_counter
 from importlib import import_module
-from bonsai import format
+from bonsai import batch as batch_mode, format, profile as profiles, stats as bit_stats
+from bonsai.jsonevents import iter_events
 
 logger = logging.getLogger(__name__)
 
@@ -12,22 +15,44 @@ logger = logging.getLogger(__name__)
 @click.pass_context
 @click.option('--verbose', '-v', count=True)
 @click.option('--spec', default='shift_es5')
-def cli(ctx, verbose, spec):
+@click.option('--codegen/--no-codegen', default=True, help='Use routines generated for the spec.')
+def cli(ctx, verbose, spec, codegen):
     levels = (logging.INFO, logging.DEBUG)
     logging.basicConfig(format='[{levelname}][{name}] {message}',
                         style='{', level=levels[verbose - 1])
     ctx.obj['SPEC'] = import_module(f'bonsai.specs.{spec}')  # wat
+    ctx.obj['SPEC_NAME'] = spec
+    ctx.obj['CODEGEN'] = codegen
 
 
 @cli.command()
 @click.pass_context
 @click.argument('input', type=click.File('rb'))
 @click.argument('output', type=click.File('wb'))
-def encode(ctx, input, output):
+@click.option('--stream', is_flag=True, help='Parse the input incrementally to save memory.')
+@click.option('--segments', type=click.IntRange(min=1), help='Split top-level statements into independent segments.')
+@click.option('--jobs', '-j', type=int, help='Number of processes to encode segments with.')
+@click.option('--lazy', is_flag=True, help='Code function bodies as blobs that can be decoded on demand.')
+@click.option('--string-refs', is_flag=True, help='Store each distinct string once.')
+@click.option('--profile', type=click.Path(dir_okay=False, exists=True), help='Code with a trained profile.')
+@click.option('--tans', is_flag=True, help='Use table ANS rather than Huffman codes.')
+@click.option('--pipeline', is_flag=True, help='Compress strings in a thread while encoding the graph.')
+def encode(ctx, input, output, stream, segments, jobs, lazy, string_refs, profile, tans, pipeline):
     spec = ctx.obj['SPEC']
-    ast = json.load(input, parse_int=str, parse_float=str)
-    start = perf_counter()
-    format.encode(spec, ast, output)
+    if profile:
+        profile = profiles.load(profile)
+    if stream:
+        events = iter_events(io.TextIOWrapper(input, encoding='utf-8'))
+        start = perf_counter()
+        format.encode_events(spec, events, output, codegen=ctx.obj['CODEGEN'], segments=segments,
+                             jobs=jobs, lazy=lazy, string_refs=string_refs, profile=profile, tans=tans,
+                             pipeline=pipeline)
+    else:
+        ast = json.load(input, parse_int=str, parse_float=str)
+        start = perf_counter()
+        format.encode(spec, ast, output, codegen=ctx.obj['CODEGEN'], segments=segments,
+                      jobs=jobs, lazy=lazy, string_refs=string_refs, profile=profile, tans=tans,
+                      pipeline=pipeline)
     logger.info(f'Encoded in {(perf_counter() - start) * 1000:.2f}ms')
 
 
@@ -35,13 +60,125 @@ def encode(ctx, input, output):
 @click.pass_context
 @click.argument('input', type=click.File('rb'))
 @click.argument('output', type=click.File('w'))
-def decode(ctx, input, output):
+@click.option('--jobs', '-j', type=int, help='Number of processes to decode segments with.')
+@click.option('--profile-dir', type=click.Path(file_okay=False), help='Directory to find profiles in.')
+@click.option('--pipeline', is_flag=True, help='Decompress strings in a thread while decoding the graph.')
+def decode(ctx, input, output, jobs, profile_dir, pipeline):
     spec = ctx.obj['SPEC']
     start = perf_counter()
-    ast = format.decode(spec, input)
+    with format.map_file(input) as data:
+        ast = format.decode(spec, data, codegen=ctx.obj['CODEGEN'], jobs=jobs, profile_dir=profile_dir,
+                            pipeline=pipeline)
     logger.info(f'Decoded in {(perf_counter() - start) * 1000:.2f}ms')
     json.dump(ast, output, separators=(',', ':'))
 
 
+@cli.command()
+@click.argument('input', type=click.File('rb'))
+def info(input):
+    """Shows the header and sections of an encoded file, without decoding it."""
+    with format.map_file(input) as data:
+        header = format.read_header(data)
+
+    flags = [name for flag, name in format.FLAG_NAMES.items() if header.flags & flag]
+    click.echo(f'Version: {header.version}')
+    click.echo(f'Spec:    {header.spec_name or "unknown"}')
+    click.echo(f'Flags:   {", ".join(flags) or "none"}')
+    if header.profile_id is not None:
+        click.echo(f'Profile: {header.profile_id:08x}')
+
+    click.echo('\nSections:')
+    for section in header.sections:
+        name = format.SECTION_NAMES.get(section.kind, f'unknown ({section.kind})')
+        click.echo(f'{name:<10} at {section.offset:10,} {section.length:10,} bytes '
+                   f'{section.size:10,} bytes uncompressed')
+
+
+@cli.command()
+@click.pass_context
+@click.argument('mode', type=click.Choice(['encode', 'decode']))
+@click.argument('inputs', nargs=-1, required=True)
+@click.option('--output-dir', '-o', required=True, type=click.Path(file_okay=False))
+@click.option('--jobs', '-j', type=int, help='Number of worker processes.')
+@click.option('--force', '-f', is_flag=True, help="Process files even if they're up to date.")
+@click.option('--profile', type=click.Path(dir_okay=False, exists=True), help='Encode with a trained profile.')
+@click.option('--profile-dir', type=click.Path(file_okay=False), help='Directory to find profiles in.')
+def batch(ctx, mode, inputs, output_dir, jobs, force, profile, profile_dir):
+    try:
+        pairs = batch_mode.collect(inputs, output_dir, mode)
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    result = batch_mode.run(mode, pairs, ctx.obj['SPEC_NAME'], codegen=ctx.obj['CODEGEN'],
+                            jobs=jobs, force=force, profile=profile, profile_dir=profile_dir)
+
+    click.echo(f'{result.files} processed, {result.skipped} up to date, {result.failed} failed')
+    if result.files:
+        click.echo(f'{result.input_size:,} -> {result.output_size:,} bytes ({result.ratio:.1%})')
+        click.echo(f'{result.elapsed:.2f}s, {result.throughput / 1e6:.2f} MB/s')
+    if result.failed:
+        ctx.exit(1)
+
+
+@cli.command()
+@click.pass_context
+@click.argument('inputs', nargs=-1, required=True)
+@click.option('--output-dir', '-o', default='.', type=click.Path(file_okay=False))
+@click.option('--dictionary-size', default=profiles.DICTIONARY_SIZE, help='Maximum size of the string dictionary.')
+def train(ctx, inputs, output_dir, dictionary_size):
+    asts = []
+    for path in dict.fromkeys(path for path, _ in batch_mode.expand(inputs, '.json')):
+        with open(path, 'rb') as fp:
+            asts.append(json.load(fp, parse_int=str, parse_float=str))
+
+    start = perf_counter()
+    profile = profiles.train(ctx.obj['SPEC'], asts, dictionary_size)
+    logger.info(f'Trained in {(perf_counter() - start) * 1000:.2f}ms')
+
+    os.makedirs(output_dir, exist_ok=True)
+    click.echo(f'Profile {profile.id:08x} trained on {len(asts)} files: {profile.save(output_dir)}')
+
+
+@cli.command()
+@click.pass_context
+@click.argument('input', type=click.File('rb'))
+@click.option('--string-refs', is_flag=True, help='Code string fields as references.')
+@click.option('--top', default=15, help='Number of node types and fields to list.')
+def stats(ctx, input, string_refs, top):
+    ast = json.load(input, parse_int=str, parse_float=str)
+    result = bit_stats.collect(ctx.obj['SPEC'], ast, string_refs=string_refs)
+    total = result.total
+
+    def row(name, bits):
+        click.echo(f'{name:<40} {bits:10,} bits {bits / total:7.1%}')
+
+    click.echo(f'Nodes: {result.ast_nodes:,} in the AST, {result.graph_nodes:,} after '
+               f'dedup ({result.dedup_ratio:.1%})')
+    click.echo(f'Total: {total:,} bits ({total // 8:,} bytes)')
+
+    click.echo('\nBy category:')
+    for category, bits in result.by_category().items():
+        row(category, bits)
+
+    click.echo('\nBy node type:')
+    for type_name, bits in result.by_node_type().most_common(top):
+        row(type_name, bits)
+
+    click.echo('\nBy field:')
+    fields = result.by_field()
+    for field, categories in sorted(fields.items(), key=lambda x: -sum(x[1].values()))[:top]:
+        name = '.'.join(filter(None, field))
+        breakdown = ', '.join(f'{k} {v:,}' for k, v in categories.most_common())
+        row(name, sum(categories.values()))
+        click.echo(f'    {breakdown}')
+
+    click.echo('\nBack-references:')
+    refs = sorted(result.refs.items(), key=lambda x: -sum(x[1]))[:top]
+    for field, (hits, misses, nulls) in refs:
+        backref_bits = fields[field]['backref']
+        per_hit = backref_bits / hits if hits else 0.0
+        click.echo(f'{".".join(field):<40} {hits:7,} hits {misses:7,} misses {nulls:7,} nulls '
+                   f'{hits / (hits + misses or 1):7.1%} hit rate {per_hit:6.2f} bits/hit')
+
+
 if __name__ == '__main__':
     cli(obj={})
@@ -0,0 +1,364 @@
+"""
+Table ANS (tANS) coding, an alternative to canonical Huffman codes.
+
+All TableCodes used in a stream share one state in ``[0, 1 << TABLE_LOG)``. Decoding a
+symbol is a single table lookup, which gives the symbol along with the number of bits to
+read into the next state. Unlike Huffman codes, symbols can cost a fraction of a bit, which
+pays off for skewed distributions.
+
+ANS decodes in the reverse order of encoding. So an ANSWriter records the symbols and raw
+bits written to it, and codes them back to front once the stream is finished. Raw bits are
+passed through unchanged, so they can be mixed freely with symbols.
+"""
+import math
+from collections import Counter
+from itertools import repeat
+from operator import itemgetter
+from io import UnsupportedOperation
+from bonsai.bits import BitsIOBase, BitsReader
+from bonsai.entropy import SymbolCode
+
+# the number of bits of the state, which bounds the precision of symbol frequencies
+TABLE_LOG = 9
+
+# the states of the table in the order they're handed out to symbols, stepping through it
+# with a stride coprime to its size so each symbol's states are scattered across it
+_STEP = (1 << TABLE_LOG - 1) + (1 << TABLE_LOG - 3) + 3
+_SPREAD = [i * _STEP & (1 << TABLE_LOG) - 1 for i in range(1 << TABLE_LOG)]
+
+# the bits read and the base of the next state, for each state number of a symbol
+_BITS = [TABLE_LOG + 1 - x.bit_length() for x in range(2 << TABLE_LOG)]
+_BASES = [(x << bits) - (1 << TABLE_LOG) for x, bits in enumerate(_BITS)]
+
+
+def _normalize(counts, log):
+    """Scales frequency counts so they sum to ``1 << log``, keeping every symbol above zero."""
+    total = sum(counts.values())
+    size = 1 << log
+    freqs = {s: max(1, (2 * c * size + total) // (2 * total)) for s, c in counts.items()}
+
+    diff = size - sum(freqs.values())
+    while diff:
+        # rounding errors matter least to the most frequent symbol
+        s = max(freqs, key=freqs.get)
+        step = max(diff, 1 - freqs[s])
+        freqs[s] += step
+        diff -= step
+    return freqs
+
+
+def _cost(counts, freqs, log):
+    """Estimates the bits of a codebook and of the symbols coded with it."""
+    codebook = 4 + sum(2 * (f + 1).bit_length() - 1 for f in freqs.values())
+    return codebook + sum(c * (log - math.log2(freqs[s])) for s, c in counts.items())
+
+
+class TableCode(SymbolCode):
+    """A table ANS encoder/decoder."""
+
+    __slots__ = ('symbols', 'log', 'freqs', 'encode_map', 'encode_table', 'decode_table')
+
+    def __init__(self, symbols, freqs):
+        """
+        :param symbols: A sequence of symbols, in the order they're spread over the states.
+        :param freqs: A sequence of frequencies of the symbols, which sum to a power of two
+                      no greater than ``1 << TABLE_LOG``.
+        """
+        if not symbols:
+            raise ValueError('One or more symbols required')
+
+        if len(symbols) != len(freqs) or min(freqs) < 1:
+            raise ValueError('Symbol/frequency mismatch')
+
+        total = sum(freqs)
+        if total & total - 1 or total > 1 << TABLE_LOG:
+            raise ValueError('Frequencies must sum to a power of two')
+
+        self.symbols = symbols
+        self.log = total.bit_length() - 1
+        self.freqs = freqs
+        self.encode_map = None
+        self.encode_table = None
+        self.decode_table = None
+
+    def _spread(self):
+        """
+        Returns the states of each symbol in ascending order. The number of states is the
+        symbol's frequency scaled to the full table.
+        """
+        shift = TABLE_LOG - self.log
+        spread = []
+        start = 0
+        for freq in self.freqs:
+            end = start + (freq << shift)
+            spread.append(sorted(_SPREAD[start:end]))
+            start = end
+        return spread
+
+    def _build_encode_tables(self):
+        """
+        Prepares a mapping of symbols to ``(delta_bits, delta_state)`` along with the table
+        of next states. Coding a symbol in state ``x`` outputs the low
+        ``(x + delta_bits) >> 16`` bits of the state, and the rest of the state plus
+        ``delta_state`` is the index of the next state.
+        """
+        size = 1 << TABLE_LOG
+        encode_map = {}
+        table = []
+        for symbol, states in zip(self.symbols, self._spread()):
+            freq = len(states)
+            max_bits = TABLE_LOG - max((freq - 1).bit_length() - 1, 0)
+            encode_map[symbol] = ((max_bits << 16) - (freq << max_bits), len(table) - freq)
+            table.extend(map(size.__add__, states))
+        return encode_map, table
+
+    def _build_decode_table(self):
+        """
+        Prepares a table of ``(symbol, bits, base)`` entries, indexed by state. The states of
+        a symbol with frequency ``f`` are numbered from ``f`` to ``2f - 1`` in order, and
+        each is scaled back up to the full table by the bits that are read.
+        """
+        entries = []
+        for symbol, states in zip(self.symbols, self._spread()):
+            freq = len(states)
+            entries.extend(zip(states, zip(repeat(symbol), _BITS[freq:2 * freq],
+                                           _BASES[freq:2 * freq])))
+        entries.sort(key=itemgetter(0))
+        return list(map(itemgetter(1), entries))
+
+    @classmethod
+    def from_counts(cls, counts, alphabet=None):
+        """
+        Returns an instance from a mapping of symbols to frequency counts, picking the
+        precision of the frequencies that codes them in the fewest bits.
+        :param counts: A mapping of symbols to frequency counts.
+        :param alphabet: The sequence the codebook will be written with. Symbols are
+                         spread in its order, which is the order they're read back in.
+        :rtype: TableCode
+        """
+        min_log = (len(counts) - 1).bit_length()
+        max_log = max(min_log, min(TABLE_LOG, (sum(counts.values()) - 1).bit_length()))
+        best = min((_normalize(counts, log) for log in range(min_log, max_log + 1)),
+                   key=lambda freqs: _cost(counts, freqs, sum(freqs.values()).bit_length() - 1))
+
+        symbols = [x for x in alphabet if x in best] if alphabet is not None else list(best)
+        return cls(symbols, [best[x] for x in symbols])
+
+    def write_symbol(self, symbol, writer):
+        """
+        Writes a symbol to the bitstream.
+        :param symbol: The symbol to write.
+        :param writer: The ANSWriter to write the symbol to.
+        """
+        writer.write_symbol(self, symbol)
+
+    def read_symbol(self, reader):
+        """
+        Reads a symbol from the bitstream.
+        :param reader: The ANSReader to read the symbol from.
+        :return: A symbol.
+        """
+        if self.decode_table is None:
+            self.decode_table = self._build_decode_table()
+
+        symbol, bits, base = self.decode_table[reader.state]
+        reader.state = base + reader.read_uint(bits)
+        return symbol
+
+    def cost(self, counts):
+        return sum(counts.get(s, 0) * (self.log - math.log2(f))
+                   for s, f in zip(self.symbols, self.freqs))
+
+    def write_codebook(self, alphabet, writer):
+        """
+        Serializes the codebook to the stream, as the precision of the frequencies followed
+        by the frequency of each symbol of the alphabet, up to the last one in the code.
+        :param alphabet: A known sequence containing the symbols in the code, in the order
+                         given to from_counts().
+        :param writer: The stream to write the codebook to.
+        """
+        writer.write_uint(self.log, 4)
+        freqs = dict(zip(self.symbols, self.freqs))
+        remaining = 1 << self.log
+        alphabet = list(alphabet)
+        for i, symbol in enumerate(alphabet):
+            if not remaining:
+                break
+            freq = freqs.get(symbol, 0)
+            if i < len(alphabet) - 1:
+                writer.write_ue(freq)
+            remaining -= freq
+
+    @classmethod
+    def read_from_codebook(cls, reader, alphabet):
+        """
+        Reads a table ANS codebook from the stream.
+        :param reader: The stream to read the codebook from.
+        :param alphabet: A known sequence from which symbols will be taken.
+        :rtype: TableCode
+        """
+        remaining = 1 << reader.read_uint(4)
+        alphabet = list(alphabet)
+        symbols = []
+        freqs = []
+        for i, symbol in enumerate(alphabet):
+            if not remaining:
+                break
+            freq = reader.read_ue() if i < len(alphabet) - 1 else remaining
+            if freq:
+                symbols.append(symbol)
+                freqs.append(freq)
+            remaining -= freq
+        return cls(symbols, freqs)
+
+
+class DeferredCode:
+    """
+    Stands in for a TableCode of the symbols written with it, which can only be built once
+    they're all known. Since an ANSWriter codes symbols when it's finished, the code just
+    needs to be set by then.
+    """
+
+    __slots__ = ('counts', 'code')
+
+    def __init__(self):
+        self.counts = Counter()
+        self.code = None
+
+    def write_symbol(self, symbol, writer):
+        self.counts[symbol] += 1
+        writer.write_symbol(self, symbol)
+
+
+class ANSWriter(BitsIOBase):
+    """
+    Records symbols and raw bits for a single ANS stream, which is coded to another
+    bitstream by finish().
+    """
+
+    __slots__ = ('ops', 'acc', 'acc_bits', 'captures')
+
+    def __init__(self):
+        # raw bits as (value, bits), symbols as (code, symbol) and captures as (ops, fields)
+        self.ops = []
+        self.acc = 0
+        self.acc_bits = 0
+        self.captures = []
+
+    def _flush_bits(self):
+        if self.acc_bits:
+            self.ops.append((self.acc, self.acc_bits))
+            self.acc = self.acc_bits = 0
+
+    def begin_capture(self):
+        """Starts a nested ANS stream, until the matching end_capture()."""
+        self._flush_bits()
+        self.captures.append(self.ops)
+        self.ops = []
+
+    def end_capture(self, *fields):
+        """
+        Ends the innermost capture. Once finished, it's written as its length in bits and
+        ``fields`` as exp-Golomb codes, followed by its stream.
+        """
+        self._flush_bits()
+        ops, self.ops = self.ops, self.captures.pop()
+        self.ops.append((ops, fields))
+
+    def seek(self, pos):
+        raise UnsupportedOperation('ANSWriter is write-only')
+
+    def tell(self):
+        raise UnsupportedOperation('ANSWriter is write-only')
+
+    def flush(self):
+        pass
+
+    def write_uint(self, value, bits):
+        acc = self.acc << bits | value & (1 << bits) - 1
+        acc_bits = self.acc_bits + bits
+        if acc_bits >= 64:
+            self.ops.append((acc, acc_bits))
+            acc = acc_bits = 0
+        self.acc = acc
+        self.acc_bits = acc_bits
+
+    def write_symbol(self, code, symbol):
+        """Writes a symbol with a TableCode or DeferredCode."""
+        self._flush_bits()
+        self.ops.append((code, symbol))
+
+    def read_uint(self, bits):
+        raise UnsupportedOperation('ANSWriter is write-only')
+
+    def peek(self, bits):
+        raise UnsupportedOperation('ANSWriter is write-only')
+
+    def finish(self, writer):
+        """
+        Codes the recorded stream to a bitstream, as the final state followed by the bits
+        in the order they're read.
+        :param writer: A BitsIO.
+        """
+        self._flush_bits()
+        _finish(self.ops, writer)
+
+
+def _finish(ops, writer):
+    size = 1 << TABLE_LOG
+    # captures are finished before the stream enclosing them resumes, without recursing.
+    # Frames hold [ops, index of the next op, state, output, fields of the capture]
+    stack = [[ops, len(ops), size, [], ()]]
+    while stack:
+        frame = stack[-1]
+        ops, i, state, out, _ = frame
+        while i:
+            i -= 1
+            head, tail = ops[i]
+            if type(head) is int:
+                out.append((head, tail))
+            elif type(head) is list:
+                writer.begin_capture()
+                frame[1], frame[2] = i, state
+                stack.append([head, len(head), size, [], tail])
+                break
+            else:
+                code = head.code if type(head) is DeferredCode else head
+                if code.encode_map is None:
+                    code.encode_map, code.encode_table = code._build_encode_tables()
+                delta_bits, delta_state = code.encode_map[tail]
+                bits = (state + delta_bits) >> 16
+                out.append((state, bits))
+                state = code.encode_table[(state >> bits) + delta_state]
+        else:
+            writer.write_uint(state - size, TABLE_LOG)
+            for value, bits in reversed(out):
+                writer.write_uint(value, bits)
+            fields = stack.pop()[4]
+            if stack:
+                value, bits = writer.end_capture()
+                out = stack[-1][3]
+                out.append((value, bits))
+                for x in reversed((bits, *fields)):
+                    x += 1
+                    out.append((x, 2 * x.bit_length() - 1))
+
+
+class ANSReader(BitsReader):
+    """Reads a bitstream holding ANS streams, keeping the state of the current one."""
+
+    __slots__ = ('state', 'states')
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.state = None
+        self.states = []
+
+    def begin(self):
+        """Starts reading an ANS stream at the current position, until the matching end()."""
+        self.states.append(self.state)
+        self.state = self.read_uint(TABLE_LOG)
+
+    def end(self):
+        """Resumes the enclosing ANS stream."""
+        self.state = self.states.pop()
@@ -0,0 +1,173 @@
+"""
+Encodes or decodes many files at once on a process pool.
+
+Each worker imports the spec and loads the profile once, so per-file costs are limited to
+the codec itself, including priming a brotli Compressor with the profile's dictionary.
+"""
+import os
+import glob
+import json
+import logging
+from time import perf_counter
+from importlib import import_module
+from concurrent.futures import ProcessPoolExecutor
+from bonsai import format, profile as profiles
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = {'encode': ('.json', '.bonsai'), 'decode': ('.bonsai', '.json')}
+
+# per-worker state, set up by _init_worker
+_spec = None
+_codegen = True
+_profile = None
+_profile_dir = None
+
+
+class BatchResult:
+    __slots__ = ('files', 'skipped', 'failed', 'input_size', 'output_size', 'elapsed')
+
+    def __init__(self):
+        self.files = 0
+        self.skipped = 0
+        self.failed = 0
+        self.input_size = 0
+        self.output_size = 0
+        self.elapsed = 0.0
+
+    @property
+    def ratio(self):
+        return self.output_size / self.input_size if self.input_size else 0.0
+
+    @property
+    def throughput(self):
+        """Input bytes processed per second."""
+        return self.input_size / self.elapsed if self.elapsed else 0.0
+
+
+def expand(inputs, ext):
+    """
+    Expands directories and glob patterns into the files they hold.
+    :param inputs: Paths to files or directories, or glob patterns.
+    :param ext: The extension of files to look for in directories.
+    :return: Pairs of a file's path and its path relative to the directory it was found
+             under, or its name if it was given directly.
+    """
+    for pattern in inputs:
+        for path in sorted(glob.glob(pattern, recursive=True)) or [pattern]:
+            if os.path.isdir(path):
+                for found in sorted(glob.glob(os.path.join(path, '**', '*' + ext), recursive=True)):
+                    yield found, os.path.relpath(found, path)
+            elif os.path.isfile(path):
+                yield path, os.path.basename(path)
+            else:
+                logger.warning(f'No such file or directory: {path}')
+
+
+def collect(inputs, output_dir, mode):
+    """
+    Expands directories and glob patterns into pairs of input and output paths.
+
+    Files found under a directory keep their relative path below ``output_dir``; other
+    files are written directly into it.
+    :param inputs: Paths to files or directories, or glob patterns.
+    :param output_dir: The directory to write outputs to.
+    :param mode: ``'encode'`` or ``'decode'``.
+    :raises ValueError: If two inputs would be written to the same output.
+    """
+    in_ext, out_ext = EXTENSIONS[mode]
+    pairs = {}
+    sources = {}
+    for path, rel in expand(inputs, in_ext):
+        base, ext = os.path.splitext(rel)
+        if ext == in_ext:
+            rel = base
+        dest = os.path.join(output_dir, rel + out_ext)
+        other = sources.setdefault(os.path.normcase(os.path.abspath(dest)), path)
+        if other != path:
+            raise ValueError(f'{other} and {path} would both be written to {dest}')
+        pairs[path] = dest
+
+    return list(pairs.items())
+
+
+def is_stale(src, dest):
+    """Returns whether ``dest`` is missing or older than ``src``."""
+    try:
+        return os.path.getmtime(dest) < os.path.getmtime(src)
+    except OSError:
+        return True
+
+
+def _init_worker(spec_name, codegen, profile_path, profile_dir):
+    global _spec, _codegen, _profile, _profile_dir
+    _spec = import_module(f'bonsai.specs.{spec_name}')
+    _codegen = codegen
+    _profile = profiles.load(profile_path) if profile_path else None
+    _profile_dir = profile_dir
+
+
+def _encode_file(src, dest):
+    with open(src, 'rb') as fp:
+        ast = json.load(fp, parse_int=str, parse_float=str)
+    with open(dest, 'wb') as fp:
+        format.encode(_spec, ast, fp, codegen=_codegen, profile=_profile)
+
+
+def _decode_file(src, dest):
+    with open(src, 'rb') as fp, format.map_file(fp) as data:
+        ast = format.decode(_spec, data, codegen=_codegen, profile_dir=_profile_dir)
+    with open(dest, 'w') as fp:
+        json.dump(ast, fp, separators=(',', ':'))
+
+
+def _process(mode, src, dest):
+    """Runs in a worker. Returns the input and output sizes, or an error message."""
+    # outputs are written next to their destination and only moved over it once complete,
+    # so a failure can't leave a partial output that is_stale() takes as up to date
+    partial = dest + '.part'
+    try:
+        os.makedirs(os.path.dirname(dest) or '.', exist_ok=True)
+        (_encode_file if mode == 'encode' else _decode_file)(src, partial)
+        os.replace(partial, dest)
+        return os.path.getsize(src), os.path.getsize(dest), None
+    except Exception as e:
+        if os.path.exists(partial):
+            os.remove(partial)
+        return 0, 0, f'{type(e).__name__}: {e}'
+
+
+def run(mode, pairs, spec_name, codegen=True, jobs=None, force=False, profile=None,
+        profile_dir=None):
+    """
+    Processes files on a pool of ``jobs`` worker processes.
+    :param mode: ``'encode'`` or ``'decode'``.
+    :param pairs: Input and output paths, as returned by collect().
+    :param spec_name: The name of a module in ``bonsai.specs``.
+    :param force: Process files even if their output is newer than their input.
+    :param profile: The path of a profile to encode files with.
+    :param profile_dir: The directory to find the profiles of decoded files in.
+    :rtype: BatchResult
+    """
+    result = BatchResult()
+    todo = [(src, dest) for src, dest in pairs if force or is_stale(src, dest)]
+    result.skipped = len(pairs) - len(todo)
+
+    start = perf_counter()
+    if todo:
+        with ProcessPoolExecutor(jobs, initializer=_init_worker,
+                                 initargs=(spec_name, codegen, profile, profile_dir)) as pool:
+            futures = [(src, pool.submit(_process, mode, src, dest)) for src, dest in todo]
+            for src, future in futures:
+                input_size, output_size, error = future.result()
+                if error:
+                    logger.error(f'{src}: {error}')
+                    result.failed += 1
+                else:
+                    logger.debug(f'{src}: {input_size:,} -> {output_size:,} bytes')
+                    result.files += 1
+                    result.input_size += input_size
+                    result.output_size += output_size
+    result.elapsed = perf_counter() - start
+
+    return result
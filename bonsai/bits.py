@@ -1,6 +1,5 @@
 import abc
-import itertools
-from io import BytesIO
+from io import BytesIO, UnsupportedOperation
 
 
 class BitsIOBase(abc.ABC):
@@ -26,6 +25,14 @@ class BitsIOBase(abc.ABC):
     def read_uint(self, bits):
         """Reads an unsigned integer of a given number of bits from the bitstream."""
 
+    @abc.abstractmethod
+    def peek(self, bits):
+        """Returns the next bits of the bitstream without advancing, padding with zeros past the end."""
+
+    def consume(self, bits):
+        """Advances the bitstream by a given number of bits."""
+        self.read_uint(bits)
+
     def write_bool(self, value):
         """Writes a boolean to the bitstream."""
         self.write_uint(int(value), 1)
@@ -36,30 +43,23 @@ class BitsIOBase(abc.ABC):
 
     def write_ue(self, value, order=0):
         """Writes an unsigned exponential-Golomb-coded integer of a given order to the bitstream."""
-        if order:
-            q = value >> order
-            r = value & (1 << order) - 1
-            self.write_ue(q, 0)
-            self.write_uint(r, order)
-        else:
-            bits = (value + 1).bit_length() * 2 - 1
-            self.write_uint(value + 1, bits)
+        # the prefix zeros, the stop bit and the suffix all come out of a single integer
+        value += 1 << order
+        self.write_uint(value, 2 * value.bit_length() - order - 1)
 
     def read_ue(self, order=0):
         """Reads an unsigned exponential-Golomb-coded integer of a given order from the bitstream."""
-        if order:
-            q = self.read_ue(0)
-            r = self.read_uint(order)
-            return (q << order) | r
-        else:
-            for x in itertools.count():
-                # read 1, 2, 4, 8... bits until we hit non-zero
-                bits = 1 << x
-                last = self.read_uint(bits)
-                if last:
-                    to_get = 2 * (bits - last.bit_length())
-                    break
-            return ((last << to_get) | self.read_uint(to_get)) - 1
+        zeros = 0
+        head = self.peek(32)
+        while not head:
+            # very long prefix, skip over it in steps
+            self.consume(32)
+            zeros += 32
+            head = self.peek(32)
+
+        # the prefix zeros don't change the value, so read them along with the rest
+        prefix_len = 32 - head.bit_length()
+        return self.read_uint(prefix_len + zeros + prefix_len + 1 + order) - (1 << order)
 
     def write_se(self, value, order=0):
         """Writes a signed exponential-Golomb-coded integer of a given order to the bitstream."""
@@ -73,15 +73,141 @@ class BitsIOBase(abc.ABC):
         return q + 1 if r else -q
 
 
+class BitsReader(BitsIOBase):
+    """
+    Reads a bitstream from an in-memory buffer.
+
+    Bits are served from an integer window that is refilled eight bytes at a time,
+    so any read of up to ``MAX_PEEK`` bits costs a constant number of operations.
+    """
+
+    __slots__ = ('data', 'byte_pos', 'window', 'window_bits', 'pad_bits')
+
+    # the window always holds at least this many bits after a refill
+    MAX_PEEK = 57
+
+    def __init__(self, data):
+        """
+        :param data: A bytes-like object, e.g. bytes or a memoryview.
+        """
+        self.data = data
+        self.byte_pos = 0
+        self.window = 0
+        self.window_bits = 0
+        self.pad_bits = 0
+
+    def _refill(self):
+        num_bytes = (64 - self.window_bits) >> 3
+        chunk = self.data[self.byte_pos:self.byte_pos + num_bytes]
+        self.byte_pos += num_bytes
+
+        if len(chunk) < num_bytes:
+            # past the end of the buffer, pretend it's followed by zeros
+            self.pad_bits += (num_bytes - len(chunk)) << 3
+            chunk = bytes(chunk).ljust(num_bytes, b'\0')
+
+        self.window = self.window << (num_bytes << 3) | int.from_bytes(chunk, 'big')
+        self.window_bits += num_bytes << 3
+
+    def seek(self, pos):
+        self.byte_pos = pos >> 3
+        self.window = self.window_bits = self.pad_bits = 0
+        if pos & 7:
+            self.consume(pos & 7)
+
+    def tell(self):
+        return (self.byte_pos << 3) - self.window_bits
+
+    def flush(self):
+        pass
+
+    def write_uint(self, value, bits):
+        raise UnsupportedOperation('BitsReader is read-only')
+
+    def read_uint(self, bits):
+        if bits > self.MAX_PEEK:
+            high = self.read_uint(bits - self.MAX_PEEK)
+            return high << self.MAX_PEEK | self.read_uint(self.MAX_PEEK)
+
+        if bits > self.window_bits:
+            self._refill()
+
+        window_bits = self.window_bits - bits
+        value = self.window >> window_bits
+        self.window &= (1 << window_bits) - 1
+        self.window_bits = window_bits
+
+        if window_bits < self.pad_bits:
+            raise EOFError('Read past the end of the bitstream')
+        return value
+
+    def peek(self, bits):
+        if bits > self.window_bits:
+            self._refill()
+        return self.window >> (self.window_bits - bits)
+
+    def consume(self, bits):
+        self.read_uint(bits)
+
+    def read_ue(self, order=0):
+        if self.window_bits < 32:
+            self._refill()
+
+        head = self.window >> (self.window_bits - 32)
+        if not head:
+            return super().read_ue(order)
+
+        prefix_len = 32 - head.bit_length()
+        return self.read_uint(2 * prefix_len + 1 + order) - (1 << order)
+
+
 class BitsIO(BitsIOBase):
-    __slots__ = ('fp', 'bit_pos', 'bit_buf')
+    __slots__ = ('fp', 'bit_pos', 'reader', 'read_base', 'acc', 'acc_bits', 'out', 'captures')
+
+    # buffered output is handed to the file once it grows past this many bytes
+    CHUNK_SIZE = 1 << 16
 
     def __init__(self, fp=None):
         if fp is None:
             fp = BytesIO()
         self.fp = fp
+
+        # read state: the rest of the file is loaded into a BitsReader on first read
         self.bit_pos = 0
-        self.bit_buf = None
+        self.reader = None
+        self.read_base = 0
+
+        # write state: pending bits are accumulated in an integer and moved to the
+        # output buffer in bulk
+        self.acc = 0
+        self.acc_bits = 0
+        self.out = bytearray()
+
+        # write states saved by begin_capture
+        self.captures = []
+
+    def begin_capture(self):
+        """Diverts written bits until the matching end_capture(). Captures may be nested."""
+        self.captures.append((self.acc, self.acc_bits, self.out))
+        self.acc = self.acc_bits = 0
+        self.out = bytearray()
+
+    def end_capture(self):
+        """
+        Ends the innermost capture and resumes writing where it began.
+        :return: The captured bits as an integer, and their number.
+        """
+        value = int.from_bytes(self.out, 'big') << self.acc_bits | self.acc
+        bits = (len(self.out) << 3) + self.acc_bits
+        self.acc, self.acc_bits, self.out = self.captures.pop()
+        return value, bits
+
+    def _get_reader(self):
+        if self.reader is None:
+            self.read_base = self.fp.tell()
+            self.reader = BitsReader(self.fp.read())
+            self.reader.seek(self.bit_pos)
+        return self.reader
 
     def seek(self, pos):
         self.flush()  # uh...
@@ -90,50 +216,49 @@ class BitsIO(BitsIOBase):
         self.bit_pos = bit
 
     def tell(self):
-        return (self.fp.tell() << 3) + self.bit_pos
+        if self.reader is not None:
+            return (self.read_base << 3) + self.reader.tell()
+        return ((self.fp.tell() + len(self.out)) << 3) + self.acc_bits + self.bit_pos
 
     def flush(self):
-        if self.bit_pos and self.fp.writable():
-            self.fp.write(bytes((self.bit_buf,)))
-        self.bit_buf = None
+        if self.acc_bits:
+            # pad the last partial byte with zeros
+            pad = -self.acc_bits & 7
+            self.out += (self.acc << pad).to_bytes((self.acc_bits + pad) >> 3, 'big')
+        if self.out:
+            self.fp.write(self.out)
+            self.out.clear()
+        self.acc = self.acc_bits = 0
+
+        if self.reader is not None:
+            # hand the file position back, rounded up to the next byte
+            self.fp.seek(self.read_base + (self.reader.tell() + 7 >> 3))
+            self.reader = None
         self.bit_pos = 0
 
     def write_uint(self, value, bits):
-        while bits:
-            if self.bit_buf is None:
-                self.bit_buf = 0
+        acc = self.acc << bits | value & (1 << bits) - 1
+        acc_bits = self.acc_bits + bits
 
-            to_put = min(8 - self.bit_pos, bits)
-            in_shift = bits - to_put
-            out_shift = 8 - to_put - self.bit_pos
-            mask = (1 << to_put) - 1
+        if acc_bits >= 64:
+            # move all whole bytes to the output buffer
+            rem = acc_bits & 7
+            self.out += (acc >> rem).to_bytes(acc_bits >> 3, 'big')
+            acc &= (1 << rem) - 1
+            acc_bits = rem
 
-            value_part = value >> in_shift & mask
-            self.bit_buf |= value_part << out_shift
+            if len(self.out) >= self.CHUNK_SIZE and not self.captures:
+                self.fp.write(self.out)
+                self.out.clear()
 
-            bits -= to_put
-            self.bit_pos += to_put
-            if self.bit_pos >= 8:
-                self.flush()
+        self.acc = acc
+        self.acc_bits = acc_bits
 
     def read_uint(self, bits):
-        if self.bit_buf is None:
-            self.bit_buf = ord(self.fp.read(1))
-
-        result = 0
-
-        while bits:
-            to_get = min(8 - self.bit_pos, bits)
-            shift = 8 - to_get - self.bit_pos
-            mask = (1 << to_get) - 1
-
-            result <<= to_get
-            result |= self.bit_buf >> shift & mask
+        return self._get_reader().read_uint(bits)
 
-            bits -= to_get
-            self.bit_pos += to_get
-            if self.bit_pos >= 8:
-                self.bit_buf = ord(self.fp.read(1))
-                self.bit_pos = 0
+    def peek(self, bits):
+        return self._get_reader().peek(bits)
 
-        return result
+    def consume(self, bits):
+        self._get_reader().consume(bits)
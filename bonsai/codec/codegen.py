@@ -0,0 +1,381 @@
+"""
+Generates flat encode and decode routines for every node type in a spec.
+
+The generic codecs dispatch on each field's type at run time. The code generated here
+unrolls the fields of each node type into a single function, with the per-file contexts
+and bitstream methods bound as closure variables. Source is generated and compiled once
+per schema, entropy coder and process, and a fresh set of closures is made for every
+encoder or decoder.
+"""
+import functools
+import bonsai.specs as spec_types
+from bonsai.codec.numbers import read_number, write_number
+from bonsai.entropy import SymbolCode
+from bonsai.util import trampoline
+
+
+class _Source:
+    __slots__ = ('lines', 'depth')
+
+    def __init__(self):
+        self.lines = []
+        self.depth = 0
+
+    def __call__(self, line):
+        self.lines.append('    ' * self.depth + line)
+
+    def indent(self, by=1):
+        self.depth += by
+
+    def dedent(self, by=1):
+        self.depth -= by
+
+    def __str__(self):
+        return '\n'.join(self.lines) + '\n'
+
+
+SCALAR_TYPES = (spec_types.Enum, spec_types.Boolean, spec_types.String, spec_types.Number)
+
+
+def _nested_types(schema):
+    """Returns the node types whose routines can yield child nodes."""
+    return frozenset(x for x, fields in schema.fields.items()
+                     if not all(isinstance(t, SCALAR_TYPES) for _, t, _ in fields))
+
+
+def _slots(schema):
+    """Numbers every node-referencing field so it can be bound to a closure variable."""
+    ref_slots = (slot for node_type in schema.node_types for slot, _ in schema.ref_fields[node_type])
+    return {slot: i for i, slot in enumerate(ref_slots)}
+
+
+def _enum_slots(schema):
+    """Numbers every enum field, whose tANS codes are bound like those of node references."""
+    enum_slots = (slot for node_type in schema.node_types
+                  for _, field_type, slot in schema.fields[node_type]
+                  if isinstance(field_type, spec_types.Enum))
+    return {slot: i for i, slot in enumerate(enum_slots)}
+
+
+def _lazy_slots(schema):
+    """Returns the node-referencing fields that may refer to nodes of lazy types."""
+    return frozenset(slot for node_type in schema.node_types
+                     for slot, candidates in schema.ref_fields[node_type]
+                     if candidates & schema.lazy_types)
+
+
+def _bind_contexts(src, slots, enum_slots):
+    for slot, i in slots.items():
+        src(f'ctx_{i} = contexts.get(SLOTS[{i}])')
+        src(f'multi_{i} = isinstance(ctx_{i}, SymbolCode)')
+    for slot, i in enum_slots.items():
+        src(f'enum_{i} = contexts.get(ENUM_SLOTS[{i}])')
+        src(f'enum_multi_{i} = isinstance(enum_{i}, SymbolCode)')
+
+
+def _compile(src, namespace, name):
+    code = compile(str(src), f'<bonsai.codegen.{name}>', 'exec')
+    exec(code, namespace)
+    return namespace['make']
+
+
+def _encode_ref(src, k, lazy, tans):
+    """
+    Emits the encoding of the node index in ``value`` for slot ``k``.
+    :param lazy: Whether the slot may refer to nodes of lazy types.
+    :param tans: Whether MTF ranks are coded with tANS.
+    """
+    src(f'recent = recent_nodes[ctx_{k}]')
+    src('rank = recent.rank(value)')
+    src('if rank is not None:')
+    src('    write_bool(True)')
+    src('    write_rank(rank, rank_code)' if tans else '    write_ue(rank, rank_order)')
+    src('    recent.move_to_front(value)')
+    src('else:')
+    src('    write_bool(False)')
+    src('    if value is None:')
+    src(f'        if multi_{k}:')
+    src(f'            ctx_{k}.write_symbol(Null, writer)')
+    src('    else:')
+    src('        child = nodes[value]')
+    src('        child_type = child[0]')
+    src(f'        if multi_{k}:')
+    src(f'            ctx_{k}.write_symbol(child_type, writer)')
+    if lazy:
+        src('        blob = blobs and child_type in LAZY_TYPES')
+        src('        if blob:')
+        src('            begin_blob()')
+    src('        if child_type in NESTED_TYPES:')
+    src('            yield encoders[child_type](child)')
+    src('        else:')
+    src('            encoders[child_type](child)')
+    if lazy:
+        src('        if blob:')
+        src('            end_blob()')
+    src('        recent.move_to_front(value)')
+
+
+@functools.lru_cache(maxsize=None)
+def encoder_factory(schema, tans=False):
+    """
+    Returns a function that makes node encoders for a GraphEncoder of the given schema.
+    The made function takes a node type and a node, and encodes it along with its children.
+    :param tans: Whether the encoder codes enums and MTF ranks with tANS.
+    """
+    slots = _slots(schema)
+    enum_slots = _enum_slots(schema) if tans else {}
+    lazy_slots = _lazy_slots(schema)
+    namespace = {
+        'SLOTS': {i: slot for slot, i in slots.items()},
+        'ENUM_SLOTS': {i: slot for slot, i in enum_slots.items()},
+        'NESTED_TYPES': _nested_types(schema),
+        'LAZY_TYPES': schema.lazy_types,
+        'SymbolCode': SymbolCode,
+        'Null': spec_types.Null,
+        'write_number': write_number,
+        'trampoline': trampoline,
+    }
+
+    src = _Source()
+    src('def make(encoder):')
+    src.indent()
+    src('writer = encoder.writer')
+    src('write_uint = writer.write_uint')
+    src('write_bool = writer.write_bool')
+    src('write_ue = writer.write_ue')
+    src('rank_order = encoder.rank_order')
+    src('write_rank = encoder._write_rank')
+    src('rank_code = encoder.rank_code')
+    src('nodes = encoder.nodes')
+    src('add_string = encoder.string_table.append')
+    src('string_refs = encoder.string_refs')
+    src('encode_string_ref = encoder._encode_string_ref')
+    src('encode_field = encoder._encode_field')
+    src('recent_nodes = encoder.recent_nodes')
+    src('contexts = encoder.contexts')
+    src('blobs = encoder.blobs')
+    src('begin_blob = encoder._begin_blob')
+    src('end_blob = encoder._end_blob')
+    _bind_contexts(src, slots, enum_slots)
+    src('encoders = {}')
+
+    for node_type in schema.node_types:
+        name = node_type.__name__
+        src('')
+        src(f'def encode_{name}(node):')
+        src.indent()
+        if not schema.fields[node_type]:
+            src('pass')
+
+        for position, (field_key, field_type, slot) in enumerate(schema.fields[node_type], 1):
+            value = f'node[{position}]'
+            if isinstance(field_type, spec_types.Enum) and tans:
+                e = enum_slots[slot]
+                src(f'if enum_multi_{e}:')
+                src(f'    enum_{e}.write_symbol({value}, writer)')
+            elif isinstance(field_type, spec_types.Enum):
+                indices = {v: i for i, v in reversed(list(enumerate(field_type.variants)))}
+                namespace[f'ENUM_{name}_{field_key}'] = indices
+                bits = (len(field_type.variants) - 1).bit_length()
+                src(f'write_uint(ENUM_{name}_{field_key}[{value}], {bits})')
+            elif isinstance(field_type, spec_types.Boolean):
+                src(f'write_bool({value})')
+            elif isinstance(field_type, spec_types.String):
+                namespace[f'SLOT_{name}_{field_key}'] = slot
+                src('if string_refs:')
+                src(f'    encode_string_ref({value}, SLOT_{name}_{field_key})')
+                src('else:')
+                src(f'    add_string({value})')
+            elif isinstance(field_type, spec_types.Number):
+                src(f'write_number({value}, writer)')
+            elif isinstance(field_type, spec_types.NodeRef):
+                src(f'value = {value}')
+                _encode_ref(src, slots[slot], slot in lazy_slots, tans)
+            elif isinstance(field_type, spec_types.List) and isinstance(field_type.of_type, spec_types.NodeRef):
+                k = slots[slot]
+                src(f'if ctx_{k} is not None:')
+                src.indent()
+                if field_type.nonempty:
+                    src(f'for i, value in enumerate({value}):')
+                    src('    if i:')
+                    src('        write_bool(True)')
+                else:
+                    src(f'for value in {value}:')
+                    src('    write_bool(True)')
+                src.indent()
+                _encode_ref(src, k, slot in lazy_slots, tans)
+                src.dedent()
+                src('write_bool(False)')
+                src.dedent()
+            else:
+                namespace[f'FIELD_{name}_{field_key}'] = field_type
+                namespace[f'SLOT_{name}_{field_key}'] = slot
+                src(f'yield from encode_field(FIELD_{name}_{field_key}, {value}, '
+                    f'contexts.get(SLOT_{name}_{field_key}))')
+
+        src.dedent()
+        namespace[f'T_{name}'] = node_type
+        src(f'encoders[T_{name}] = encode_{name}')
+
+    src('')
+    src('def encode_tree(node_type, node):')
+    src('    if node_type in NESTED_TYPES:')
+    src('        trampoline(encoders[node_type](node))')
+    src('    else:')
+    src('        encoders[node_type](node)')
+    src('')
+    src('return encode_tree')
+
+    return _compile(src, namespace, 'encoder')
+
+
+def _decode_ref(src, k, lazy, tans):
+    """
+    Emits the decoding of a node reference for slot ``k`` into ``value``.
+    :param lazy: Whether the slot may refer to nodes of lazy types.
+    :param tans: Whether MTF ranks are coded with tANS.
+    """
+    src(f'recent = recent_nodes[ctx_{k}]')
+    src('if read_bool():')
+    src('    index = recent.pop(read_rank(rank_code))' if tans else
+        '    index = recent.pop(read_ue(rank_order))')
+    src('    recent.move_to_front(index)')
+    src('    value = nodes[index] if tree else index')
+    src('else:')
+    src(f'    child_type = ctx_{k}.read_symbol(reader) if multi_{k} else ctx_{k}')
+    src('    if child_type is Null:')
+    src('        value = None')
+    src('    else:')
+    if lazy:
+        src('        if blobs and child_type in LAZY_TYPES:')
+        src('            child = begin_blob(child_type)')
+        src('            if child is None:')
+        src('                if child_type in NESTED_TYPES:')
+        src('                    child = yield decoders[child_type]()')
+        src('                else:')
+        src('                    child = decoders[child_type]()')
+        src('                end_blob()')
+        src('        elif child_type in NESTED_TYPES:')
+    else:
+        src('        if child_type in NESTED_TYPES:')
+    src('            child = yield decoders[child_type]()')
+    src('        else:')
+    src('            child = decoders[child_type]()')
+    src('        nodes.append(child)')
+    src('        index = len(nodes) - 1')
+    src('        recent.move_to_front(index)')
+    src('        value = child if tree else index')
+
+
+@functools.lru_cache(maxsize=None)
+def decoder_factory(schema, tans=False):
+    """
+    Returns a function that makes node decoders for a GraphDecoder of the given schema.
+    The made function takes a node type and returns the decoded node.
+    :param tans: Whether the decoder reads enums and MTF ranks coded with tANS.
+    """
+    slots = _slots(schema)
+    enum_slots = _enum_slots(schema) if tans else {}
+    lazy_slots = _lazy_slots(schema)
+    namespace = {
+        'SLOTS': {i: slot for slot, i in slots.items()},
+        'ENUM_SLOTS': {i: slot for slot, i in enum_slots.items()},
+        'NESTED_TYPES': _nested_types(schema),
+        'LAZY_TYPES': schema.lazy_types,
+        'SymbolCode': SymbolCode,
+        'Null': spec_types.Null,
+        'read_number': read_number,
+        'trampoline': trampoline,
+    }
+
+    src = _Source()
+    src('def make(decoder):')
+    src.indent()
+    src('reader = decoder.reader')
+    src('read_uint = reader.read_uint')
+    src('read_bool = reader.read_bool')
+    src('read_ue = reader.read_ue')
+    src('rank_order = decoder.rank_order')
+    src('read_rank = decoder._read_rank')
+    src('rank_code = decoder.rank_code')
+    src('nodes = decoder.nodes')
+    src('tree = decoder.tree')
+    src('next_string = decoder.string_table.popleft')
+    src('string_refs = decoder.string_refs')
+    src('decode_string_ref = decoder._decode_string_ref')
+    src('decode_field = decoder._decode_field')
+    src('recent_nodes = decoder.recent_nodes')
+    src('contexts = decoder.contexts')
+    src('blobs = decoder.blobs')
+    src('begin_blob = decoder._begin_blob')
+    src('end_blob = decoder._end_blob')
+    _bind_contexts(src, slots, enum_slots)
+    src('decoders = {}')
+
+    for node_type in schema.node_types:
+        name = node_type.__name__
+        src('')
+        src(f'def decode_{name}():')
+        src.indent()
+        src(f"node = {{'type': {name!r}}}")
+
+        for field_key, field_type, slot in schema.fields[node_type]:
+            target = f'node[{field_key!r}]'
+            if isinstance(field_type, spec_types.Enum) and tans:
+                e = enum_slots[slot]
+                src(f'{target} = enum_{e}.read_symbol(reader) if enum_multi_{e} else enum_{e}')
+            elif isinstance(field_type, spec_types.Enum):
+                namespace[f'ENUM_{name}_{field_key}'] = field_type.variants
+                bits = (len(field_type.variants) - 1).bit_length()
+                src(f'{target} = ENUM_{name}_{field_key}[read_uint({bits})]')
+            elif isinstance(field_type, spec_types.Boolean):
+                src(f'{target} = read_bool()')
+            elif isinstance(field_type, spec_types.String):
+                namespace[f'SLOT_{name}_{field_key}'] = slot
+                src(f'{target} = decode_string_ref(SLOT_{name}_{field_key}) '
+                    f'if string_refs else next_string()')
+            elif isinstance(field_type, spec_types.Number):
+                src(f'{target} = read_number(reader)')
+            elif isinstance(field_type, spec_types.NodeRef):
+                _decode_ref(src, slots[slot], slot in lazy_slots, tans)
+                src(f'{target} = value')
+            elif isinstance(field_type, spec_types.List) and isinstance(field_type.of_type, spec_types.NodeRef):
+                k = slots[slot]
+                src('items = []')
+                src(f'if ctx_{k} is not None:')
+                src.indent()
+                if field_type.nonempty:
+                    _decode_ref(src, k, slot in lazy_slots, tans)
+                    src('items.append(value)')
+                src('while read_bool():')
+                src.indent()
+                _decode_ref(src, k, slot in lazy_slots, tans)
+                src('items.append(value)')
+                src.dedent(2)
+                src(f'{target} = tuple(items)')
+            else:
+                namespace[f'FIELD_{name}_{field_key}'] = field_type
+                namespace[f'SLOT_{name}_{field_key}'] = slot
+                src(f'{target} = yield from decode_field(FIELD_{name}_{field_key}, '
+                    f'contexts.get(SLOT_{name}_{field_key}))')
+
+        src('return node')
+        src.dedent()
+        namespace[f'T_{name}'] = node_type
+        src(f'decoders[T_{name}] = decode_{name}')
+
+    src('')
+    src('def decode_tree(node_type):')
+    src('    try:')
+    src('        if node_type in NESTED_TYPES:')
+    src('            return trampoline(decoders[node_type]())')
+    src('        else:')
+    src('            return decoders[node_type]()')
+    src('    finally:')
+    # the decoders refer to each other through the dict, which would keep the GraphDecoder
+    # and the buffer it reads from alive until the next garbage collection
+    src('        decoders.clear()')
+    src('')
+    src('return decode_tree')
+
+    return _compile(src, namespace, 'decoder')
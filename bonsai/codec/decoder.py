@@ -1,71 +1,135 @@
 import bonsai.specs as spec_types
-from blist import blist
 from collections import defaultdict, deque
-from decimal import Decimal, DecimalTuple
-from bonsai.bits import BitsIO
+from collections.abc import Mapping
+from bonsai.ans import ANSReader, TableCode
+from bonsai.bits import BitsReader
+from bonsai.codec.codegen import decoder_factory
+from bonsai.codec.numbers import read_number
+from bonsai.entropy import SymbolCode
 from bonsai.huffman import CanonicalCode
-from bonsai.util import *
+from bonsai.mtf import MoveToFront, RANK_ORDER
+from bonsai.schema import compile_schema
+from bonsai.stringsection import StringSection, StringCursor
+from bonsai.util import trampoline
 
-vardecimal = CanonicalCode((None, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9), (0, 1, 2, 8))
+# field types that may refer to child nodes
+COMPOUND_TYPES = (spec_types.NodeRef, spec_types.List)
 
 
 class GraphDecoder:
-    __slots__ = ('spec', 'nodes', 'reader', 'string_table', 'used_types',
-                 'recent_nodes', 'contexts', 'ctx_stack', 'tree')
+    __slots__ = ('spec', 'schema', 'nodes', 'reader', 'string_table', 'used_types',
+                 'recent_nodes', 'contexts', 'tree', 'codegen', 'blobs', 'lazy', 'blob_states',
+                 'string_refs', 'strings', 'recent_strings', 'profile', 'rank_order',
+                 'string_rank_order', 'tans', 'rank_code', 'string_rank_code')
 
-    def __init__(self, fp, spec, string_table, tree=True):
+    def __init__(self, data, spec, string_table, tree=True, codegen=True, blobs=False, lazy=False,
+                 string_refs=False, profile=None, tans=False):
+        """
+        :param data: A bytes-like object holding the graph bitstream.
+        :param spec: A spec module.
+        :param string_table: A sequence of strings in the order they are used. Strings
+                             of a StringSection are only decoded when they are read.
+        :param tree: Return the root node rather than the list of all nodes.
+        :param codegen: Decode nodes with routines generated for the spec.
+        :param blobs: Nodes of the spec's ``lazy_types`` were coded as skippable blobs.
+        :param lazy: Return blobs as LazyNode proxies rather than decoding them.
+        :param string_refs: String fields were coded as references to a table of distinct
+                            strings.
+        :param profile: The bonsai.profile.Profile the stream was encoded with, if any.
+        :param tans: The stream was coded with table ANS, see ``GraphEncoder``.
+        """
         self.spec = spec
+        self.schema = compile_schema(spec)
         self.tree = tree
-        self.reader = BitsIO(fp)
-        self.string_table = deque(string_table)
+        self.codegen = codegen
+        self.blobs = blobs
+        self.lazy = lazy
+        self.string_refs = string_refs
+        self.profile = profile
+        self.tans = tans
+        self.reader = ANSReader(data) if tans else BitsReader(data)
+        if isinstance(string_table, StringSection):
+            self.string_table = string_table.cursor()
+        else:
+            self.string_table = deque(string_table)
 
         self.used_types = [spec_types.Null]
         self.nodes = []
-        self.recent_nodes = defaultdict(blist)
+        self.recent_nodes = defaultdict(MoveToFront)
         self.contexts = {}
-        self.ctx_stack = deque()
+        self.blob_states = []
+
+        # the strings read from the table so far, and the recently used ones per string field
+        self.strings = []
+        self.recent_strings = defaultdict(MoveToFront)
+
+        self.rank_order = profile.rank_order if profile else RANK_ORDER
+        self.string_rank_order = profile.string_rank_order if profile else RANK_ORDER
+
+        # the codes of MTF ranks with tANS, read at the start of the node stream
+        self.rank_code = None
+        self.string_rank_code = None
+
+    def _decode_Enum(self, meta, slot):
+        if self.tans:
+            ctx = self.contexts[slot]
+            return ctx.read_symbol(self.reader) if isinstance(ctx, SymbolCode) else ctx
 
-    def _decode_Enum(self, meta):
         bits = (len(meta.variants) - 1).bit_length()
         value = self.reader.read_uint(bits)
         return meta.variants[value]
 
-    def _decode_Boolean(self, _):
+    def _decode_Boolean(self, _, _ctx):
         return self.reader.read_bool()
 
-    def _decode_String(self, _):
+    def _decode_String(self, _, slot):
+        if self.string_refs:
+            return self._decode_string_ref(slot)
         return self.string_table.popleft()
 
-    def _decode_Number(self, _):
-        digits = []
-        while True:
-            sym = vardecimal.read_symbol(self.reader)
-            if sym is None:
-                break
-            digits.append(sym)
+    def _decode_string_ref(self, slot):
+        recent = self.recent_strings[slot]
+        if self.reader.read_bool():
+            if self.tans:
+                string_id = recent.pop(self._read_rank(self.string_rank_code))
+            else:
+                string_id = recent.pop(self.reader.read_ue(self.string_rank_order))
+        else:
+            distance = self.reader.read_ue()
+            if distance:
+                string_id = len(self.strings) - distance
+            else:
+                string_id = len(self.strings)
+                self.strings.append(self.string_table.popleft())
 
-        sign = self.reader.read_bool() if digits else 0
-        exponent = self.reader.read_se()
+        recent.move_to_front(string_id)
+        return self.strings[string_id]
 
-        decimal = Decimal(DecimalTuple(sign, digits, exponent))
-        return float(decimal) if exponent else int(decimal)
+    def _read_rank(self, code):
+        suffix_bits = code.read_symbol(self.reader)
+        return ((1 << suffix_bits) | self.reader.read_uint(suffix_bits)) - 1
 
-    def _decode_List(self, meta):
+    def _decode_Number(self, _, _ctx):
+        return read_number(self.reader)
+
+    def _decode_List(self, meta, ctx):
         items = []
-        if self.ctx_stack[-1] is not None:
+        if ctx is not None:
             if meta.nonempty:
-                items.append(self._decode_field(meta.of_type))
+                items.append((yield from self._decode_field(meta.of_type, ctx)))
             while self.reader.read_bool():
-                items.append(self._decode_field(meta.of_type))
+                items.append((yield from self._decode_field(meta.of_type, ctx)))
         return tuple(items)
 
-    def _decode_NodeRef(self, _):
-        ctx = self.ctx_stack[-1]
-        valid_types = ctx.symbols if isinstance(ctx, CanonicalCode) else [ctx]
+    def _decode_NodeRef(self, _, ctx):
+        valid_types = ctx.symbols if isinstance(ctx, SymbolCode) else [ctx]
         recent_ctx = self.recent_nodes[ctx]
 
         if self.reader.read_bool():
-            rank = self.reader.read_ue(2)
+            if self.tans:
+                rank = self._read_rank(self.rank_code)
+            else:
+                rank = self.reader.read_ue(self.rank_order)
             node_index = recent_ctx.pop(rank)
         else:
             if len(valid_types) >= 2:
@@ -74,33 +138,80 @@ class GraphDecoder:
                 actual_type, = valid_types
 
             if actual_type != spec_types.Null:
-                self.nodes.append(self._decode_node_inner(actual_type))
+                if self.blobs and actual_type in self.schema.lazy_types:
+                    node = self._begin_blob(actual_type)
+                    if node is None:
+                        node = yield self._decode_node_inner(actual_type)
+                        self._end_blob()
+                else:
+                    node = yield self._decode_node_inner(actual_type)
+                self.nodes.append(node)
                 node_index = len(self.nodes) - 1
             else:
                 node_index = None
 
         if isinstance(node_index, int):
-            recent_ctx.insert(0, node_index)
+            recent_ctx.move_to_front(node_index)
             return self.nodes[node_index] if self.tree else node_index
 
-    def _decode_field(self, node_type):
-        decode_fn = getattr(self, f'_decode_{node_type.__class__.__name__}')
-        return decode_fn(node_type)
+    def _begin_blob(self, node_type):
+        """
+        Starts decoding a blob. Returns a LazyNode for it if decoding lazily, otherwise
+        sets up fresh recency state for the blob's contents and returns None.
+        """
+        bits = self.reader.read_ue()
+        num_strings = self.reader.read_ue()
+
+        if self.lazy:
+            pos = self.reader.tell()
+            if isinstance(self.string_table, StringCursor):
+                strings = self.string_table.take(num_strings)
+            else:
+                strings = [self.string_table.popleft() for _ in range(num_strings)]
+            self.reader.seek(pos + bits)
+            return LazyNode(self, node_type, pos, strings)
+
+        # mutated in place since generated decoders hold on to the dict
+        self.blob_states.append((dict(self.recent_nodes), self.strings, self.recent_strings))
+        self.recent_nodes.clear()
+        self.strings = []
+        self.recent_strings = defaultdict(MoveToFront)
+        if self.tans:
+            self.reader.begin()
+
+    def _end_blob(self):
+        recent_nodes, self.strings, self.recent_strings = self.blob_states.pop()
+        self.recent_nodes.clear()
+        self.recent_nodes.update(recent_nodes)
+        if self.tans:
+            self.reader.end()
+
+    def _decode_field(self, field_type, ctx):
+        decode_fn = getattr(self, f'_decode_{field_type.__class__.__name__}')
+        if isinstance(field_type, COMPOUND_TYPES):
+            return (yield from decode_fn(field_type, ctx))
+        else:
+            return decode_fn(field_type, ctx)
 
     def _decode_node_inner(self, node_type):
+        """
+        Decodes the fields of a node. Child nodes are yielded as generators to be run
+        by trampoline(), which sends the decoded child back.
+        """
         node = {'type': node_type.__name__}
-        for field_key, field_type in fields(node_type):
-            self.ctx_stack.append(self.contexts.get((node_type, field_key)))
-            node[field_key] = self._decode_field(field_type)
-            self.ctx_stack.pop()
+        for field_key, field_type, slot in self.schema.fields[node_type]:
+            decode_fn = getattr(self, f'_decode_{field_type.__class__.__name__}')
+            if isinstance(field_type, COMPOUND_TYPES):
+                node[field_key] = yield from decode_fn(field_type, self.contexts.get(slot))
+            else:
+                node[field_key] = decode_fn(field_type, slot)
         return node
 
     def _prepare_huffman(self):
-        for key, child_types in iter_fields(self.used_types, spec_types.NodeRef):
+        for key, child_types in self.schema.iter_ref_fields(self.used_types):
             if len(child_types) >= 2:
                 if self.reader.read_bool():
-                    ctx = CanonicalCode.read_from_codebook(self.reader, child_types)
-                    self.contexts[key] = ctx
+                    self.contexts[key] = self._read_code(child_types)
                 else:
                     bits = (len(child_types) - 1).bit_length()
                     index = self.reader.read_uint(bits)
@@ -108,15 +219,112 @@ class GraphDecoder:
             elif child_types:
                 self.contexts[key], = child_types
 
-    def decode(self):
-        all_types = subclasses(spec_types.Node)
+    def _read_code(self, alphabet):
+        code_type = TableCode if self.tans and self.reader.read_bool() else CanonicalCode
+        return code_type.read_from_codebook(self.reader, alphabet)
+
+    def _prepare_enums(self):
+        for slot, variants in self.schema.iter_enum_fields(self.used_types):
+            if self.reader.read_bool():
+                self.contexts[slot] = self._read_code(variants)
+            else:
+                bits = (len(variants) - 1).bit_length()
+                self.contexts[slot] = variants[self.reader.read_uint(bits)]
+
+    def _read_rank_codebook(self):
+        if self.reader.read_bool():
+            return TableCode.read_from_codebook(self.reader, range(self.reader.read_ue() + 1))
+
+    def read_header(self):
+        """Reads the bitmap of used types and the codebooks, or takes them from the profile."""
+        if self.profile is not None:
+            self.used_types[:] = self.profile.used_types
+            self.contexts.update(self.profile.contexts)
+            return
+
+        all_types = self.schema.node_types
         self.used_types.extend(x for x in all_types if self.reader.read_bool())
 
         self._prepare_huffman()
-        decoded = self._decode_node_inner(self.spec.root_type)
+        if self.tans:
+            self._prepare_enums()
+
+    def decode_node(self, node_type, rank_codes=None):
+        """
+        Decodes a node and its children using the codebooks of the header. With tANS, the
+        codebooks of MTF ranks are read first.
+        :param rank_codes: The codes of MTF ranks of the enclosing stream instead, when
+                           decoding a blob on its own.
+        """
+        if self.tans:
+            if rank_codes is None:
+                rank_codes = self._read_rank_codebook(), self._read_rank_codebook()
+            self.rank_code, self.string_rank_code = rank_codes
+            self.reader.begin()
+
+        if self.codegen:
+            decode_tree = decoder_factory(self.schema, self.tans)(self)
+            return decode_tree(node_type)
+        else:
+            return trampoline(self._decode_node_inner(node_type))
+
+    def decode(self):
+        self.read_header()
+        decoded = self.decode_node(self.schema.root_type)
 
         if self.tree:
             return decoded
         else:
             self.nodes.append(decoded)
             return self.nodes
+
+
+class LazyNode(Mapping):
+    """A node coded as a blob, which is decoded when it is first accessed."""
+
+    __slots__ = ('_decoder', '_node_type', '_pos', '_strings', '_node')
+
+    def __init__(self, decoder, node_type, pos, strings):
+        """
+        :param decoder: The GraphDecoder that read the blob.
+        :param node_type: The type of the node.
+        :param pos: The position of the blob's contents in the bitstream.
+        :param strings: The strings used by the blob.
+        """
+        self._decoder = decoder
+        self._node_type = node_type
+        self._pos = pos
+        self._strings = strings
+        self._node = None
+
+    def _load(self):
+        if self._node is None:
+            parent = self._decoder
+            d = GraphDecoder(parent.reader.data, parent.spec, self._strings,
+                             codegen=parent.codegen, blobs=True, lazy=True,
+                             string_refs=parent.string_refs, profile=parent.profile,
+                             tans=parent.tans)
+            d.used_types, d.contexts = parent.used_types, parent.contexts
+            d.reader.seek(self._pos)
+            rank_codes = parent.rank_code, parent.string_rank_code
+            self._node = d.decode_node(self._node_type, rank_codes)
+            self._decoder = self._strings = None
+        return self._node
+
+    @property
+    def loaded(self):
+        return self._node is not None
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def __repr__(self):
+        if self._node is None:
+            return f'<LazyNode {self._node_type.__name__}>'
+        return f'LazyNode({self._node!r})'
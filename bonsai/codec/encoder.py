@@ -1,118 +1,242 @@
 import logging
 import bonsai.specs as spec_types
-from blist import blist
-from collections import deque, defaultdict, Counter
-from decimal import Decimal
+from collections import defaultdict, Counter
+from bonsai.ans import ANSWriter, DeferredCode, TableCode
+from bonsai.entropy import SymbolCode
 from bonsai.huffman import CanonicalCode
 from bonsai.bits import BitsIO
-from bonsai.util import *
+from bonsai.codec.codegen import encoder_factory
+from bonsai.codec.numbers import write_number
+from bonsai.mtf import MoveToFront, RANK_ORDER
+from bonsai.schema import compile_schema
+from bonsai.util import trampoline
 
 logger = logging.getLogger(__name__)
-vardecimal = CanonicalCode((None, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9), (0, 1, 2, 8))
+
+# field types that may refer to child nodes
+COMPOUND_TYPES = (spec_types.NodeRef, spec_types.List)
+
+# bounds the size of the second-level decode tables
+MAX_CODE_LENGTH = 15
 
 
 class GraphEncoder:
-    __slots__ = ('spec', 'nodes', 'tree', 'writer', 'string_table', 'used_types',
-                 'recent_nodes', 'contexts', 'ctx_stack')
+    __slots__ = ('spec', 'schema', 'nodes', 'tree', 'writer', 'string_table', 'used_types',
+                 'recent_nodes', 'contexts', 'codegen', 'events', 'blobs', 'blob_states',
+                 'string_refs', 'string_ids', 'recent_strings', 'profile', 'rank_order',
+                 'string_rank_order', 'tans', 'rank_code', 'string_rank_code')
+
+    def __init__(self, spec, tree, fp, codegen=True, events=None, blobs=False, string_refs=False,
+                 profile=None, tans=False):
+        """
+        :param spec: A spec module.
+        :param tree: The AST to encode, or None if ``events`` is given.
+        :param fp: The stream to write the graph bitstream to.
+        :param codegen: Encode nodes with routines generated for the spec.
+        :param events: JSON parse events of the AST, see ``bonsai.jsonevents``.
+        :param blobs: Code nodes of the spec's ``lazy_types`` as skippable blobs.
+        :param string_refs: Keep each distinct string once in the string table, and code
+                            string fields as references to it.
+        :param profile: A bonsai.profile.Profile to take the codebooks and rank orders from,
+                        rather than writing them to the header.
+        :param tans: Code node types, enums and MTF ranks with table ANS rather than
+                     Huffman codes and fixed-length or exp-Golomb codes.
+        """
+        if tans and profile:
+            raise ValueError('Profiles hold Huffman codebooks, so they cannot be used with tANS')
 
-    def __init__(self, spec, tree, fp):
         self.spec = spec
+        self.schema = compile_schema(spec)
         self.tree = tree
+        self.codegen = codegen
+        self.events = events
+        self.blobs = blobs
+        self.string_refs = string_refs
+        self.profile = profile
         self.writer = BitsIO(fp)
 
+        # a record per distinct node: its type followed by its field values in schema
+        # order, with children replaced by their indices
         self.nodes = []
         self.string_table = []
         self.used_types = [spec_types.Null]
-        self.recent_nodes = defaultdict(blist)
+        self.recent_nodes = defaultdict(MoveToFront)
         self.contexts = {}
-        self.ctx_stack = deque()
+        self.blob_states = []
 
-    def _encode_Enum(self, meta, value):
-        index = meta.variants.index(value)
-        bits = (len(meta.variants) - 1).bit_length()
-        self.writer.write_uint(index, bits)
+        # indices of the distinct strings, and the recently used ones per string field
+        self.string_ids = {}
+        self.recent_strings = defaultdict(MoveToFront)
 
-    def _encode_Boolean(self, _, value):
-        self.writer.write_bool(value)
+        self.rank_order = profile.rank_order if profile else RANK_ORDER
+        self.string_rank_order = profile.string_rank_order if profile else RANK_ORDER
 
-    def _encode_String(self, _, value):
-        self.string_table.append(value)
+        # with tANS, the codes of MTF ranks are built once the node stream is done
+        self.tans = tans
+        self.rank_code = DeferredCode() if tans else None
+        self.string_rank_code = DeferredCode() if tans else None
 
-    def _encode_Number(self, _, value):
-        dt = Decimal(value).as_tuple()
+    def _encode_Enum(self, meta, value, slot):
+        if self.tans:
+            ctx = self.contexts[slot]
+            if isinstance(ctx, SymbolCode):
+                ctx.write_symbol(value, self.writer)
+            return
 
-        digits = dt.digits if dt.digits != (0,) else ()
-        for d in digits:
-            vardecimal.write_symbol(d, self.writer)
-        vardecimal.write_symbol(None, self.writer)
-
-        if digits:
-            self.writer.write_bool(dt.sign)
+        index = meta.variants.index(value)
+        bits = (len(meta.variants) - 1).bit_length()
+        self.writer.write_uint(index, bits)
 
-        self.writer.write_se(dt.exponent)
+    def _encode_Boolean(self, _, value, _ctx):
+        self.writer.write_bool(value)
 
-    def _encode_List(self, meta, items):
-        if self.ctx_stack[-1] is not None:
+    def _encode_String(self, _, value, slot):
+        if self.string_refs:
+            self._encode_string_ref(value, slot)
+        else:
+            self.string_table.append(value)
+
+    def _encode_string_ref(self, value, slot):
+        """
+        Codes a string as its rank among the recent strings of its field if it's there.
+        Otherwise codes its distance from the most recently added string, with zero adding
+        it as a new string. Blobs start with an empty set of strings.
+        """
+        recent = self.recent_strings[slot]
+        string_id = self.string_ids.get(value)
+
+        if string_id is None:
+            self.writer.write_bool(False)
+            self.writer.write_ue(0)
+            string_id = self.string_ids[value] = len(self.string_ids)
+            self.string_table.append(value)
+        else:
+            rank = recent.rank(string_id)
+            if rank is not None:
+                self.writer.write_bool(True)
+                if self.tans:
+                    self._write_rank(rank, self.string_rank_code)
+                else:
+                    self.writer.write_ue(rank, self.string_rank_order)
+            else:
+                self.writer.write_bool(False)
+                self.writer.write_ue(len(self.string_ids) - string_id)
+
+        recent.move_to_front(string_id)
+
+    def _write_rank(self, rank, code):
+        """
+        Codes an MTF rank like an exp-Golomb code of order 0, but with the length of the
+        suffix coded as a symbol of a tANS code.
+        """
+        rank += 1
+        suffix_bits = rank.bit_length() - 1
+        code.write_symbol(suffix_bits, self.writer)
+        self.writer.write_uint(rank, suffix_bits)
+
+    def _encode_Number(self, _, value, _ctx):
+        write_number(value, self.writer)
+
+    def _encode_List(self, meta, items, ctx):
+        if ctx is not None:
             for i, item in enumerate(items):
                 if not meta.nonempty or i > 0:
                     self.writer.write_bool(True)
-                self._encode_field(meta.of_type, item)
+                yield from self._encode_field(meta.of_type, item, ctx)
             self.writer.write_bool(False)
 
-    def _encode_NodeRef(self, _, node_index):
-        ctx = self.ctx_stack[-1]
-        valid_types = ctx.symbols if isinstance(ctx, CanonicalCode) else [ctx]
+    def _encode_NodeRef(self, _, node_index, ctx):
+        valid_types = ctx.symbols if isinstance(ctx, SymbolCode) else [ctx]
         recent_ctx = self.recent_nodes[ctx]
 
-        try:
-            rank = recent_ctx.index(node_index)
-        except ValueError:
-            rank = None
+        rank = recent_ctx.rank(node_index)
 
         if rank is not None:
             # code rank using exp-Golomb
             self.writer.write_bool(True)
-            self.writer.write_ue(rank, 2)
-
-            # we'll move the index to the front of the list
-            del recent_ctx[rank]
+            if self.tans:
+                self._write_rank(rank, self.rank_code)
+            else:
+                self.writer.write_ue(rank, self.rank_order)
         else:
             self.writer.write_bool(False)
 
             if isinstance(node_index, int):
                 actual_node = self.nodes[node_index]
-                actual_type = getattr(self.spec, actual_node['type'])
+                actual_type = actual_node[0]
             else:
-                actual_node = {}
+                actual_node = ()
                 actual_type = spec_types.Null
 
             if len(valid_types) >= 2:
                 ctx.write_symbol(actual_type, self.writer)
 
-            self._encode_node_inner(actual_type, actual_node)
+            if self.blobs and actual_type in self.schema.lazy_types:
+                self._begin_blob()
+                yield self._encode_node_inner(actual_type, actual_node)
+                self._end_blob()
+            else:
+                yield self._encode_node_inner(actual_type, actual_node)
 
         if isinstance(node_index, int):
-            recent_ctx.insert(0, node_index)
-
-    def _encode_field(self, node_type, value):
-        encode_fn = getattr(self, f'_encode_{node_type.__class__.__name__}')
-        encode_fn(node_type, value)
+            recent_ctx.move_to_front(node_index)
+
+    def _begin_blob(self):
+        """
+        Starts coding a node as a blob. Its bits are captured, and it gets fresh recency
+        state so that it can be decoded on its own.
+        """
+        # mutated in place since generated encoders hold on to the dict
+        self.blob_states.append((dict(self.recent_nodes), len(self.string_table),
+                                 self.string_ids, self.recent_strings))
+        self.recent_nodes.clear()
+        self.string_ids = {}
+        self.recent_strings = defaultdict(MoveToFront)
+        self.writer.begin_capture()
+
+    def _end_blob(self):
+        """Writes the blob's length in bits and its number of strings, followed by its bits."""
+        recent_nodes, string_pos, self.string_ids, self.recent_strings = self.blob_states.pop()
+        self.recent_nodes.clear()
+        self.recent_nodes.update(recent_nodes)
+
+        if self.tans:
+            # the blob is an ANS stream of its own, whose length is known once it's finished
+            self.writer.end_capture(len(self.string_table) - string_pos)
+            return
+
+        value, bits = self.writer.end_capture()
+        self.writer.write_ue(bits)
+        self.writer.write_ue(len(self.string_table) - string_pos)
+        self.writer.write_uint(value, bits)
+
+    def _encode_field(self, field_type, value, ctx):
+        encode_fn = getattr(self, f'_encode_{field_type.__class__.__name__}')
+        if isinstance(field_type, COMPOUND_TYPES):
+            yield from encode_fn(field_type, value, ctx)
+        else:
+            encode_fn(field_type, value, ctx)
 
     def _encode_node_inner(self, node_type, node):
-        for field_key, field_type in fields(node_type):
-            self.ctx_stack.append(self.contexts.get((node_type, field_key)))
-            self._encode_field(field_type, node[field_key])
-            self.ctx_stack.pop()
+        """
+        Encodes the fields of a node. Child nodes are yielded as generators to be run
+        by trampoline(), so deeply nested trees don't exhaust the Python stack.
+        """
+        for value, (_, field_type, slot) in zip(node[1:], self.schema.fields[node_type]):
+            encode_fn = getattr(self, f'_encode_{field_type.__class__.__name__}')
+            if isinstance(field_type, COMPOUND_TYPES):
+                yield from encode_fn(field_type, value, self.contexts.get(slot))
+            else:
+                encode_fn(field_type, value, slot)
 
     def _prepare_huffman(self, stats):
-        for key, child_types in iter_fields(self.used_types, spec_types.NodeRef):
+        for key, child_types in self.schema.iter_ref_fields(self.used_types):
             if len(child_types) >= 2:
                 type_counts = stats[key]
 
                 if len(type_counts) >= 2:
                     self.writer.write_bool(True)
-                    ctx = CanonicalCode.from_counts(type_counts)
-                    ctx.write_codebook(child_types, self.writer)
+                    ctx = self._write_code(type_counts, child_types)
                 else:
                     self.writer.write_bool(False)
                     ctx, _ = type_counts.popitem()
@@ -125,58 +249,254 @@ class GraphEncoder:
                 # field can only have one type of node anyway
                 self.contexts[key], = child_types
 
+    def _write_code(self, counts, alphabet):
+        """
+        Builds a code from symbol counts and writes its codebook. With tANS, whichever of a
+        Huffman and a tANS code takes fewer bits along with its codebook is used, since
+        codebooks can outweigh the savings in small files. A bit tells which one it is.
+        """
+        code = CanonicalCode.from_counts(counts, MAX_CODE_LENGTH)
+        if self.tans:
+            candidates = []
+            for x in (code, TableCode.from_counts(counts, alphabet)):
+                codebook = BitsIO()
+                x.write_codebook(alphabet, codebook)
+                candidates.append((codebook.tell() + x.cost(counts), x))
+            code = min(candidates, key=lambda x: x[0])[1]
+            self.writer.write_bool(isinstance(code, TableCode))
+
+        code.write_codebook(alphabet, self.writer)
+        return code
+
+    def _prepare_enums(self):
+        """
+        Writes a codebook for each enum field of the used types, or the index of its only
+        variant. Either goes in the contexts, under the field's slot.
+        """
+        enum_fields = {node_type: [(i, slot) for i, (_, field_type, slot)
+                                   in enumerate(self.schema.fields[node_type], 1)
+                                   if isinstance(field_type, spec_types.Enum)]
+                       for node_type in self.used_types}
+        counts = defaultdict(Counter)
+        for node in self.nodes:
+            for i, slot in enum_fields[node[0]]:
+                counts[slot][node[i]] += 1
+
+        for slot, variants in self.schema.iter_enum_fields(self.used_types):
+            value_counts = counts[slot]
+            if len(value_counts) >= 2:
+                self.writer.write_bool(True)
+                ctx = self._write_code(value_counts, variants)
+            else:
+                self.writer.write_bool(False)
+                ctx, = value_counts
+                self.writer.write_uint(variants.index(ctx), (len(variants) - 1).bit_length())
+            self.contexts[slot] = ctx
+
+    def _write_rank_codebook(self, code, writer):
+        """Builds the code of a DeferredCode of MTF ranks, and writes its codebook."""
+        writer.write_bool(bool(code.counts))
+        if code.counts:
+            alphabet = range(max(code.counts) + 1)
+            code.code = TableCode.from_counts(code.counts, alphabet)
+            writer.write_ue(len(alphabet) - 1)
+            code.code.write_codebook(alphabet, writer)
+
+    def _intern(self, node_type, node, indices):
+        """
+        Returns the index of a node in the node table, adding a record for it if there's
+        no equal node. Since children are replaced by their indices before their parent
+        is interned, equal records mean equal subtrees.
+        :param node: A dict of the node's fields, with children replaced by their indices.
+        :param indices: Maps records to node indices.
+        """
+        record = (node_type, *[node[k] for k, _, _ in self.schema.fields[node_type]])
+        index = indices.get(record)
+        if index is None:
+            index = indices[record] = len(self.nodes)
+            self.nodes.append(record)
+        return index
+
     def _graphify(self, tree):
+        """
+        Builds the node table from an AST, deduplicating equal subtrees. The AST is left
+        unchanged.
+        """
         indices = {}
         type_stats = defaultdict(Counter)
-        ctx_stack = deque([None])
 
-        def traverse(node):
-            ctx_type, ctx_field = ctx_stack[-1] or (None, None)
-            if isinstance(node, dict):
+        def convert(value, ctx):
+            if isinstance(value, dict):
+                if 'type' in value:
+                    return (yield visit(value, ctx))
+                else:
+                    return tuple(value.items())
+            elif isinstance(value, list):
+                items = []
+                for x in value:
+                    items.append((yield from convert(x, ctx)))
+                return tuple(items)
+            elif value is None:
+                type_stats[ctx][spec_types.Null] += 1
+            return value
+
+        def visit(node, ctx):
+            real_type = self.schema.types[node['type']]
+            type_stats[ctx][real_type] += 1
+
+            fields = {}
+            for k, v in node.items():
+                fields[k] = yield from convert(v, (real_type, k))
+
+            return self._intern(real_type, fields, indices)
+
+        trampoline(convert(tree, (None, None)))
+        return type_stats
+
+    def _graphify_events(self, events):
+        """
+        Builds the node table from JSON parse events, hash-consing each node as it closes
+        so the AST is never held in memory. Produces the same nodes and statistics as
+        _graphify().
+        """
+        indices = {}
+        types = self.schema.types
+
+        # a node's type may only be known once it closes, so statistics are gathered
+        # per (context, type) along with the pre-order position of their first use
+        seen = {}
+        root_pending = []
+        order = 0
+
+        # map frames hold [True, node, current key, pending stats, position] and array
+        # frames [False, items, pending stats of owner, key of owner]
+        stack = []
+
+        def record(pending, ctx_type):
+            for position, field, real_type in pending:
+                key = ((ctx_type, field), real_type)
+                entry = seen.get(key)
+                if entry is None:
+                    seen[key] = [position, 1]
+                else:
+                    # inner nodes close before the outer ones that precede them
+                    entry[0] = min(entry[0], position)
+                    entry[1] += 1
+
+        for event, value in events:
+            if event == 'key':
+                stack[-1][2] = value
+                continue
+            elif event == 'start_map':
+                stack.append([True, {}, None, [], order])
+                order += 1
+                continue
+            elif event == 'start_array':
+                if not stack:
+                    stack.append([False, [], root_pending, None])
+                elif stack[-1][0]:
+                    stack.append([False, [], stack[-1][3], stack[-1][2]])
+                else:
+                    stack.append([False, [], stack[-1][2], stack[-1][3]])
+                continue
+
+            stat = None
+            if event == 'end_map':
+                _, node, _, pending, position = stack.pop()
                 if 'type' in node:
-                    real_type = getattr(self.spec, node['type'])
-                    type_stats[ctx_type, ctx_field][real_type] += 1
-
-                    for k, v in node.items():
-                        ctx_stack.append((real_type, k))
-                        node[k] = traverse(v)
-                        ctx_stack.pop()
-
-                    flat_node = tuple(node.items())
-                    try:
-                        index = indices[flat_node]
-                    except KeyError:
-                        index = len(self.nodes)
-                        self.nodes.append(node)
-                        indices[flat_node] = index
-
-                    return index
+                    real_type = types[node['type']]
+                    record(pending, real_type)
+                    stat = position, real_type
+
+                    value = self._intern(real_type, node, indices)
                 else:
-                    return tuple(node.items())
-            elif isinstance(node, list):
-                return tuple(map(traverse, node))
-            elif node is None:
-                type_stats[ctx_type, ctx_field][spec_types.Null] += 1
-            return node
-
-        traverse(tree)
+                    value = tuple(node.items())
+            elif event == 'end_array':
+                value = tuple(stack.pop()[1])
+            elif value is None:
+                stat = order, spec_types.Null
+                order += 1
+
+            if not stack:
+                pending, field = root_pending, None
+            elif stack[-1][0]:
+                _, node, field, pending, _ = stack[-1]
+                node[field] = value
+            else:
+                _, items, pending, field = stack[-1]
+                items.append(value)
+
+            if stat:
+                pending.append((stat[0], field, stat[1]))
+
+        record(root_pending, None)
+
+        type_stats = defaultdict(Counter)
+        for (ctx, real_type), (_, count) in sorted(seen.items(), key=lambda x: x[1][0]):
+            type_stats[ctx][real_type] = count
         return type_stats
 
-    def encode(self):
-        type_stats = self._graphify(self.tree)
+    def encode_header(self):
+        """
+        Builds the node table, then writes the bitmap of used types and the codebooks, unless
+        they're taken from a profile.
+        """
+        self.write_header(self.build_graph())
+
+    def build_graph(self):
+        """
+        Builds the node table from the AST or its events.
+        :return: The counts of child types in each node-referencing field.
+        """
+        if self.events is not None:
+            return self._graphify_events(self.events)
+        return self._graphify(self.tree)
+
+    def write_header(self, type_stats):
+        """Writes the bitmap of used types and the codebooks built from ``type_stats``."""
+        if self.profile is not None:
+            self.used_types[:] = self.profile.used_types
+            self.contexts.update(self.profile.contexts)
+            return
 
         # TODO: filter out Node types that shouldn't be codeable
-        all_types = subclasses(spec_types.Node)
-        used_types_set = {getattr(self.spec, x['type']) for x in self.nodes}
+        all_types = self.schema.node_types
+        used_types_set = {x[0] for x in self.nodes}
         for x in all_types:
             self.writer.write_bool(x in used_types_set)
         self.used_types.extend(x for x in all_types if x in used_types_set)
 
         self._prepare_huffman(type_stats)
+        if self.tans:
+            self._prepare_enums()
         logger.debug(f'Codebook size: {self.writer.tell()} bits')
 
-        self._encode_node_inner(self.spec.root_type, self.nodes[-1])
+    def encode_node(self, node_type, node):
+        """
+        Encodes a node and its children using the codebooks of the header, then flushes
+        the bitstream. With tANS, the nodes are coded as an ANS stream preceded by the
+        codebooks of MTF ranks.
+        :return: The strings used, in order.
+        """
+        if self.tans:
+            writer, self.writer = self.writer, ANSWriter()
+
+        if self.codegen:
+            encode_tree = encoder_factory(self.schema, self.tans)(self)
+            encode_tree(node_type, node)
+        else:
+            trampoline(self._encode_node_inner(node_type, node))
+
+        if self.tans:
+            stream, self.writer = self.writer, writer
+            self._write_rank_codebook(self.rank_code, writer)
+            self._write_rank_codebook(self.string_rank_code, writer)
+            stream.finish(writer)
 
         self.writer.flush()
 
         return self.string_table
+
+    def encode(self):
+        self.encode_header()
+        return self.encode_node(self.schema.root_type, self.nodes[-1])
@@ -0,0 +1,161 @@
+"""
+Codes numeric literals without going through ``Decimal``.
+
+A number is coded as the digits of its coefficient, each with the ``vardecimal`` Huffman
+code and followed by its terminator, then a sign bit if there are any digits, then the
+exponent as a signed exp-Golomb integer. Digits are written and read several at a time
+using precomputed tables, with the same bits as coding them one by one.
+"""
+import re
+from decimal import Decimal
+from bonsai.huffman import CanonicalCode
+
+vardecimal = CanonicalCode((None, 0, 1, 2, 3, 4, 5, 6, 7, 8, 9), (0, 1, 2, 8))
+
+# a number as it appears in JSON source
+NUMBER = re.compile(r'(-?)([0-9]*)(?:\.([0-9]*))?(?:[eE]([-+]?[0-9]+))?')
+
+# the number of digits written with a single table lookup
+GROUP_DIGITS = 3
+
+# the number of bits peeked at once when reading digits
+READ_BITS = 12
+
+
+def _build_write_tables():
+    """Maps digit strings of up to GROUP_DIGITS digits to their codes, without and with the terminator."""
+    codes = {None if d is None else str(d): code
+             for d, code in vardecimal._build_code_map().items()}
+    end_length, end_code = codes[None]
+
+    groups = {'': (0, 0)}
+    for _ in range(GROUP_DIGITS):
+        for prefix, (value, bits) in list(groups.items()):
+            for digit in '0123456789':
+                length, code = codes[digit]
+                groups[prefix + digit] = (value << length | code, bits + length)
+
+    terminated = {k: (value << end_length | end_code, bits + end_length)
+                  for k, (value, bits) in groups.items()}
+
+    # small non-negative integers: digits, terminator, sign and a zero exponent at once
+    small_ints = {k: (value << 2 | 1, bits + 2) for k, (value, bits) in terminated.items() if k}
+
+    return groups, terminated, small_ints
+
+
+def _build_read_table():
+    """
+    Maps every READ_BITS-bit window to the digits of the complete codes at its start,
+    the number of bits they take and whether the terminator was among them.
+    """
+    codes = {(length, code): symbol for symbol, (length, code) in vardecimal._build_code_map().items()}
+    max_length = len(vardecimal.length_counts)
+
+    def match(window, pos):
+        for length in range(1, min(max_length, READ_BITS - pos) + 1):
+            code = window >> (READ_BITS - pos - length) & (1 << length) - 1
+            if (length, code) in codes:
+                return codes[length, code], length
+        return None
+
+    table = []
+    for window in range(1 << READ_BITS):
+        digits = ''
+        pos = 0
+        done = False
+        while not done:
+            entry = match(window, pos)
+            if entry is None:
+                # the next code continues past the window
+                break
+            symbol, length = entry
+            pos += length
+            if symbol is None:
+                done = True
+            else:
+                digits += str(symbol)
+        table.append((digits, pos, done))
+
+    return table
+
+
+GROUPS, TERMINATED, SMALL_INTS = _build_write_tables()
+READ_TABLE = _build_read_table()
+
+
+def parse(value):
+    """
+    Splits a number into the parts of ``Decimal(value).as_tuple()``, except that zero has
+    no digits. Returns None for values other than numeric text and integers.
+    :return: A tuple of the sign, the digits as a string, and the exponent.
+    """
+    if isinstance(value, int) and not isinstance(value, bool):
+        value = str(value)
+    elif not isinstance(value, str):
+        return None
+
+    match = NUMBER.fullmatch(value)
+    if match is None:
+        return None
+
+    sign, whole, fraction, exponent = match.groups()
+    fraction = fraction or ''
+    if not whole and not fraction:
+        return None
+
+    exponent = int(exponent) if exponent else 0
+    return bool(sign), (whole + fraction).lstrip('0'), exponent - len(fraction)
+
+
+def write_number(value, writer):
+    """
+    Writes a number to the bitstream.
+    :param value: Numeric text, as parsed with ``parse_int=str`` and ``parse_float=str``,
+                  or any value accepted by ``Decimal``.
+    """
+    parts = parse(value)
+    if parts is None:
+        dt = Decimal(value).as_tuple()
+        parts = dt.sign, ''.join(map(str, dt.digits)).lstrip('0'), dt.exponent
+    sign, digits, exponent = parts
+
+    if not exponent and not sign and 0 < len(digits) <= GROUP_DIGITS:
+        writer.write_uint(*SMALL_INTS[digits])
+        return
+
+    end = len(digits) - GROUP_DIGITS
+    pos = 0
+    while pos < end:
+        writer.write_uint(*GROUPS[digits[pos:pos + GROUP_DIGITS]])
+        pos += GROUP_DIGITS
+    writer.write_uint(*TERMINATED[digits[pos:]])
+
+    if digits:
+        writer.write_bool(sign)
+
+    writer.write_se(exponent)
+
+
+def read_number(reader):
+    """
+    Reads a number from the bitstream.
+    :return: An int if the exponent is zero, otherwise a float.
+    """
+    digits = ''
+    while True:
+        more, bits, done = READ_TABLE[reader.peek(READ_BITS)]
+        reader.consume(bits)
+        digits += more
+        if done:
+            break
+
+    sign = reader.read_bool() if digits else False
+    exponent = reader.read_se()
+
+    if exponent:
+        # float() rounds the same way as converting through Decimal
+        return float(f'{"-" if sign else ""}{digits or "0"}e{exponent}')
+    value = int(digits) if digits else 0
+    return -value if sign else value
+
@@ -0,0 +1,160 @@
+"""
+Codes the top-level nodes of an AST in independent segments.
+
+All segments share the type bitmap and codebooks of one header, but each has its own
+bitstream, strings and recency state, so they can be encoded and decoded in parallel.
+The list of nodes to split is found by following the spec's ``segment_path`` from the
+root, e.g. ``FunctionBody.statements`` for scripts. The header stream holds the rest of
+the tree (the trunk) with that list left empty.
+"""
+from io import BytesIO
+from importlib import import_module
+from concurrent.futures import ProcessPoolExecutor
+from bonsai.codec.decoder import GraphDecoder
+from bonsai.codec.encoder import GraphEncoder
+
+# per-process state, set up by _init_encoder or _init_decoder
+_state = None
+
+
+def _split(items, count):
+    """Splits a sequence into ``count`` contiguous parts of near-equal length."""
+    count = min(count, len(items))
+    if not count:
+        return []
+    bounds = [len(items) * i // count for i in range(count + 1)]
+    return [items[a:b] for a, b in zip(bounds, bounds[1:])]
+
+
+def _replace(schema, node, key, value):
+    """Returns a copy of a node record with one of its fields replaced."""
+    i = schema.field_positions[node[0]][key]
+    return node[:i] + (value,) + node[i + 1:]
+
+
+def split_tree(encoder, count):
+    """
+    Splits the node table of an encoder whose header has been written.
+    :param count: The maximum number of segments, at least 1.
+    :return: The trunk and a list of segment nodes. The trunk is the root node with the
+             list at ``segment_path`` emptied. Each segment node is a copy of the node
+             owning that list, holding a part of it.
+    """
+    if count < 1:
+        raise ValueError(f'The number of segments must be at least 1, not {count}')
+    *ref_keys, list_key = encoder.spec.segment_path
+    nodes = encoder.nodes
+    schema = encoder.schema
+
+    path = [nodes[-1]]
+    for key in ref_keys:
+        path.append(nodes[path[-1][schema.field_positions[path[-1][0]][key]]])
+
+    owner = path[-1]
+    items = owner[schema.field_positions[owner[0]][list_key]]
+    segments = [_replace(schema, owner, list_key, part) for part in _split(items, count)]
+
+    # rebuild the path down to the owner around the emptied list
+    trunk = _replace(schema, owner, list_key, ())
+    for key, node in zip(reversed(ref_keys), reversed(path[:-1])):
+        nodes.append(trunk)
+        trunk = _replace(schema, node, key, len(nodes) - 1)
+
+    return trunk, segments
+
+
+def _init_encoder(spec_name, nodes, used_types, contexts, options):
+    global _state
+    _state = import_module(spec_name), nodes, used_types, contexts, options
+
+
+def _encode_segment(node):
+    spec, nodes, used_types, contexts, options = _state
+    with BytesIO() as buf:
+        e = GraphEncoder(spec, None, buf, **options)
+        e.nodes, e.used_types, e.contexts = nodes, used_types, contexts
+        strings = e.encode_node(node[0], node)
+        return buf.getvalue(), strings
+
+
+def encode_segments(encoder, segments, jobs=None):
+    """
+    Encodes segment nodes with the codebooks of an encoder.
+    :param jobs: The number of worker processes, or None to encode in this process.
+    :return: The bitstream and strings of each segment.
+    """
+    options = dict(codegen=encoder.codegen, blobs=encoder.blobs, string_refs=encoder.string_refs,
+                   profile=encoder.profile, tans=encoder.tans)
+    initargs = (encoder.spec.__name__, encoder.nodes, encoder.used_types, encoder.contexts, options)
+    return _run(_init_encoder, initargs, _encode_segment, [segments], jobs)
+
+
+def _init_decoder(spec_name, header, options):
+    global _state
+    d = GraphDecoder(header, import_module(spec_name), (), **options)
+    d.read_header()
+    _state = d.spec, d.used_types, d.contexts, options
+
+
+def _decode_segment(owner_type, data, strings):
+    spec, used_types, contexts, options = _state
+    d = GraphDecoder(data, spec, strings, tree=False, **options)
+    d.used_types, d.contexts = used_types, contexts
+    d.nodes.append(d.decode_node(d.schema.types[owner_type]))
+    return d.nodes
+
+
+def _link(schema, nodes):
+    """Replaces node indices with the nodes themselves, in a list decoded with ``tree=False``."""
+    for node in nodes:
+        for (_, key), _ in schema.ref_fields[schema.types[node['type']]]:
+            value = node[key]
+            if isinstance(value, tuple):
+                node[key] = tuple(None if x is None else nodes[x] for x in value)
+            elif value is not None:
+                node[key] = nodes[value]
+    return nodes[-1]
+
+
+def decode_segments(decoder, header, trunk, segments, jobs=None):
+    """
+    Decodes segments and joins their nodes into the trunk.
+    :param decoder: The decoder of the header.
+    :param header: The header bitstream, for worker processes to read the codebooks from.
+    :param trunk: The root node decoded from the header.
+    :param segments: The bitstream and strings of each segment.
+    :param jobs: The number of worker processes, or None to decode in this process.
+    :return: The root node.
+    """
+    *ref_keys, list_key = decoder.spec.segment_path
+    owner = trunk
+    for key in ref_keys:
+        owner = owner[key]
+
+    if jobs is not None and jobs > 1:
+        # memoryviews of the file can't be sent to worker processes
+        header = bytes(header)
+        segments = [(bytes(data), strings) for data, strings in segments]
+
+    args = list(zip(*segments)) or [(), ()]
+    options = dict(codegen=decoder.codegen, blobs=decoder.blobs, string_refs=decoder.string_refs,
+                   profile=decoder.profile, tans=decoder.tans)
+    initargs = (decoder.spec.__name__, header, options)
+    results = _run(_init_decoder, initargs, _decode_segment,
+                   [[owner['type']] * len(segments)] + args, jobs)
+
+    items = []
+    for nodes in results:
+        items.extend(_link(decoder.schema, nodes)[list_key])
+    owner[list_key] = tuple(items)
+
+    return trunk
+
+
+def _run(initializer, initargs, fn, args, jobs):
+    if jobs is None or jobs <= 1:
+        initializer(*initargs)
+        return list(map(fn, *args))
+
+    with ProcessPoolExecutor(jobs, initializer=initializer, initargs=initargs) as pool:
+        return list(pool.map(fn, *args))
@@ -0,0 +1,41 @@
+"""
+The interface of the entropy coders used for the symbols of a context, e.g. the node types
+of a field. Canonical Huffman codes are the default, table ANS codes are used for files
+with the ``FLAG_TANS`` flag.
+"""
+import abc
+
+
+class SymbolCode(abc.ABC):
+    __slots__ = ()
+
+    @property
+    @abc.abstractmethod
+    def symbols(self):
+        """The symbols that can be coded."""
+
+    @classmethod
+    @abc.abstractmethod
+    def from_counts(cls, counts):
+        """Returns a code built from a mapping of symbols to frequency counts."""
+
+    @abc.abstractmethod
+    def write_symbol(self, symbol, writer):
+        """Writes a symbol to the bitstream."""
+
+    @abc.abstractmethod
+    def read_symbol(self, reader):
+        """Reads a symbol from the bitstream."""
+
+    @abc.abstractmethod
+    def cost(self, counts):
+        """Estimates the bits of coding symbols with the given frequency counts."""
+
+    @abc.abstractmethod
+    def write_codebook(self, alphabet, writer):
+        """Serializes the code, given a known sequence containing its symbols."""
+
+    @classmethod
+    @abc.abstractmethod
+    def read_from_codebook(cls, reader, alphabet):
+        """Reads a code serialized with write_codebook()."""
@@ -1,60 +1,451 @@
+import io
+import mmap
 import logging
+import contextlib
 import brotli
 from io import BytesIO
+from bonsai import profile as profiles
 from bonsai.codec import decoder, encoder
+from bonsai.codec.segments import split_tree, encode_segments, decode_segments
+from bonsai.nodetable import NodeTable
+from bonsai.stringsection import StringSection, StringCompressor
 
 logger = logging.getLogger(__name__)
+
+# files start with the magic and the format version, followed by the name of the spec, 4 bytes
+# of flags, the 4-byte ID of the profile if FLAG_PROFILE is set, and the directory of sections
+MAGIC_CONTAINER = '盆器'.encode('utf-16-be')
+FORMAT_VERSION = 1
+
+# files from before the directory, read as version 0. They have no flags, and each section
+# is preceded by its length
 MAGIC = '盆栽'.encode('utf-16-be')
 
+FLAG_SEGMENTED = 1
+FLAG_BLOBS = 2
+FLAG_STRING_REFS = 4
+FLAG_PROFILE = 8
+FLAG_TANS = 16
+FLAG_NAMES = {FLAG_SEGMENTED: 'segmented', FLAG_BLOBS: 'blobs', FLAG_STRING_REFS: 'string refs',
+              FLAG_PROFILE: 'profile', FLAG_TANS: 'tans'}
+
+# the kinds of sections. Directory entries hold a section's kind, then its offset from the
+# start of the file, length and uncompressed length as 4-byte integers
+SECTION_STRINGS = 1
+SECTION_GRAPH = 2
+SECTION_SEGMENTS = 3
+SECTION_NAMES = {SECTION_STRINGS: 'strings', SECTION_GRAPH: 'graph', SECTION_SEGMENTS: 'segments'}
+DIRECTORY_ENTRY_SIZE = 13
+
+
+class Section:
+    __slots__ = ('kind', 'offset', 'length', 'size')
+
+    def __init__(self, kind, offset, length, size):
+        """
+        :param kind: One of the ``SECTION_*`` constants.
+        :param offset: The position of the section in the file, in bytes.
+        :param length: The length of the section in the file, in bytes.
+        :param size: The length of the section once decompressed, in bytes.
+        """
+        self.kind = kind
+        self.offset = offset
+        self.length = length
+        self.size = size
+
+    @property
+    def end(self):
+        return self.offset + self.length
+
+    def __repr__(self):
+        return (f'Section({SECTION_NAMES.get(self.kind, self.kind)}, offset={self.offset}, '
+                f'length={self.length}, size={self.size})')
+
+
+class Header:
+    __slots__ = ('version', 'spec_name', 'flags', 'profile_id', 'sections')
+
+    def __init__(self, version, spec_name, flags, profile_id, sections):
+        """
+        :param version: The format version, or 0 for files from before the directory.
+        :param spec_name: The name of the spec the file was encoded with, see
+                          ``spec_name()``. Unknown for version 0.
+        :param flags: The ``FLAG_*`` bits of the file.
+        :param profile_id: The ID of the profile the file was encoded with, if any.
+        :param sections: The Sections of the file, in order.
+        """
+        self.version = version
+        self.spec_name = spec_name
+        self.flags = flags
+        self.profile_id = profile_id
+        self.sections = sections
+
+    def section(self, kind, required=False):
+        """
+        Returns the first Section of a kind, or None if the file has none.
+        :param required: Raise a ValueError rather than return None.
+        """
+        section = next((x for x in self.sections if x.kind == kind), None)
+        if section is None and required:
+            raise ValueError(f'missing section {SECTION_NAMES[kind]}')
+        return section
+
+
+def spec_name(spec):
+    """Returns the name files record for a spec module, relative to ``bonsai.specs``."""
+    name = spec.__name__
+    return name[len('bonsai.specs.'):] if name.startswith('bonsai.specs.') else name
+
+
+def compress_section(data, profile=None):
+    return profile.compress(data) if profile else brotli.compress(data)
+
+
+def decompress_section(compressed, profile=None):
+    return profile.decompress(compressed) if profile else brotli.decompress(compressed)
+
+
+def write_container(fp, spec, flags, profile, sections):
+    """
+    Writes the header and the directory of sections, followed by the sections themselves.
+    :param sections: ``(kind, data, size)`` for each section, where ``size`` is the length
+                     of its data once decompressed.
+    """
+    name = spec_name(spec).encode('utf-8')
+    header = bytearray(MAGIC_CONTAINER)
+    header.append(FORMAT_VERSION)
+    header.append(len(name))
+    header += name
+    header += flags.to_bytes(4, 'big')
+    if profile:
+        header += profile.id.to_bytes(4, 'big')
+
+    header.append(len(sections))
+    offset = len(header) + DIRECTORY_ENTRY_SIZE * len(sections)
+    for kind, data, size in sections:
+        header.append(kind)
+        header += offset.to_bytes(4, 'big')
+        header += len(data).to_bytes(4, 'big')
+        header += size.to_bytes(4, 'big')
+        offset += len(data)
+
+    fp.write(header)
+    for _, data, _ in sections:
+        fp.write(data)
+
+
+def read_header(fp):
+    """
+    Parses the header of a file and its directory of sections, without reading the
+    sections themselves.
+    :param fp: A file object positioned at the start of the file, or a bytes-like object
+               holding the file, e.g. an mmap.
+    :rtype: Header
+    """
+    read, file_size = _read_at(fp)
+    magic = bytes(read(0, 4))
+    if magic == MAGIC:
+        return _read_legacy_header(read)
+    if magic != MAGIC_CONTAINER:
+        raise ValueError('Not a Bonsai format file')
+
+    version, name_len = read(4, 2)
+    if version > FORMAT_VERSION:
+        raise ValueError(f'Unsupported format version: {version}')
+    name = str(read(6, name_len), 'utf-8')
+    pos = 6 + name_len
+
+    flags = _uint32(read(pos, 4))
+    pos += 4
+    _check_flags(flags)
+    profile_id = None
+    if flags & FLAG_PROFILE:
+        profile_id = _uint32(read(pos, 4))
+        pos += 4
+
+    count = read(pos, 1)[0]
+    directory = read(pos + 1, DIRECTORY_ENTRY_SIZE * count)
+    sections = []
+    for pos in range(0, len(directory), DIRECTORY_ENTRY_SIZE):
+        entry = directory[pos:pos + DIRECTORY_ENTRY_SIZE]
+        offset, length, size = _uint32(entry[1:5]), _uint32(entry[5:9]), _uint32(entry[9:13])
+        if offset + length > file_size:
+            raise ValueError('Truncated file')
+        sections.append(Section(entry[0], offset, length, size))
+    return Header(version, name, flags, profile_id, sections)
+
+
+def _read_legacy_header(read):
+    pos = 4
+    size, length = _uint32(read(pos, 4)), _uint32(read(pos + 4, 4))
+    sections = [Section(SECTION_STRINGS, pos + 8, length, size)]
+    pos += 8 + length
+    length = _uint32(read(pos, 4))
+    sections.append(Section(SECTION_GRAPH, pos + 4, length, length))
+    return Header(0, None, 0, None, sections)
 
-def write_compressed_section(data, fp):
-    compressed = brotli.compress(data)
-    compressed_len = len(compressed)
-    fp.write(len(data).to_bytes(4, 'big'))
-    fp.write(compressed_len.to_bytes(4, 'big'))
-    fp.write(compressed)
-    return compressed_len
 
+def _check_flags(flags):
+    if flags & ~sum(FLAG_NAMES):
+        raise ValueError(f'Unsupported format flags: {flags:#x}')
 
-def read_compressed_section(fp):
-    fp.seek(4, 1)  # don't need this for now
-    compressed_len = int.from_bytes(fp.read(4), 'big')
-    compressed = fp.read(compressed_len)
-    return brotli.decompress(compressed)
 
+def _read_at(fp):
+    """
+    Returns a function that reads a number of bytes at a position in a file, along with
+    the size of the file. Seekable files are only read where needed.
+    """
+    if hasattr(fp, 'seekable') and fp.seekable() and not isinstance(fp, mmap.mmap):
+        base = fp.tell()
+        file_size = fp.seek(0, io.SEEK_END) - base
 
-def encode(spec, ast, fp):
+        def read(pos, n):
+            fp.seek(base + pos)
+            return fp.read(n)
+    else:
+        view = _buffer(fp)
+        file_size = len(view)
+
+        def read(pos, n):
+            return view[pos:pos + n]
+    return read, file_size
+
+
+def _buffer(fp):
+    """Returns a memoryview of a bytes-like object such as an mmap, or of the rest of a file."""
+    try:
+        return memoryview(fp)
+    except TypeError:
+        return memoryview(fp.read())
+
+
+@contextlib.contextmanager
+def map_file(fp):
+    """
+    Maps a file into memory, so it can be decoded without reading it. Files that can't be
+    mapped, like pipes or empty files, are passed through as they are.
+    :param fp: A file object opened for reading in binary mode.
+    """
+    try:
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError, io.UnsupportedOperation):
+        yield fp
+        return
+    with data:
+        yield data
+
+
+def _uint32(data):
+    return int.from_bytes(data, 'big')
+
+
+def encode(spec, ast, fp, codegen=True, segments=None, jobs=None, lazy=False, string_refs=False,
+           profile=None, tans=False, pipeline=False):
+    """
+    :param segments: Split the top-level nodes into up to this many independently coded
+                     segments, see ``bonsai.codec.segments``. Must be at least 1.
+    :param jobs: The number of processes to encode segments with.
+    :param lazy: Code nodes of the spec's ``lazy_types`` as blobs that can be decoded
+                 on demand.
+    :param string_refs: Store each distinct string once, and code string fields as
+                        references to the string table.
+    :param profile: A bonsai.profile.Profile to code the file with. Decoding the file
+                    requires the same profile.
+    :param tans: Code node types, enums and MTF ranks with table ANS rather than Huffman
+                 codes, see ``bonsai.ans``. Can't be combined with a profile.
+    :param pipeline: Compress the string table in a worker thread while the graph is
+                     encoded. The output is the same.
+    """
+    _encode(spec, fp, codegen, segments, jobs, lazy, string_refs, profile, tans, pipeline,
+            ast, None)
+
+
+def encode_events(spec, events, fp, codegen=True, segments=None, jobs=None, lazy=False,
+                  string_refs=False, profile=None, tans=False, pipeline=False):
+    """
+    Encodes an AST given as JSON parse events, without building it in memory first.
+    :param events: ``(event, value)`` pairs, e.g. from ``bonsai.jsonevents.iter_events``.
+    """
+    _encode(spec, fp, codegen, segments, jobs, lazy, string_refs, profile, tans, pipeline,
+            None, events)
+
+
+def _encode(spec, fp, codegen, segments, jobs, lazy, string_refs, profile, tans, pipeline,
+            ast, events):
+    if segments is not None and segments < 1:
+        raise ValueError(f'The number of segments must be at least 1, not {segments}')
     logger.info('Encoding...')
 
     with BytesIO() as buf:
-        e = encoder.GraphEncoder(spec, ast, buf)
-        string_table = e.encode()
+        e = encoder.GraphEncoder(spec, ast, buf, codegen=codegen, events=events, blobs=lazy,
+                                 string_refs=string_refs, profile=profile, tans=tans)
+        compressor = None
+        if pipeline:
+            # picks up strings as the encoder appends them, including those of segments
+            compressor = StringCompressor(e.string_table,
+                                          profile.compressor() if profile else brotli.Compressor())
+        try:
+            e.encode_header()
+            if segments is None:
+                string_table = e.encode_node(spec.root_type, e.nodes[-1])
+            else:
+                trunk, segment_nodes = split_tree(e, segments)
+                string_table = e.encode_node(spec.root_type, trunk)
+                encoded_segments = encode_segments(e, segment_nodes, jobs)
+                for _, segment_strings in encoded_segments:
+                    string_table.extend(segment_strings)
+        except BaseException:
+            if compressor is not None:
+                compressor.cancel()
+            raise
         graph_data = buf.getvalue()
 
-    fp.write(MAGIC)
+    flags = ((FLAG_SEGMENTED if segments is not None else 0) | (FLAG_BLOBS if lazy else 0) |
+             (FLAG_STRING_REFS if string_refs else 0) | (FLAG_PROFILE if profile else 0) |
+             (FLAG_TANS if tans else 0))
 
-    string_table_bin = b'\0'.join(x.encode('utf-8') for x in string_table)
-    string_table_packed_len = write_compressed_section(string_table_bin, fp)
+    if compressor is not None:
+        string_table_len, string_table_packed = compressor.finish()
+    else:
+        string_table_bin = b'\0'.join(x.encode('utf-8') for x in string_table)
+        string_table_len = len(string_table_bin)
+        string_table_packed = compress_section(string_table_bin, profile)
 
+    sections = [(SECTION_STRINGS, string_table_packed, string_table_len),
+                (SECTION_GRAPH, graph_data, len(graph_data))]
     graph_data_len = len(graph_data)
-    fp.write(graph_data_len.to_bytes(4, 'big'))
-    fp.write(graph_data)
 
-    logger.info(f'String table: {string_table_packed_len: 8,} bytes')
+    if segments is not None:
+        # directory of segment sizes and string counts, followed by their data
+        segment_data = [len(encoded_segments).to_bytes(4, 'big')]
+        for data, segment_strings in encoded_segments:
+            segment_data.append(len(data).to_bytes(4, 'big'))
+            segment_data.append(len(segment_strings).to_bytes(4, 'big'))
+            graph_data_len += len(data)
+        segment_data.extend(data for data, _ in encoded_segments)
+        segment_data = b''.join(segment_data)
+        sections.append((SECTION_SEGMENTS, segment_data, len(segment_data)))
+        logger.info(f'    Segments: {len(encoded_segments): 8,}')
+
+    write_container(fp, spec, flags, profile, sections)
+
+    logger.info(f'String table: {len(string_table_packed): 8,} bytes')
     logger.info(f' Syntax tree: {graph_data_len: 8,} bytes')
     logger.info(f'  Total size: {fp.tell(): 8,} bytes')
 
 
-def decode(spec, fp):
+def _read_sections(view, header, spec, profile_dir=None, pipeline=False):
+    """
+    Takes the sections the file has from its directory. The graph bitstream and segments
+    are views of the file rather than copies.
+    :param view: A bytes-like object holding the file.
+    :param header: The file's Header, see ``read_header``.
+    :param spec: The spec module the file should have been encoded with.
+    :param profile_dir: The directory to look up the file's profile in, if it has one.
+    :param pipeline: Decompress the string table in a worker thread.
+    :return: The profile or None, the string table as a StringSection, the graph bitstream
+             and the segments section, if any.
+    """
+    if header.spec_name is not None and header.spec_name != spec_name(spec):
+        raise ValueError(f'The file was encoded with the {header.spec_name} spec')
+
+    profile = None
+    if header.profile_id is not None:
+        profile = profiles.find(header.profile_id, profile_dir)
+
+    strings = header.section(SECTION_STRINGS, required=True)
+    graph = header.section(SECTION_GRAPH, required=True)
+    compressed = view[strings.offset:strings.end]
+    if pipeline:
+        decompressor = profile.decompressor() if profile else brotli.Decompressor()
+        string_table = StringSection.load(decompressor, compressed)
+    else:
+        data = decompress_section(compressed, profile)
+        if len(data) != strings.size and header.version:
+            raise ValueError('Corrupt string section')
+        string_table = StringSection(data)
+
+    segments = header.section(SECTION_SEGMENTS, required=bool(header.flags & FLAG_SEGMENTED))
+    return (profile, string_table, view[graph.offset:graph.end],
+            segments and view[segments.offset:segments.end])
+
+
+def decode(spec, fp, codegen=True, jobs=None, lazy=False, profile_dir=None, pipeline=False):
+    """
+    :param fp: A file object to read from, or a bytes-like object holding the file, e.g.
+               an mmap. The file's sections are then decoded without copying them.
+    :param jobs: The number of processes to decode segments with, if the file has any.
+    :param lazy: Return nodes that were coded as blobs as LazyNode proxies, which are
+                 decoded on first access. Segments are always decoded in full. The
+                 proxies keep a copy of the graph bitstream rather than a view of ``fp``,
+                 so they can outlive e.g. an mmap of the file.
+    :param profile_dir: The directory holding profiles, see ``bonsai.profile.find``.
+    :param pipeline: Decompress the string table in a worker thread while the graph is
+                     decoded, only waiting for strings that aren't ready yet. Segmented
+                     files wait for the whole table before decoding.
+    """
     logger.info('Decoding...')
 
-    if fp.read(4) != MAGIC:
-        raise ValueError('Not a Bonsai format file')
+    view = _buffer(fp)
+    header = read_header(view)
+    profile, string_table, graph_data, rest = _read_sections(view, header, spec, profile_dir,
+                                                             pipeline)
+    flags = header.flags
+    options = dict(codegen=codegen, blobs=bool(flags & FLAG_BLOBS),
+                   string_refs=bool(flags & FLAG_STRING_REFS), profile=profile,
+                   tans=bool(flags & FLAG_TANS))
+
+    if not flags & FLAG_SEGMENTED:
+        if lazy:
+            # the proxies read their blobs after decode() returns
+            graph_data = bytes(graph_data)
+        d = decoder.GraphDecoder(graph_data, spec, string_table, lazy=lazy, **options)
+        decoded = d.decode()
+        if pipeline:
+            # the worker may still hold a view of the file, which has to be released before
+            # e.g. an mmap of it is closed
+            string_table.loader.join()
+        return decoded
+
+    directory = []
+    for pos in range(4, 8 * _uint32(rest[:4]) + 4, 8):
+        directory.append((_uint32(rest[pos:pos + 4]), _uint32(rest[pos + 4:pos + 8])))
+
+    # the strings of the trunk come first, followed by those of each segment
+    pos = len(string_table) - sum(count for _, count in directory)
+    d = decoder.GraphDecoder(graph_data, spec, string_table[:pos], **options)
+    trunk = d.decode()
+
+    encoded_segments = []
+    offset = 8 * len(directory) + 4
+    for segment_len, count in directory:
+        encoded_segments.append((rest[offset:offset + segment_len], string_table[pos:pos + count]))
+        offset += segment_len
+        pos += count
+
+    return decode_segments(d, graph_data, trunk, encoded_segments, jobs)
+
+
+def decode_table(spec, fp, codegen=True, profile_dir=None):
+    """
+    Decodes a file into a columnar NodeTable rather than a tree of dicts.
+    :param fp: A file object, or a bytes-like object holding the file.
+    :rtype: bonsai.nodetable.NodeTable
+    """
+    logger.info('Decoding...')
 
-    string_table_bin = read_compressed_section(fp)
-    string_table = [x.decode('utf-8') for x in string_table_bin.split(b'\0')]
+    view = _buffer(fp)
+    header = read_header(view)
+    flags = header.flags
+    if flags & FLAG_SEGMENTED:
+        raise ValueError('Segmented files cannot be decoded to a node table')
 
-    fp.seek(4, 1)  # not sure we need this either
+    profile, string_table, graph_data, _ = _read_sections(view, header, spec, profile_dir)
 
-    d = decoder.GraphDecoder(fp, spec, string_table)
+    # string fields are decoded as indices into the section, which the table decodes on access
+    d = decoder.GraphDecoder(graph_data, spec, range(len(string_table)), tree=False,
+                             codegen=codegen, blobs=bool(flags & FLAG_BLOBS),
+                             string_refs=bool(flags & FLAG_STRING_REFS), profile=profile,
+                             tans=bool(flags & FLAG_TANS))
+    d.nodes = NodeTable(d.schema, string_table)
     return d.decode()
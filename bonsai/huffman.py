@@ -1,5 +1,6 @@
-import queue
+import heapq
 import collections
+from bonsai.entropy import SymbolCode
 
 
 class HuffmanNode:
@@ -34,17 +35,16 @@ def construct_tree(counts):
     Constructs a Huffman tree from a mapping of symbols to frequency counts.
     :rtype: InternalNode or LeafNode
     """
-    pq = queue.PriorityQueue()
+    heap = []
 
     for s, c in counts.items():
-        pq.put(LeafNode(c, s))
+        heapq.heappush(heap, LeafNode(c, s))
 
-    while pq.qsize() > 1:
-        a, b = pq.get(), pq.get()
-        n = InternalNode(a.weight + b.weight, a, b)
-        pq.put(n)
+    while len(heap) > 1:
+        a, b = heapq.heappop(heap), heapq.heappop(heap)
+        heapq.heappush(heap, InternalNode(a.weight + b.weight, a, b))
 
-    return pq.get()
+    return heap[0]
 
 
 def code_lengths(tree):
@@ -68,15 +68,44 @@ def code_lengths(tree):
     return lengths
 
 
+def limited_code_lengths(counts, max_length):
+    """
+    Returns a mapping of symbols to optimal code lengths no longer than a given limit,
+    using the package-merge algorithm.
+    :param counts: A mapping of symbols to frequency counts.
+    :param max_length: The maximum code length.
+    :rtype: dict
+    """
+    if len(counts) > 1 << max_length:
+        raise ValueError('Too many symbols for maximum code length')
+
+    # each item is a weight and the symbols it covers, every time a symbol is
+    # selected its code gets one bit longer
+    leaves = sorted(((c, (s,)) for s, c in counts.items()), key=lambda x: x[0])
+    items = leaves
+    for _ in range(max_length - 1):
+        packages = [(a[0] + b[0], a[1] + b[1]) for a, b in zip(items[::2], items[1::2])]
+        items = list(heapq.merge(leaves, packages, key=lambda x: x[0]))
+
+    lengths = dict.fromkeys(counts, 0)
+    for _, symbols in items[:2 * len(counts) - 2]:
+        for s in symbols:
+            lengths[s] += 1
+    return lengths
+
+
 class DecodeError(Exception):
     """Represents an error while attempting to read a symbol."""
     pass
 
 
-class CanonicalCode:
+class CanonicalCode(SymbolCode):
     """A canonical Huffman encoder/decoder."""
 
-    __slots__ = ('symbols', 'length_counts', 'code_map')
+    __slots__ = ('symbols', 'length_counts', 'code_map', 'decode_table')
+
+    # codes up to this length are resolved with a single table lookup
+    TABLE_BITS = 9
 
     def __init__(self, symbols, length_counts):
         """
@@ -105,6 +134,7 @@ class CanonicalCode:
         self.symbols = symbols
         self.length_counts = length_counts
         self.code_map = None
+        self.decode_table = None
 
     def _build_code_map(self):
         """
@@ -119,6 +149,46 @@ class CanonicalCode:
             index += count
         return code_map
 
+    def _build_decode_table(self):
+        """
+        Prepares a two-level lookup table for decoding.
+
+        The first level is indexed by the next ``table_bits`` bits of the stream and holds
+        ``(symbol, length)`` entries. Codes longer than that share an entry per prefix which
+        holds ``(subtable, -sub_bits)`` instead, where the subtable is indexed by the bits
+        following the prefix.
+        """
+        table_bits = min(len(self.length_counts), self.TABLE_BITS)
+        table = [None] * (1 << table_bits)
+        long_codes = collections.defaultdict(list)
+
+        code = index = 0
+        for length, count in enumerate(self.length_counts, 1):
+            for x in range(count):
+                entry = (self.symbols[index + x], length)
+                if length <= table_bits:
+                    shift = table_bits - length
+                    start = (code + x) << shift
+                    table[start:start + (1 << shift)] = [entry] * (1 << shift)
+                else:
+                    tail_bits = length - table_bits
+                    prefix = (code + x) >> tail_bits
+                    long_codes[prefix].append((entry, (code + x) & (1 << tail_bits) - 1))
+            code = (code + count) << 1
+            index += count
+
+        for prefix, codes in long_codes.items():
+            # codes are in canonical order, so the last one is the longest
+            sub_bits = codes[-1][0][1] - table_bits
+            subtable = [None] * (1 << sub_bits)
+            for entry, tail in codes:
+                shift = sub_bits - (entry[1] - table_bits)
+                start = tail << shift
+                subtable[start:start + (1 << shift)] = [entry] * (1 << shift)
+            table[prefix] = (subtable, -sub_bits)
+
+        return table_bits, table
+
     @classmethod
     def from_code_lengths(cls, lengths):
         """
@@ -132,14 +202,17 @@ class CanonicalCode:
         return cls(symbols, length_counts)
 
     @classmethod
-    def from_counts(cls, counts):
+    def from_counts(cls, counts, max_length=None):
         """
         Returns an instance from a mapping of symbols to frequency counts.
         :param counts: A mapping of symbols to frequency counts.
+        :param max_length: An optional limit on code lengths.
         :rtype: CanonicalCode
         """
         tree = construct_tree(counts)
         lengths = code_lengths(tree)
+        if max_length and max(lengths.values()) > max_length:
+            lengths = limited_code_lengths(counts, max_length)
         return cls.from_code_lengths(lengths)
 
     def write_symbol(self, symbol, writer):
@@ -160,15 +233,25 @@ class CanonicalCode:
         :param reader: The stream to read the symbol from.
         :return: A symbol.
         """
-        code = first = index = 0
-        for count in self.length_counts:
-            code = code << 1 | reader.read_uint(1)
-            if code - count < first:
-                return self.symbols[index + (code - first)]
-            index += count
-            first = (first + count) << 1
+        if not self.decode_table:
+            self.decode_table = self._build_decode_table()
+
+        table_bits, table = self.decode_table
+        symbol, length = table[reader.peek(table_bits)]
+
+        if length < 0:
+            # long code, resolve the rest using the second-level table
+            reader.consume(table_bits)
+            symbol, length = symbol[reader.peek(-length)]
+            length -= table_bits
 
-        raise DecodeError('Max code length exceeded while reading symbol')
+        reader.consume(length)
+        return symbol
+
+    def cost(self, counts):
+        if not self.code_map:
+            self.code_map = self._build_code_map()
+        return sum(c * self.code_map[s][0] for s, c in counts.items())
 
     def write_codebook(self, alphabet, writer):
         """
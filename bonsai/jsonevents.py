@@ -0,0 +1,146 @@
+import re
+from json import JSONDecodeError
+from json.decoder import scanstring
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+NUMBER = re.compile(r'-?(?:0|[1-9][0-9]*)(?:\.[0-9]+)?(?:[eE][-+]?[0-9]+)?')
+NUMBER_CHARS = re.compile(r'[-+.0-9eE]*')
+LITERALS = {'true': True, 'false': False, 'null': None}
+
+# what the parser expects next
+VALUE, VALUE_OR_END, KEY, KEY_OR_END, COLON, COMMA_OR_END, DONE = range(7)
+
+
+def _refill(fp, buf, pos, chunk_size):
+    """Drops consumed text and appends the next chunk. Returns the new buffer, position and EOF flag."""
+    chunk = fp.read(chunk_size)
+    return buf[pos:] + chunk, 0, not chunk
+
+
+def iter_events(fp, chunk_size=1 << 16):
+    """
+    Parses a JSON document incrementally, yielding ``(event, value)`` pairs.
+
+    Events are ``start_map``, ``key``, ``end_map``, ``start_array``, ``end_array`` and
+    ``value``. Numbers are yielded as their source text, like ``json.load`` with
+    ``parse_int=str`` and ``parse_float=str``.
+    :param fp: A text stream.
+    :param chunk_size: The number of characters to read at a time.
+    """
+    buf = fp.read(chunk_size)
+    pos = 0
+    eof = not buf
+    stack = []  # True for maps, False for arrays
+    expect = VALUE
+
+    while True:
+        pos = WHITESPACE.match(buf, pos).end()
+        if pos == len(buf):
+            if eof:
+                break
+            buf, pos, eof = _refill(fp, buf, pos, chunk_size)
+            continue
+
+        c = buf[pos]
+
+        if expect == COLON:
+            if c != ':':
+                raise JSONDecodeError("Expecting ':' delimiter", buf, pos)
+            pos += 1
+            expect = VALUE
+            continue
+
+        if expect == COMMA_OR_END:
+            if c == ',':
+                pos += 1
+                expect = KEY if stack[-1] else VALUE
+                continue
+            if c == ('}' if stack[-1] else ']'):
+                pos += 1
+                yield ('end_map' if stack.pop() else 'end_array'), None
+                expect = COMMA_OR_END if stack else DONE
+                continue
+            raise JSONDecodeError("Expecting ',' delimiter", buf, pos)
+
+        if expect == DONE:
+            raise JSONDecodeError('Extra data', buf, pos)
+
+        if expect == KEY or expect == KEY_OR_END:
+            if c == '}' and expect == KEY_OR_END:
+                pos += 1
+                stack.pop()
+                yield 'end_map', None
+                expect = COMMA_OR_END if stack else DONE
+                continue
+            if c != '"':
+                raise JSONDecodeError('Expecting property name enclosed in double quotes', buf, pos)
+            try:
+                key, end = scanstring(buf, pos + 1)
+            except JSONDecodeError:
+                if eof:
+                    raise
+                # the string may continue in the next chunk
+                buf, pos, eof = _refill(fp, buf, pos, chunk_size)
+                continue
+            pos = end
+            yield 'key', key
+            expect = COLON
+            continue
+
+        # expecting a value
+        if c == ']' and expect == VALUE_OR_END:
+            pos += 1
+            stack.pop()
+            yield 'end_array', None
+            expect = COMMA_OR_END if stack else DONE
+            continue
+
+        if c == '{':
+            pos += 1
+            stack.append(True)
+            yield 'start_map', None
+            expect = KEY_OR_END
+            continue
+
+        if c == '[':
+            pos += 1
+            stack.append(False)
+            yield 'start_array', None
+            expect = VALUE_OR_END
+            continue
+
+        if c == '"':
+            try:
+                value, end = scanstring(buf, pos + 1)
+            except JSONDecodeError:
+                if eof:
+                    raise
+                buf, pos, eof = _refill(fp, buf, pos, chunk_size)
+                continue
+        elif c == '-' or '0' <= c <= '9':
+            end = NUMBER_CHARS.match(buf, pos).end()
+            if end == len(buf) and not eof:
+                # the number may continue in the next chunk
+                buf, pos, eof = _refill(fp, buf, pos, chunk_size)
+                continue
+            match = NUMBER.match(buf, pos, end)
+            if match is None or match.end() != end:
+                raise JSONDecodeError('Invalid number', buf, pos)
+            value = match.group()
+        else:
+            for word, value in LITERALS.items():
+                if buf.startswith(word, pos):
+                    end = pos + len(word)
+                    break
+            else:
+                if not eof and len(buf) - pos < 5:
+                    buf, pos, eof = _refill(fp, buf, pos, chunk_size)
+                    continue
+                raise JSONDecodeError('Expecting value', buf, pos)
+
+        pos = end
+        yield 'value', value
+        expect = COMMA_OR_END if stack else DONE
+
+    if expect != DONE:
+        raise JSONDecodeError('Unexpected end of document', buf, pos)
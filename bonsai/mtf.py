@@ -0,0 +1,120 @@
+# the exp-Golomb order that ranks are coded with, unless a profile says otherwise
+RANK_ORDER = 2
+
+
+class MoveToFront:
+    """
+    A move-to-front list supporting rank lookups, removals and front insertions in
+    logarithmic time.
+
+    Every insertion is stamped with an increasing timestamp, and a Fenwick tree over
+    the timestamps counts the items still present, so an item's rank is the number of
+    items inserted after it.
+    """
+
+    __slots__ = ('times', 'items', 'tree', 'clock', 'size')
+
+    MIN_CAPACITY = 64
+
+    def __init__(self):
+        self.times = {}  # item -> timestamp
+        self.items = [None]  # timestamp -> item, timestamps start at 1
+        self.tree = [0] * (self.MIN_CAPACITY + 1)
+        self.clock = 0
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, item):
+        return item in self.times
+
+    def __iter__(self):
+        """Yields items from the front (most recent) to the back."""
+        return (x for t, x in sorted(((t, x) for x, t in self.times.items()), reverse=True))
+
+    def _add(self, pos, delta):
+        tree = self.tree
+        capacity = len(tree) - 1
+        while pos <= capacity:
+            tree[pos] += delta
+            pos += pos & -pos
+
+    def _prefix(self, pos):
+        tree = self.tree
+        total = 0
+        while pos:
+            total += tree[pos]
+            pos &= pos - 1
+        return total
+
+    def _find(self, k):
+        """Returns the timestamp of the k-th oldest item, counting from 1."""
+        tree = self.tree
+        capacity = len(tree) - 1
+        pos = 0
+        step = capacity
+        while step:
+            nxt = pos + step
+            if nxt <= capacity and tree[nxt] < k:
+                pos = nxt
+                k -= tree[nxt]
+            step >>= 1
+        return pos + 1
+
+    def _compact(self):
+        """Renumbers timestamps from 1 and resizes the tree to fit."""
+        ordered = sorted(self.times, key=self.times.get)
+        capacity = self.MIN_CAPACITY
+        while capacity < 2 * len(ordered):
+            capacity <<= 1
+
+        self.items = [None] + ordered
+        self.times = {x: t for t, x in enumerate(ordered, 1)}
+        self.clock = len(ordered)
+
+        # every present timestamp holds a one, build the tree in linear time
+        tree = [0] + [1] * self.clock + [0] * (capacity - self.clock)
+        for pos in range(1, capacity + 1):
+            parent = pos + (pos & -pos)
+            if parent <= capacity:
+                tree[parent] += tree[pos]
+        self.tree = tree
+
+    def rank(self, item):
+        """
+        Returns the position of an item counted from the front, or None if it isn't present.
+        """
+        t = self.times.get(item)
+        if t is None:
+            return None
+        return self.size - self._prefix(t)
+
+    def remove(self, item):
+        """Removes an item from the list."""
+        t = self.times.pop(item)
+        self.items[t] = None
+        self._add(t, -1)
+        self.size -= 1
+
+    def pop(self, rank):
+        """Removes and returns the item at a given position counted from the front."""
+        if not 0 <= rank < self.size:
+            raise IndexError('MoveToFront index out of range')
+        item = self.items[self._find(self.size - rank)]
+        self.remove(item)
+        return item
+
+    def move_to_front(self, item):
+        """Inserts an item at the front, removing it from its old position if present."""
+        if item in self.times:
+            self.remove(item)
+
+        if self.clock >= len(self.tree) - 1:
+            self._compact()
+
+        self.clock += 1
+        self.times[item] = self.clock
+        self.items.append(item)
+        self._add(self.clock, 1)
+        self.size += 1
@@ -0,0 +1,178 @@
+"""
+A columnar node table, as a compact alternative to a list of node dicts.
+
+Every node gets a type id and a row in the table of its type, which holds one column per
+field. Child references are stored as node indices, strings as indices into the table's
+string list and enums as variant indices, all in ``array`` columns. Since arrays support
+the buffer protocol, columns can be viewed with ``numpy.frombuffer`` without copying.
+"""
+from array import array
+from collections import Counter
+import bonsai.specs as spec_types
+
+# marks a null child reference
+NO_NODE = -1
+
+
+class ListColumn:
+    """The items of a list field, concatenated, with the offset of each row's items."""
+
+    __slots__ = ('offsets', 'items')
+
+    def __init__(self):
+        self.offsets = array('Q', [0])
+        self.items = array('q')
+
+    def append(self, items):
+        self.items.extend(NO_NODE if x is None else x for x in items)
+        self.offsets.append(len(self.items))
+
+    def __getitem__(self, row):
+        return tuple(None if x == NO_NODE else x
+                     for x in self.items[self.offsets[row]:self.offsets[row + 1]])
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+def _make_column(field_type):
+    if isinstance(field_type, spec_types.NodeRef):
+        return array('q')
+    elif isinstance(field_type, spec_types.List) and isinstance(field_type.of_type, spec_types.NodeRef):
+        return ListColumn()
+    elif isinstance(field_type, spec_types.Enum):
+        return array('B' if len(field_type.variants) <= 256 else 'H')
+    elif isinstance(field_type, spec_types.Boolean):
+        return array('B')
+    elif isinstance(field_type, spec_types.String):
+        return array('L')
+    else:
+        return []
+
+
+class NodeTable:
+    __slots__ = ('schema', 'type_index', 'type_ids', 'rows', 'row_counts', 'columns',
+                 'field_columns', 'strings', 'string_ids', 'enum_ids')
+
+    def __init__(self, schema, strings=None):
+        """
+        :param schema: The schema of the spec the nodes belong to.
+        :param strings: A sequence of strings, e.g. a StringSection, that the values of
+                        string fields index into. By default, string fields hold the
+                        strings themselves, which are collected into the table.
+        """
+        self.schema = schema
+        self.type_index = {x: i for i, x in enumerate(schema.node_types)}
+        self.type_ids = array('H')
+        self.rows = array('L')
+        self.row_counts = Counter()
+        self.strings = [] if strings is None else strings
+        self.string_ids = {} if strings is None else None
+
+        # the columns of each node type, in the order of its fields, and the type of each
+        # field along with its column
+        self.columns = {}
+        self.field_columns = {}
+        self.enum_ids = {}
+        for node_type in schema.node_types:
+            columns = self.columns[node_type] = {}
+            field_columns = self.field_columns[node_type] = {}
+            for field_key, field_type, slot in schema.fields[node_type]:
+                columns[field_key] = _make_column(field_type)
+                field_columns[field_key] = field_type, columns[field_key]
+                if isinstance(field_type, spec_types.Enum):
+                    self.enum_ids[slot] = {v: i for i, v in reversed(list(enumerate(field_type.variants)))}
+
+    def append(self, node):
+        """
+        Adds a node, as decoded with ``tree=False``.
+        :param node: A dict holding the node's fields, with children as node indices.
+        """
+        node_type = self.schema.types[node['type']]
+        columns = self.columns[node_type]
+
+        self.type_ids.append(self.type_index[node_type])
+        self.rows.append(self.row_counts[node_type])
+        self.row_counts[node_type] += 1
+
+        for field_key, field_type, slot in self.schema.fields[node_type]:
+            value = node[field_key]
+            column = columns[field_key]
+            if isinstance(field_type, spec_types.NodeRef):
+                column.append(NO_NODE if value is None else value)
+            elif isinstance(field_type, spec_types.Enum):
+                column.append(self.enum_ids[slot][value])
+            elif isinstance(field_type, spec_types.String) and self.string_ids is not None:
+                string_id = self.string_ids.get(value)
+                if string_id is None:
+                    string_id = self.string_ids[value] = len(self.strings)
+                    self.strings.append(value)
+                column.append(string_id)
+            else:
+                column.append(value)
+
+    def __len__(self):
+        return len(self.type_ids)
+
+    def node_type(self, index):
+        """Returns the type of a node."""
+        return self.schema.node_types[self.type_ids[index]]
+
+    def get(self, index, field_key):
+        """
+        Returns a field of a node. Children are returned as node indices, or None for
+        null references, and lists of children as tuples of them.
+        """
+        field_type, column = self.field_columns[self.node_type(index)][field_key]
+        value = column[self.rows[index]]
+
+        if isinstance(field_type, spec_types.NodeRef):
+            return None if value == NO_NODE else value
+        elif isinstance(field_type, spec_types.Enum):
+            return field_type.variants[value]
+        elif isinstance(field_type, spec_types.Boolean):
+            return bool(value)
+        elif isinstance(field_type, spec_types.String):
+            return self.strings[value]
+        return value
+
+    def children(self, index):
+        """Returns the indices of a node's children, in field order."""
+        node_type = self.node_type(index)
+        row = self.rows[index]
+        children = []
+        for (_, field_key), _ in self.schema.ref_fields[node_type]:
+            value = self.columns[node_type][field_key][row]
+            if isinstance(value, tuple):
+                children.extend(x for x in value if x is not None)
+            elif value != NO_NODE:
+                children.append(value)
+        return children
+
+    def type_counts(self):
+        """Counts the nodes of each type, by type name."""
+        node_types = self.schema.node_types
+        return Counter({node_types[k].__name__: v for k, v in Counter(self.type_ids).items()})
+
+    def node(self, index):
+        """Returns a node as a dict, with children as node indices."""
+        node_type = self.node_type(index)
+        node = {'type': node_type.__name__}
+        for field_key, _, _ in self.schema.fields[node_type]:
+            node[field_key] = self.get(index, field_key)
+        return node
+
+    def to_tree(self):
+        """Converts the table to a tree of dicts, like the decoder's default output."""
+        nodes = []
+        for index in range(len(self)):
+            # children always precede their parents
+            node = self.node(index)
+            for (_, field_key), _ in self.schema.ref_fields[self.node_type(index)]:
+                value = node[field_key]
+                if isinstance(value, tuple):
+                    node[field_key] = tuple(None if x is None else nodes[x] for x in value)
+                elif value is not None:
+                    node[field_key] = nodes[value]
+            nodes.append(node)
+        return nodes[-1] if nodes else None
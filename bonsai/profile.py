@@ -0,0 +1,251 @@
+"""
+Profiles trained on a corpus of ASTs, which files can refer to instead of carrying their
+own coding parameters.
+
+A profile holds a Huffman codebook for every node-referencing field of the spec, the
+exp-Golomb orders that MTF ranks are coded with, and a dictionary of common strings. Files
+encoded with a profile store its ID in place of the bitmap of used types and the codebooks.
+The string section is compressed as a continuation of the dictionary's brotli stream, so
+it can refer back to the dictionary's strings. Decoders only replay the compressed stream,
+but the brotli binding can't copy a Compressor, so encoding a file still compresses the
+whole dictionary first. With a full dictionary this costs tens of milliseconds per file,
+see ``bench.corpus --profile``.
+"""
+import os
+import json
+import base64
+import hashlib
+import functools
+import brotli
+from io import BytesIO
+from importlib import import_module
+from collections import defaultdict, Counter
+import bonsai.specs as spec_types
+from bonsai.codec.encoder import GraphEncoder, MAX_CODE_LENGTH
+from bonsai.huffman import CanonicalCode
+from bonsai.mtf import RANK_ORDER
+from bonsai.schema import compile_schema
+
+# the largest dictionary built by default, in bytes
+DICTIONARY_SIZE = 1 << 15
+
+# the exp-Golomb orders tried for MTF ranks
+RANK_ORDERS = range(5)
+
+# the variable naming the directory profiles are looked up in by default, which is
+# otherwise the current directory
+PROFILE_DIR_VAR = 'BONSAI_PROFILE_DIR'
+
+
+class Profile:
+    __slots__ = ('spec', 'codebooks', 'rank_order', 'string_rank_order', 'dictionary',
+                 'dictionary_stream', 'id', 'used_types', 'contexts')
+
+    def __init__(self, spec, codebooks, rank_order=RANK_ORDER, string_rank_order=RANK_ORDER,
+                 dictionary=b'', dictionary_stream=None):
+        """
+        :param spec: A spec module.
+        :param codebooks: A mapping of ``(node_type, field_key)`` slots to CanonicalCodes
+                          over the slot's candidate types.
+        :param rank_order: The exp-Golomb order of node ranks.
+        :param string_rank_order: The exp-Golomb order of string ranks.
+        :param dictionary: Strings separated and followed by NUL bytes.
+        :param dictionary_stream: The dictionary compressed and flushed by a brotli
+                                  Compressor, computed if not given.
+        """
+        self.spec = spec
+        self.codebooks = codebooks
+        self.rank_order = rank_order
+        self.string_rank_order = string_rank_order
+        self.dictionary = dictionary
+        if dictionary_stream is None:
+            dictionary_stream = _start_stream(dictionary)[1]
+        self.dictionary_stream = dictionary_stream
+        self.id = int.from_bytes(hashlib.sha256(self.dumps()).digest()[:4], 'big')
+
+        # files using a profile don't list the types they use, so all of them are available
+        schema = compile_schema(spec)
+        self.used_types = [spec_types.Null] + list(schema.node_types)
+        self.contexts = {}
+        for key, child_types in schema.iter_ref_fields(self.used_types):
+            if len(child_types) >= 2:
+                self.contexts[key] = codebooks[key]
+            elif child_types:
+                self.contexts[key], = child_types
+
+    def compressor(self):
+        """
+        Returns a brotli Compressor that continues the dictionary's stream. The binding's
+        Compressors can't be copied, so each one is primed with the dictionary anew.
+        """
+        compressor, stream = _start_stream(self.dictionary)
+        if stream != self.dictionary_stream:
+            raise ValueError('The profile was trained with a different version of brotli')
+        return compressor
+
+    def decompressor(self):
+        """Returns a brotli Decompressor that has been fed the dictionary's stream."""
+        decompressor = brotli.Decompressor()
+        decompressor.process(self.dictionary_stream)
+        return decompressor
+
+    def compress(self, data):
+        """Compresses a string section as a continuation of the dictionary's stream."""
+        compressor = self.compressor()
+        return compressor.process(data) + compressor.finish()
+
+    def decompress(self, compressed):
+        return self.decompressor().process(compressed)
+
+    def dumps(self):
+        """Serializes the profile to JSON."""
+        codebooks = {f'{node_type.__name__}.{field_key}': [[x.__name__ for x in code.symbols],
+                                                          list(code.length_counts)]
+                     for (node_type, field_key), code in sorted(
+                         self.codebooks.items(), key=lambda x: (x[0][0].__name__, x[0][1]))}
+        return json.dumps({
+            'spec': self.spec.__name__,
+            'rank_order': self.rank_order,
+            'string_rank_order': self.string_rank_order,
+            'codebooks': codebooks,
+            'dictionary': base64.b64encode(self.dictionary).decode('ascii'),
+            'dictionary_stream': base64.b64encode(self.dictionary_stream).decode('ascii'),
+        }, indent=1).encode('utf-8')
+
+    @classmethod
+    def loads(cls, data):
+        """
+        Reads a profile serialized with dumps().
+        :rtype: Profile
+        """
+        obj = json.loads(data)
+        spec = import_module(obj['spec'])
+        schema = compile_schema(spec)
+        types = dict(schema.types, Null=spec_types.Null)
+
+        codebooks = {}
+        for key, (symbols, length_counts) in obj['codebooks'].items():
+            type_name, field_key = key.split('.', 1)
+            codebooks[types[type_name], field_key] = CanonicalCode([types[x] for x in symbols],
+                                                                   length_counts)
+
+        return cls(spec, codebooks, obj['rank_order'], obj['string_rank_order'],
+                   base64.b64decode(obj['dictionary']), base64.b64decode(obj['dictionary_stream']))
+
+    def save(self, directory):
+        """Writes the profile to a file named after its ID, and returns the path."""
+        path = os.path.join(directory, f'{self.id:08x}.json')
+        with open(path, 'wb') as fp:
+            fp.write(self.dumps())
+        return path
+
+
+def _start_stream(dictionary):
+    """Returns a Compressor that has been fed the dictionary, and the stream it produced."""
+    compressor = brotli.Compressor()
+    return compressor, compressor.process(dictionary) + compressor.flush()
+
+
+def load(path):
+    """
+    Reads a profile from a file.
+    :rtype: Profile
+    """
+    with open(path, 'rb') as fp:
+        return Profile.loads(fp.read())
+
+
+def find(profile_id, directory=None):
+    """
+    Loads the profile with the given ID from a directory, once per process.
+    :param directory: The directory holding profiles, by default ``$BONSAI_PROFILE_DIR``
+                      or the current directory, as they are at the time of the call.
+    :rtype: Profile
+    """
+    if directory is None:
+        directory = os.environ.get(PROFILE_DIR_VAR, '.')
+    return _find(profile_id, os.path.abspath(directory))
+
+
+@functools.lru_cache(maxsize=None)
+def _find(profile_id, directory):
+    path = os.path.join(directory, f'{profile_id:08x}.json')
+    try:
+        profile = load(path)
+    except FileNotFoundError:
+        raise ValueError(f'Profile {profile_id:08x} not found in {directory}')
+    if profile.id != profile_id:
+        raise ValueError(f'Profile {profile_id:08x} does not match its ID')
+    return profile
+
+
+def _codebooks(schema, type_stats, max_length):
+    """Builds a codebook for every field with several candidate types, giving each a code."""
+    used_types = [spec_types.Null] + list(schema.node_types)
+    codebooks = {}
+    for key, child_types in schema.iter_ref_fields(used_types):
+        if len(child_types) >= 2:
+            counts = {x: type_stats[key][x] + 1 for x in child_types}
+            codebooks[key] = CanonicalCode.from_counts(counts, max_length)
+    return codebooks
+
+
+def _dictionary(documents, size):
+    """
+    Picks the strings used by more than one document that would save the most bytes,
+    with the most valuable ones last, where they're cheapest to refer to.
+    """
+    scores = {x: (count - 1) * len(x.encode('utf-8')) for x, count in documents.items() if count > 1}
+    chosen = []
+    total = 0
+    for string in sorted(scores, key=lambda x: (-scores[x], x)):
+        length = len(string.encode('utf-8')) + 1
+        if total + length > size:
+            break
+        chosen.append(string)
+        total += length
+    return b''.join(x.encode('utf-8') + b'\0' for x in reversed(chosen))
+
+
+def _graph_size(profile, asts, string_refs):
+    size = 0
+    for ast in asts:
+        with BytesIO() as buf:
+            GraphEncoder(profile.spec, ast, buf, string_refs=string_refs,
+                         profile=profile).encode()
+            size += buf.tell()
+    return size
+
+
+def train(spec, asts, dictionary_size=DICTIONARY_SIZE):
+    """
+    Trains a profile on a corpus.
+    :param spec: A spec module.
+    :param asts: A sequence of ASTs, which is iterated several times.
+    :param dictionary_size: The maximum size of the string dictionary, in bytes.
+    :rtype: Profile
+    """
+    schema = compile_schema(spec)
+    type_stats = defaultdict(Counter)
+    documents = Counter()
+
+    for ast in asts:
+        with BytesIO() as buf:
+            e = GraphEncoder(spec, ast, buf)
+            for key, counts in e.build_graph().items():
+                type_stats[key].update(counts)
+        # count each string once per document
+        documents.update({value for node in e.nodes
+                          for value, (_, t, _) in zip(node[1:], schema.fields[node[0]])
+                          if isinstance(t, spec_types.String)})
+
+    codebooks = _codebooks(schema, type_stats, MAX_CODE_LENGTH)
+    dictionary = _dictionary(documents, dictionary_size)
+
+    # pick the orders that give the smallest graphs, the string order with string refs on
+    rank_order = min(RANK_ORDERS, key=lambda k: _graph_size(
+        Profile(spec, codebooks, k, RANK_ORDER, b''), asts, False))
+    string_rank_order = min(RANK_ORDERS, key=lambda k: _graph_size(
+        Profile(spec, codebooks, rank_order, k, b''), asts, True))
+
+    return Profile(spec, codebooks, rank_order, string_rank_order, dictionary)
@@ -0,0 +1,80 @@
+import typing
+import functools
+import bonsai.specs as spec_types
+from bonsai.util import subclasses
+
+
+class Schema:
+    """Reflection data for a spec module, computed once and shared by the codecs."""
+
+    __slots__ = ('spec', 'root_type', 'node_types', 'types', 'fields', 'field_positions',
+                 'ref_types', 'ref_fields', 'lazy_types')
+
+    def __init__(self, spec):
+        self.spec = spec
+        self.root_type = spec.root_type
+
+        # all codeable node types, in the order used for the type bitmap
+        self.node_types = tuple(x for x in subclasses(spec_types.Node)
+                                if x.__module__ == spec.__name__)
+        self.types = {x.__name__: x for x in self.node_types}
+
+        # node types that may be coded as skippable blobs
+        self.lazy_types = frozenset(getattr(spec, 'lazy_types', ()))
+
+        self.fields = {spec_types.Null: ()}
+        # where each field is in the encoder's node records, which start with the node type
+        self.field_positions = {spec_types.Null: {}}
+        self.ref_types = {}
+        self.ref_fields = {spec_types.Null: ()}
+
+        for node_type in self.node_types:
+            node_fields = []
+            ref_fields = []
+
+            for field_key, field_type in typing.get_type_hints(node_type).items():
+                slot = (node_type, field_key)
+                node_fields.append((field_key, field_type, slot))
+
+                # see if this field references other nodes
+                of_type = getattr(field_type, 'of_type', field_type)
+                if isinstance(of_type, spec_types.NodeRef):
+                    if of_type not in self.ref_types:
+                        self.ref_types[of_type] = frozenset(
+                            x for c in of_type.dest_types for x in subclasses(c, True))
+                    ref_fields.append((slot, self.ref_types[of_type]))
+
+            self.fields[node_type] = tuple(node_fields)
+            self.field_positions[node_type] = {k: i for i, (k, _, _) in enumerate(node_fields, 1)}
+            self.ref_fields[node_type] = tuple(ref_fields)
+
+    def iter_ref_fields(self, used_types):
+        """
+        Yields each node-referencing field of the used types along with its candidate types.
+        :param used_types: A sequence of node types present in the stream.
+        :return: Pairs of ``(node_type, field_key)`` and a list of candidate types.
+        """
+        for node_type in used_types:
+            for slot, candidate_types in self.ref_fields[node_type]:
+                yield slot, [x for x in used_types if x in candidate_types]
+
+    def iter_enum_fields(self, used_types):
+        """
+        Yields each enum field of the used types along with its variants.
+        :param used_types: A sequence of node types present in the stream.
+        :return: Pairs of ``(node_type, field_key)`` and a tuple of variants.
+        """
+        for node_type in used_types:
+            for _, field_type, slot in self.fields[node_type]:
+                if isinstance(field_type, spec_types.Enum):
+                    yield slot, field_type.variants
+
+
+@functools.lru_cache(maxsize=None)
+def compile_schema(spec):
+    """
+    Returns the cached schema for a spec module.
+    :param spec: A spec module, e.g. ``bonsai.specs.shift_es5``.
+    :rtype: Schema
+    """
+    return Schema(spec)
@@ -325,3 +325,9 @@ class UseStrictDirective(Directive):
 # Spec meta
 
 root_type = Script
+
+# field keys leading from the root to the list of nodes that segmented files are split on
+segment_path = ('body', 'statements')
+
+# node types that may be coded as skippable blobs and decoded on first access
+lazy_types = (FunctionBody,)
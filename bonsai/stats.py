@@ -0,0 +1,163 @@
+"""
+Accounts for every bit of an encoded file, by node type, field and category.
+
+A StatsEncoder codes the AST exactly like a GraphEncoder without codegen, measuring the
+bitstream position around each part of each field. Codebooks and the compressed string
+section are counted as a whole.
+"""
+import brotli
+from io import BytesIO
+from collections import Counter, defaultdict
+import bonsai.specs as spec_types
+from bonsai.codec.encoder import GraphEncoder
+from bonsai.util import trampoline
+
+# categories of bits, in the order they're reported
+CATEGORIES = ('type', 'backref', 'list', 'enum', 'boolean', 'number', 'string ref', 'codebooks',
+              'strings')
+
+SCALAR_CATEGORIES = {
+    spec_types.Enum: 'enum',
+    spec_types.Boolean: 'boolean',
+    spec_types.Number: 'number',
+    spec_types.String: 'string ref',
+}
+
+# the pseudo-fields that bits outside of any node are counted under
+HEADER_FIELD = ('(header)', '')
+STRINGS_FIELD = ('(strings)', '')
+
+
+def count_nodes(value):
+    """Counts the nodes of an AST, before deduplication."""
+    count = 0
+    stack = [value]
+    while stack:
+        value = stack.pop()
+        if isinstance(value, dict):
+            count += 'type' in value
+            stack.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            stack.extend(value)
+    return count
+
+
+class BitStats:
+    __slots__ = ('bits', 'refs', 'ast_nodes', 'graph_nodes', 'string_bytes')
+
+    def __init__(self):
+        # bits by (node type name, field key) and category
+        self.bits = Counter()
+        # back-reference hits, misses and nulls by (node type name, field key)
+        self.refs = defaultdict(lambda: [0, 0, 0])
+        self.ast_nodes = 0
+        self.graph_nodes = 0
+        # uncompressed UTF-8 bytes of the strings of each field
+        self.string_bytes = Counter()
+
+    @property
+    def total(self):
+        return sum(self.bits.values())
+
+    @property
+    def dedup_ratio(self):
+        """The number of nodes after deduplication, relative to the AST."""
+        return self.graph_nodes / self.ast_nodes if self.ast_nodes else 0.0
+
+    def by_category(self):
+        totals = Counter()
+        for (_, category), bits in self.bits.items():
+            totals[category] += bits
+        return Counter({k: totals[k] for k in CATEGORIES if totals[k]})
+
+    def by_node_type(self):
+        totals = Counter()
+        for ((type_name, _), _), bits in self.bits.items():
+            totals[type_name] += bits
+        return totals
+
+    def by_field(self):
+        """Returns the bits of each field, broken down by category."""
+        fields = defaultdict(Counter)
+        for (field, category), bits in self.bits.items():
+            fields[field][category] += bits
+        return fields
+
+
+class StatsEncoder(GraphEncoder):
+    __slots__ = ('stats',)
+
+    def __init__(self, spec, tree, fp, string_refs=False):
+        super().__init__(spec, tree, fp, codegen=False, string_refs=string_refs)
+        self.stats = BitStats()
+
+    def _add(self, field, category, start):
+        self.stats.bits[field, category] += self.writer.tell() - start
+
+    def _encode_ref(self, field, node_index, ctx):
+        """Runs GraphEncoder._encode_NodeRef, counting the bits it writes before the child."""
+        hit = self.recent_nodes[ctx].rank(node_index) is not None
+        self.stats.refs[field][0 if hit else 2 if node_index is None else 1] += 1
+
+        category = 'backref' if hit else 'type'
+        start = self.writer.tell()
+        gen = self._encode_NodeRef(None, node_index, ctx)
+        try:
+            child = next(gen)
+        except StopIteration:
+            self._add(field, category, start)
+            return
+        self._add(field, category, start)
+
+        yield child
+        for child in gen:
+            yield child
+
+    def _encode_node_inner(self, node_type, node):
+        for value, (field_key, field_type, slot) in zip(node[1:], self.schema.fields[node_type]):
+            field = (node_type.__name__, field_key)
+
+            if isinstance(field_type, spec_types.List):
+                ctx = self.contexts.get(slot)
+                if ctx is None:
+                    continue
+                for i, item in enumerate(value):
+                    if not field_type.nonempty or i > 0:
+                        start = self.writer.tell()
+                        self.writer.write_bool(True)
+                        self._add(field, 'list', start)
+                    yield from self._encode_ref(field, item, ctx)
+                start = self.writer.tell()
+                self.writer.write_bool(False)
+                self._add(field, 'list', start)
+            elif isinstance(field_type, spec_types.NodeRef):
+                yield from self._encode_ref(field, value, self.contexts.get(slot))
+            else:
+                if isinstance(field_type, spec_types.String):
+                    self.stats.string_bytes[field] += len(value.encode('utf-8'))
+                start = self.writer.tell()
+                getattr(self, f'_encode_{field_type.__class__.__name__}')(field_type, value, slot)
+                self._add(field, SCALAR_CATEGORIES[type(field_type)], start)
+
+
+def collect(spec, ast, string_refs=False):
+    """
+    Encodes an AST, accounting for its bits.
+    :param string_refs: Code string fields as references, see ``bonsai.format.encode``.
+    :rtype: BitStats
+    """
+    with BytesIO() as buf:
+        e = StatsEncoder(spec, ast, buf, string_refs=string_refs)
+        stats = e.stats
+        stats.ast_nodes = count_nodes(ast)
+
+        e.encode_header()
+        stats.graph_nodes = len(e.nodes)
+        stats.bits[HEADER_FIELD, 'codebooks'] = e.writer.tell()
+
+        trampoline(e._encode_node_inner(spec.root_type, e.nodes[-1]))
+        e.writer.flush()
+
+    string_table_bin = b'\0'.join(x.encode('utf-8') for x in e.string_table)
+    stats.bits[STRINGS_FIELD, 'strings'] = len(brotli.compress(string_table_bin)) * 8
+    return stats
@@ -0,0 +1,265 @@
+"""
+A view of the decompressed string section, which decodes strings only when accessed.
+
+The section holds UTF-8 strings separated by NUL bytes. Instead of splitting and decoding
+it up front, the view keeps the buffer along with an index of where each string starts.
+
+The section can also be decompressed in a worker thread while the graph is decoded, since
+brotli releases the GIL. Its strings are indexed as they arrive, and reading a string only
+blocks if it isn't ready yet. Likewise, the strings of an encoder can be compressed while
+they're still being appended to.
+"""
+import sys
+import threading
+from array import array
+from collections.abc import Sequence
+
+# the bytes of compressed input decompressed at a time by a StringLoader
+CHUNK_SIZE = 1 << 16
+
+# how often a StringCompressor picks up the strings appended since, in seconds
+POLL_INTERVAL = 0.005
+
+
+def _index(data):
+    """Returns the start offset of every string, followed by the end of the buffer plus one."""
+    offsets = array('L', [0])
+    find = data.find
+    pos = find(b'\0')
+    while pos >= 0:
+        offsets.append(pos + 1)
+        pos = find(b'\0', pos + 1)
+    offsets.append(len(data) + 1)
+    return offsets
+
+
+class StringSection(Sequence):
+    __slots__ = ('data', 'offsets', 'start', 'stop', 'loader')
+
+    def __init__(self, data, offsets=None, start=0, stop=None, loader=None):
+        """
+        :param data: The decompressed string section.
+        :param offsets: The index of the section, if already built.
+        :param start: The index of the first string in this view.
+        :param stop: The index after the last string in this view.
+        :param loader: The StringLoader still filling in ``data`` and ``offsets``, if any.
+                       A view without ``stop`` then extends to wherever the section ends.
+        """
+        self.data = data
+        self.offsets = _index(data) if offsets is None else offsets
+        self.start = start
+        self.stop = len(self.offsets) - 1 if stop is None and loader is None else stop
+        self.loader = loader
+
+    @classmethod
+    def load(cls, decompressor, compressed):
+        """
+        Returns a view of a section that is decompressed in a worker thread.
+        :param decompressor: A ``brotli.Decompressor``, or an object with the same interface.
+        :param compressed: The compressed section.
+        """
+        loader = StringLoader(decompressor, compressed)
+        return cls(loader.data, loader.offsets, loader=loader)
+
+    def __len__(self):
+        if self.stop is None:
+            self.stop = self.loader.join()
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(len(self))
+            if step != 1:
+                return [self[i] for i in range(start, stop, step)]
+            return StringSection(self.data, self.offsets, self.start + start,
+                                 self.start + max(start, stop), self.loader)
+
+        if index < 0:
+            index += len(self)
+        if index < 0 or self.stop is not None and index >= len(self):
+            raise IndexError('string index out of range')
+
+        index += self.start
+        if index + 1 >= len(self.offsets) and not self.loader.wait(index + 1):
+            raise IndexError('string index out of range')
+        return str(self.data[self.offsets[index]:self.offsets[index + 1] - 1], 'utf-8')
+
+    def __reduce__(self):
+        if self.loader is not None:
+            self.loader.join()
+        # only pickle the part of the buffer this view covers, e.g. for segment workers
+        stop = self.start + len(self)
+        data = self.data[self.offsets[self.start]:self.offsets[stop] - 1]
+        return StringSection, (bytes(data), None, 0, len(self))
+
+    def cursor(self):
+        """Returns a StringCursor at the first string of this view."""
+        return StringCursor(self)
+
+
+class StringCursor:
+    """Hands out the strings of a StringSection in order, like ``deque.popleft``."""
+
+    __slots__ = ('section', 'data', 'offsets', 'pos', 'stop')
+
+    def __init__(self, section):
+        self.section = section
+        self.data = section.data
+        self.offsets = section.offsets
+        self.pos = section.start
+        # while the section is loading, its end is found by waiting for the loader
+        self.stop = sys.maxsize if section.stop is None else section.stop
+
+    def popleft(self):
+        pos = self.pos
+        if pos >= self.stop or (pos + 1 >= len(self.offsets) and
+                                not self.section.loader.wait(pos + 1)):
+            raise IndexError('pop from an empty string section')
+        self.pos = pos + 1
+        return str(self.data[self.offsets[pos]:self.offsets[pos + 1] - 1], 'utf-8')
+
+    def take(self, count):
+        """Skips over a number of strings without decoding them, and returns a view of them."""
+        start = self.pos
+        self.pos = min(start + count, self.stop)
+        return StringSection(self.data, self.offsets, start, self.pos, self.section.loader)
+
+
+class StringLoader:
+    """
+    Decompresses a string section in a worker thread, appending to a buffer and its index
+    as the output arrives.
+    """
+
+    __slots__ = ('data', 'offsets', 'ready', 'done', 'error', 'thread')
+
+    def __init__(self, decompressor, compressed):
+        """
+        :param decompressor: A ``brotli.Decompressor``, or an object with the same interface.
+        :param compressed: The compressed section.
+        """
+        self.data = bytearray()
+        self.offsets = array('L', [0])
+        self.ready = threading.Condition()
+        self.done = False
+        self.error = None
+        self.thread = threading.Thread(target=self._run, args=(decompressor, compressed),
+                                       daemon=True)
+        self.thread.start()
+
+    def _run(self, decompressor, compressed):
+        data = self.data
+        view = memoryview(compressed)
+        try:
+            for pos in range(0, len(view), CHUNK_SIZE):
+                chunk_start = len(data)
+                data += decompressor.process(view[pos:pos + CHUNK_SIZE])
+
+                offsets = array('L')
+                find = data.find
+                end = find(b'\0', chunk_start)
+                while end >= 0:
+                    offsets.append(end + 1)
+                    end = find(b'\0', end + 1)
+                with self.ready:
+                    self.offsets.extend(offsets)
+                    self.ready.notify_all()
+
+            if not decompressor.is_finished():
+                raise ValueError('Truncated string section')
+        except Exception as e:
+            self.error = e
+        finally:
+            with self.ready:
+                # like _index(), the index ends with the end of the buffer plus one
+                if self.error is None:
+                    self.offsets.append(len(data) + 1)
+                self.done = True
+                self.ready.notify_all()
+
+    def wait(self, count):
+        """
+        Blocks until the first ``count`` strings are ready, or the section is done.
+        :return: Whether the strings are ready, i.e. the section holds that many.
+        """
+        if len(self.offsets) <= count:
+            with self.ready:
+                while len(self.offsets) <= count and not self.done:
+                    self.ready.wait()
+            if self.error is not None:
+                raise self.error
+        return len(self.offsets) > count
+
+    def join(self):
+        """
+        Blocks until the whole section is decompressed and the worker has let go of the
+        compressed section.
+        :return: The number of strings.
+        """
+        self.wait(sys.maxsize)
+        self.thread.join()
+        return len(self.offsets) - 1
+
+
+class StringCompressor:
+    """
+    Compresses a list of strings in a worker thread while they're still being appended to,
+    e.g. the string table of a GraphEncoder. The section is the same as compressing the
+    finished list at once.
+    """
+
+    __slots__ = ('strings', 'compressor', 'chunks', 'size', 'done', 'cancelled', 'error',
+                 'thread')
+
+    def __init__(self, strings, compressor):
+        """
+        :param strings: A list of strings that's only appended to until finish().
+        :param compressor: A ``brotli.Compressor``, or an object with the same interface.
+        """
+        self.strings = strings
+        self.compressor = compressor
+        self.chunks = []
+        self.size = 0
+        self.done = threading.Event()
+        self.cancelled = False
+        self.error = None
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def _run(self):
+        pos = 0
+        try:
+            while True:
+                finished = self.done.wait(POLL_INTERVAL)
+                if self.cancelled:
+                    return
+                end = len(self.strings)
+                if end > pos:
+                    data = b'\0'.join(x.encode('utf-8') for x in self.strings[pos:end])
+                    if pos:
+                        data = b'\0' + data
+                    self.size += len(data)
+                    self.chunks.append(self.compressor.process(data))
+                    pos = end
+                if finished:
+                    break
+            self.chunks.append(self.compressor.finish())
+        except Exception as e:
+            self.error = e
+
+    def finish(self):
+        """
+        Compresses the rest of the strings once they've all been appended.
+        :return: The length of the section and the compressed section.
+        """
+        self.done.set()
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.size, b''.join(self.chunks)
+
+    def cancel(self):
+        """Stops the worker without finishing the section."""
+        self.cancelled = True
+        self.done.set()
+        self.thread.join()
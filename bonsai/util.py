@@ -1,6 +1,3 @@
-import typing
-
-
 def subclasses(cls, and_self=False):
     """
     Return all subclasses for a given class.
@@ -12,15 +9,23 @@ def subclasses(cls, and_self=False):
     return base + sub + [g for s in sub for g in subclasses(s, False)]
 
 
-def fields(cls):
-    return typing.get_type_hints(cls).items()
-
-
-def iter_fields(from_types, with_type):
-    for node_type in from_types:
-        for field_key, field_type in fields(node_type):
-            # see if this field references other nodes
-            of_type = getattr(field_type, 'of_type', field_type)
-            if isinstance(of_type, with_type):
-                candidate_types = {x for c in of_type.dest_types for x in subclasses(c, True)}
-                yield (node_type, field_key), [x for x in from_types if x in candidate_types]
+def trampoline(root):
+    """
+    Runs a generator that may yield further generators, without recursing.
+    Each yielded generator runs to completion before its parent is resumed, and its
+    return value is sent back to the parent as the result of the yield.
+    :param root: A generator object.
+    :return: The return value of the root generator.
+    """
+    stack = [root]
+    value = None
+    while stack:
+        try:
+            child = stack[-1].send(value)
+        except StopIteration as stop:
+            stack.pop()
+            value = stop.value
+        else:
+            stack.append(child)
+            value = None
+    return value
@@ -0,0 +1,91 @@
+import unittest
+import string
+from io import BytesIO
+from collections import Counter
+from bonsai.ans import ANSWriter, ANSReader, TableCode, TABLE_LOG
+from bonsai.bits import BitsIO
+
+
+def roundtrip(message, alphabet):
+    code = TableCode.from_counts(Counter(message), alphabet)
+    fp = BytesIO()
+    bw = BitsIO(fp)
+    code.write_codebook(alphabet, bw)
+    bw.write_uint(len(message), 16)
+    stream = ANSWriter()
+    for c in message:
+        code.write_symbol(c, stream)
+    stream.finish(bw)
+    bw.flush()
+
+    reader = ANSReader(fp.getvalue())
+    decoder = TableCode.read_from_codebook(reader, alphabet)
+    to_read = reader.read_uint(16)
+    reader.begin()
+    return ''.join(decoder.read_symbol(reader) for _ in range(to_read))
+
+
+class ANSTests(unittest.TestCase):
+    def test_basic(self):
+        message = ('Lorem ipsum dolor sit amet, consectetur adipiscing elit. Nullam quis dignissim turpis. '
+                   'Praesent quis lobortis tortor, pretium tincidunt tortor. Sed bibendum lacus vitae orci egestas, '
+                   'sit amet consequat leo auctor. Etiam sed turpis vitae neque turpis duis.')
+        self.assertEqual(roundtrip(message, string.printable), message)
+
+    def test_skewed(self):
+        # symbols much more frequent than half the message cost less than a bit each
+        message = 'a' * 1000 + 'bc' * 5
+        self.assertEqual(roundtrip(message, 'abc'), message)
+        code = TableCode.from_counts(Counter(message))
+        self.assertLess(code.cost(Counter(message)), len(message) / 4)
+
+    def test_single_symbol(self):
+        self.assertEqual(roundtrip('zzzz', string.ascii_lowercase), 'zzzz')
+        code = TableCode.from_counts({'z': 4})
+        self.assertEqual(code.cost({'z': 4}), 0)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            TableCode([], [])
+        with self.assertRaises(ValueError):
+            TableCode('ab', [3, 2])
+        with self.assertRaises(ValueError):
+            TableCode('ab', [1 << TABLE_LOG, 1 << TABLE_LOG])
+
+    def test_mixed_streams(self):
+        code = TableCode.from_counts(Counter('aaaabbc'))
+        writer = ANSWriter()
+        writer.write_uint(5, 3)
+        code.write_symbol('a', writer)
+        writer.begin_capture()
+        code.write_symbol('c', writer)
+        writer.write_uint(0x1234567890, 40)
+        code.write_symbol('b', writer)
+        writer.end_capture(7)
+        code.write_symbol('b', writer)
+        writer.write_bool(True)
+
+        fp = BytesIO()
+        bw = BitsIO(fp)
+        writer.finish(bw)
+        bw.flush()
+
+        reader = ANSReader(fp.getvalue())
+        reader.begin()
+        self.assertEqual(reader.read_uint(3), 5)
+        self.assertEqual(code.read_symbol(reader), 'a')
+        bits = reader.read_ue()
+        self.assertEqual(reader.read_ue(), 7)
+        pos = reader.tell()
+        reader.begin()
+        self.assertEqual(code.read_symbol(reader), 'c')
+        self.assertEqual(reader.read_uint(40), 0x1234567890)
+        self.assertEqual(code.read_symbol(reader), 'b')
+        reader.end()
+        self.assertEqual(reader.tell(), pos + bits)
+        self.assertEqual(code.read_symbol(reader), 'b')
+        self.assertTrue(reader.read_bool())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import os
+import json
+import tempfile
+import unittest
+from bonsai import batch
+from test.test_codec import script, identifier
+
+
+class BatchTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.src = os.path.join(self.tmp.name, 'src')
+        os.makedirs(os.path.join(self.src, 'lib'))
+        for path in ('a.json', os.path.join('lib', 'b.json')):
+            with open(os.path.join(self.src, path), 'w') as fp:
+                json.dump(script({'type': 'ExpressionStatement', 'expression': identifier('a' * 100)}), fp)
+
+    def test_collect(self):
+        out = os.path.join(self.tmp.name, 'out')
+        pairs = batch.collect([self.src, os.path.join(self.src, 'lib', '*.json')], out, 'encode')
+        self.assertEqual(pairs, [
+            (os.path.join(self.src, 'a.json'), os.path.join(out, 'a.bonsai')),
+            (os.path.join(self.src, 'lib', 'b.json'), os.path.join(out, 'b.bonsai')),
+        ])
+
+        # files of the same name from different directories would overwrite each other
+        with open(os.path.join(self.src, 'lib', 'a.json'), 'w') as fp:
+            json.dump(script(), fp)
+        with self.assertRaises(ValueError):
+            batch.collect([os.path.join(self.src, '*.json'), os.path.join(self.src, 'lib', '*.json')],
+                          out, 'encode')
+
+    def test_run(self):
+        out = os.path.join(self.tmp.name, 'out')
+        pairs = batch.collect([self.src], out, 'encode')
+        self.assertEqual(pairs[1][1], os.path.join(out, 'lib', 'b.bonsai'))
+
+        result = batch.run('encode', pairs, 'shift_es5', jobs=1)
+        self.assertEqual((result.files, result.skipped, result.failed), (2, 0, 0))
+        self.assertLess(result.output_size, result.input_size)
+
+        result = batch.run('encode', pairs, 'shift_es5', jobs=1)
+        self.assertEqual((result.files, result.skipped), (0, 2))
+
+        decoded = os.path.join(self.tmp.name, 'decoded')
+        result = batch.run('decode', batch.collect([out], decoded, 'decode'), 'shift_es5', jobs=1)
+        self.assertEqual(result.files, 2)
+        with open(os.path.join(decoded, 'lib', 'b.json')) as fp:
+            self.assertEqual(json.load(fp)['type'], 'Script')
+
+    def test_failure(self):
+        out = os.path.join(self.tmp.name, 'out')
+        # valid JSON that fails while it's being encoded
+        with open(os.path.join(self.src, 'bad.json'), 'w') as fp:
+            json.dump({'type': 'Script'}, fp)
+        pairs = batch.collect([self.src], out, 'encode')
+
+        result = batch.run('encode', pairs, 'shift_es5', jobs=1)
+        self.assertEqual((result.files, result.skipped, result.failed), (2, 0, 1))
+        self.assertEqual(sorted(os.listdir(out)), ['a.bonsai', 'lib'])
+
+        result = batch.run('encode', pairs, 'shift_es5', jobs=1)
+        self.assertEqual((result.files, result.skipped, result.failed), (0, 2, 1))
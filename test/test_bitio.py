@@ -1,17 +1,62 @@
+import random
 import unittest
 import itertools
-from bonsai.bits import BitsIO
+from bonsai.bits import BitsIO, BitsReader
 
 
 class BitstringIOTests(unittest.TestCase):
     def test_ue(self):
-        for value, order in itertools.product((0, 123, 456), (0, 4, 10)):
+        for value, order in itertools.product((0, 123, 456, 1 << 40, (1 << 100) + 5), (0, 2, 4, 10)):
             with self.subTest(value=value, order=order):
                 bio = BitsIO()
                 bio.write_ue(value, order)
                 bio.seek(0)
                 self.assertEqual(bio.read_ue(order), value)
 
+    def test_uint(self):
+        rng = random.Random(0)
+        values = [(rng.getrandbits(bits), bits) for bits in (rng.randint(1, 100) for _ in range(1000))]
+        bio = BitsIO()
+        for value, bits in values:
+            bio.write_uint(value, bits)
+        self.assertEqual(bio.tell(), sum(bits for _, bits in values))
+        bio.seek(0)
+        for value, bits in values:
+            self.assertEqual(bio.read_uint(bits), value)
+
+    def test_capture(self):
+        bio = BitsIO()
+        bio.write_uint(0b1, 1)
+        bio.begin_capture()
+        bio.write_uint(0b10, 2)
+        bio.begin_capture()
+        bio.write_uint((1 << 99) + 1, 100)
+        self.assertEqual(bio.end_capture(), ((1 << 99) + 1, 100))
+        bio.write_uint(0b11, 2)
+        self.assertEqual(bio.end_capture(), (0b1011, 4))
+        bio.write_uint(0b0, 1)
+        self.assertEqual(bio.tell(), 2)
+        bio.seek(0)
+        self.assertEqual(bio.read_uint(2), 0b10)
+
+    def test_flush_padding(self):
+        bio = BitsIO()
+        bio.write_uint(0b101, 3)
+        bio.flush()
+        bio.write_uint(0b1, 1)
+        bio.flush()
+        self.assertEqual(bio.fp.getvalue(), bytes((0b10100000, 0b10000000)))
+
+    def test_ue_codes(self):
+        # order 0: 1, 010, 011, 00100, ...
+        for value, code in ((0, '1'), (1, '010'), (2, '011'), (3, '00100'), (6, '00111')):
+            with self.subTest(value=value):
+                bio = BitsIO()
+                bio.write_ue(value)
+                self.assertEqual(bio.tell(), len(code))
+                bio.seek(0)
+                self.assertEqual(bio.read_uint(len(code)), int(code, 2))
+
     def test_se(self):
         bio = BitsIO()
         bio.write_se(-123456)
@@ -19,5 +64,32 @@ class BitstringIOTests(unittest.TestCase):
         self.assertEqual(bio.read_se(), -123456)
 
 
+class BitsReaderTests(unittest.TestCase):
+    def test_peek_consume(self):
+        reader = BitsReader(memoryview(bytes((0b10110011, 0b01010101))))
+        self.assertEqual(reader.peek(4), 0b1011)
+        reader.consume(3)
+        self.assertEqual(reader.tell(), 3)
+        self.assertEqual(reader.read_uint(9), 0b100110101)
+        # peeking past the end pads with zeros
+        self.assertEqual(reader.peek(8), 0b01010000)
+
+    def test_seek(self):
+        data = bytes(range(256)) * 4
+        reader = BitsReader(data)
+        for pos in (0, 5, 64, 1000, 4000):
+            with self.subTest(pos=pos):
+                reader.seek(pos)
+                self.assertEqual(reader.tell(), pos)
+                expected = int.from_bytes(data, 'big') >> (len(data) * 8 - pos - 57) & (1 << 57) - 1
+                self.assertEqual(reader.read_uint(57), expected)
+
+    def test_eof(self):
+        reader = BitsReader(b'\xff')
+        self.assertEqual(reader.read_uint(8), 0xff)
+        with self.assertRaises(EOFError):
+            reader.read_uint(1)
+
+
 if __name__ == '__main__':
     unittest.main()
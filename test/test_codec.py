@@ -0,0 +1,351 @@
+import copy
+import json
+import mmap
+import itertools
+import tempfile
+import unittest
+from io import BytesIO, StringIO
+from bonsai import format
+from bonsai.codec.decoder import LazyNode
+from bonsai.jsonevents import iter_events
+from bonsai.specs import shift_es5
+
+
+def script(*statements):
+    return {'type': 'Script', 'body': {'type': 'FunctionBody', 'directives': [], 'statements': list(statements)}}
+
+
+def identifier(name):
+    return {'type': 'IdentifierExpression', 'identifier': {'type': 'Identifier', 'name': name}}
+
+
+def roundtrip(ast, codegen=True):
+    with BytesIO() as fp:
+        format.encode(shift_es5, ast, fp, codegen=codegen)
+        fp.seek(0)
+        return format.decode(shift_es5, fp, codegen=codegen)
+
+
+class CodecTests(unittest.TestCase):
+    def test_roundtrip(self):
+        ast = script(
+            {'type': 'VariableDeclarationStatement', 'declaration': {
+                'type': 'VariableDeclaration', 'kind': 'var', 'declarators': [
+                    {'type': 'VariableDeclarator', 'binding': {'type': 'Identifier', 'name': 'a'},
+                     'init': {'type': 'LiteralNumericExpression', 'value': '1.5'}},
+                    {'type': 'VariableDeclarator', 'binding': {'type': 'Identifier', 'name': 'b'},
+                     'init': None},
+                ]}},
+            {'type': 'ExpressionStatement', 'expression': {
+                'type': 'CallExpression', 'callee': identifier('f'),
+                'arguments': [identifier('a'), identifier('a'), {'type': 'LiteralBooleanExpression', 'value': True}]}},
+        )
+        for codegen in (True, False):
+            with self.subTest(codegen=codegen):
+                self.check_roundtrip(roundtrip(copy.deepcopy(ast), codegen))
+
+    def test_codegen_output(self):
+        ast = script(*[
+            {'type': 'IfStatement', 'test': identifier(name),
+             'consequent': {'type': 'ReturnStatement', 'expression': identifier('a')},
+             'alternate': None if i % 2 else {'type': 'EmptyStatement'}}
+            for i, name in enumerate('abcabcdd')
+        ])
+        outputs = []
+        for codegen in (True, False):
+            with BytesIO() as fp:
+                format.encode(shift_es5, copy.deepcopy(ast), fp, codegen=codegen)
+                outputs.append(fp.getvalue())
+        self.assertEqual(outputs[0], outputs[1])
+
+    def test_stream_output(self):
+        ast = script(*[
+            {'type': 'ExpressionStatement', 'expression': {
+                'type': 'CallExpression', 'callee': identifier(name),
+                'arguments': [identifier('a'), {'type': 'LiteralNullExpression'},
+                              {'type': 'LiteralNumericExpression', 'value': str(i)}]}}
+            for i, name in enumerate('abcab')
+        ], {'type': 'ReturnStatement', 'expression': None})
+        text = json.dumps(ast)
+        with BytesIO() as fp:
+            format.encode(shift_es5, copy.deepcopy(ast), fp)
+            expected = fp.getvalue()
+        with BytesIO() as fp:
+            format.encode_events(shift_es5, iter_events(StringIO(text), chunk_size=7), fp)
+            self.assertEqual(fp.getvalue(), expected)
+
+    def test_segments(self):
+        statements = [
+            {'type': 'ExpressionStatement', 'expression': {
+                'type': 'AssignmentExpression', 'operator': '=',
+                'binding': identifier(name), 'expression': identifier('a')}}
+            for name in 'abcdefabc'
+        ]
+        for count in (0, 1, 4, 20):
+            ast = script(*statements[:count])
+            expected = json.loads(json.dumps(roundtrip(copy.deepcopy(ast))))
+
+            outputs = []
+            for jobs in (None, 2):
+                with self.subTest(count=count, jobs=jobs), BytesIO() as fp:
+                    format.encode(shift_es5, copy.deepcopy(ast), fp, segments=3, jobs=jobs)
+                    outputs.append(fp.getvalue())
+                    fp.seek(0)
+                    decoded = format.decode(shift_es5, fp, jobs=jobs)
+                    self.assertEqual(json.loads(json.dumps(decoded)), expected)
+            self.assertEqual(outputs[0], outputs[1])
+
+        # the statements would otherwise all be left out of the trunk
+        for segments in (0, -1):
+            with self.subTest(segments=segments), BytesIO() as fp:
+                with self.assertRaises(ValueError):
+                    format.encode(shift_es5, script(*statements), fp, segments=segments)
+                self.assertEqual(fp.tell(), 0)
+
+    def test_lazy(self):
+        def function(name, *statements):
+            return {'type': 'FunctionDeclaration', 'name': {'type': 'Identifier', 'name': name},
+                    'parameters': [{'type': 'Identifier', 'name': 'a'}],
+                    'body': {'type': 'FunctionBody', 'directives': [], 'statements': list(statements)}}
+
+        def ret(expression):
+            return {'type': 'ReturnStatement', 'expression': expression}
+
+        ast = script(
+            function('f', ret(identifier('a')), function('g', ret(identifier('b')))),
+            {'type': 'ExpressionStatement', 'expression': identifier('a')},
+            function('h', ret(identifier('b'))),
+            function('i'),
+            function('j'),
+        )
+        expected = json.loads(json.dumps(ast))
+        for codegen in (True, False):
+            with self.subTest(codegen=codegen), BytesIO() as fp:
+                format.encode(shift_es5, copy.deepcopy(ast), fp, codegen=codegen, lazy=True)
+                fp.seek(0)
+                decoded = format.decode(shift_es5, fp, codegen=codegen)
+                self.assertEqual(json.loads(json.dumps(decoded)), expected)
+
+                fp.seek(0)
+                decoded = format.decode(shift_es5, fp, codegen=codegen, lazy=True)
+                statements = decoded['body']['statements']
+                body = statements[0]['body']
+                self.assertIsInstance(body, LazyNode)
+                self.assertFalse(body.loaded)
+                self.assertEqual(body['statements'][0], ret(identifier('a')))
+                self.assertTrue(body.loaded)
+                self.assertIsInstance(body['statements'][1]['body'], LazyNode)
+                self.assertEqual(statements[2]['body']['statements'], (ret(identifier('b')),))
+                self.assertIs(statements[3]['body'], statements[4]['body'])
+
+    def test_string_refs(self):
+        names = 'a b a c b a d a'.split()
+        ast = script(*[
+            {'type': 'ExpressionStatement', 'expression': {
+                'type': 'StaticMemberExpression', 'object': identifier(name),
+                'property': {'type': 'Identifier', 'name': names[-i - 1]}}}
+            for i, name in enumerate(names)
+        ])
+        expected = json.loads(json.dumps(ast))
+        for codegen, segments in itertools.product((True, False), (None, 3)):
+            with self.subTest(codegen=codegen, segments=segments), BytesIO() as fp:
+                format.encode(shift_es5, copy.deepcopy(ast), fp, codegen=codegen, segments=segments,
+                              lazy=True, string_refs=True)
+                fp.seek(0)
+                decoded = format.decode(shift_es5, fp, codegen=codegen)
+                self.assertEqual(json.loads(json.dumps(decoded)), expected)
+
+        with BytesIO() as fp:
+            format.encode(shift_es5, copy.deepcopy(ast), fp, string_refs=True)
+            section = format.read_header(fp.getvalue()).section(format.SECTION_STRINGS)
+            compressed = fp.getvalue()[section.offset:section.end]
+            self.assertEqual(format.decompress_section(compressed), b'a\0b\0d\0c')
+            fp.seek(0)
+            statements = format.decode(shift_es5, fp)['body']['statements']
+            self.assertIs(statements[0]['expression']['property']['name'],
+                          statements[2]['expression']['object']['identifier']['name'])
+
+    def check_roundtrip(self, decoded):
+        declarators = decoded['body']['statements'][0]['declaration']['declarators']
+        self.assertEqual(declarators[0]['binding'], {'type': 'Identifier', 'name': 'a'})
+        self.assertEqual(declarators[0]['init'], {'type': 'LiteralNumericExpression', 'value': 1.5})
+        self.assertIsNone(declarators[1]['init'])
+
+        call = decoded['body']['statements'][1]['expression']
+        self.assertEqual(call['callee'], identifier('f'))
+        self.assertEqual(call['arguments'][0], identifier('a'))
+        self.assertIs(call['arguments'][0], call['arguments'][1])
+        self.assertIs(call['arguments'][2]['value'], True)
+
+    def test_deep_nesting(self):
+        depth = 5000
+        expression = identifier('x')
+        for i in range(depth):
+            expression = {'type': 'BinaryExpression', 'operator': '+',
+                          'left': expression, 'right': identifier(str(i))}
+        decoded = roundtrip(script({'type': 'ExpressionStatement', 'expression': expression}))
+
+        node = decoded['body']['statements'][0]['expression']
+        for i in reversed(range(depth)):
+            self.assertEqual(node['right'], identifier(str(i)))
+            node = node['left']
+        self.assertEqual(node, identifier('x'))
+
+    def test_deep_lazy_nesting(self):
+        # every function body is coded as a blob nested in the one enclosing it
+        depth = 3000
+
+        def build():
+            statement = {'type': 'ReturnStatement', 'expression': identifier('x')}
+            for i in range(depth):
+                statement = {'type': 'FunctionDeclaration', 'name': {'type': 'Identifier', 'name': f'f{i}'},
+                             'parameters': [], 'body': {'type': 'FunctionBody', 'directives': [],
+                                                        'statements': [statement]}}
+            return script(statement)
+
+        for tans in (False, True):
+            with self.subTest(tans=tans), BytesIO() as fp:
+                format.encode(shift_es5, build(), fp, lazy=True, tans=tans)
+                for lazy in (False, True):
+                    fp.seek(0)
+                    node = format.decode(shift_es5, fp, lazy=lazy)['body']['statements'][0]
+                    for i in reversed(range(depth)):
+                        self.assertEqual(node['name']['name'], f'f{i}')
+                        node = node['body']['statements'][0]
+                    self.assertEqual(node['expression'], identifier('x'))
+
+    def test_tans(self):
+        ast = script(*[
+            {'type': 'ExpressionStatement', 'expression': {
+                'type': 'BinaryExpression', 'operator': '+' if i % 5 else '-',
+                'left': identifier(name), 'right': {'type': 'LiteralNumericExpression', 'value': i}}}
+            for i, name in enumerate('abcabcaadd' * 3)
+        ], {'type': 'FunctionDeclaration', 'name': {'type': 'Identifier', 'name': 'f'},
+            'parameters': [], 'body': {'type': 'FunctionBody', 'directives': [],
+                                       'statements': [{'type': 'ReturnStatement',
+                                                       'expression': identifier('a')}]}})
+        expected = json.loads(json.dumps(ast))
+        options = [{}, {'lazy': True}, {'segments': 3}, {'string_refs': True},
+                   {'lazy': True, 'string_refs': True}]
+        for codegen, extra in itertools.product((True, False), options):
+            with self.subTest(codegen=codegen, **extra), BytesIO() as fp:
+                format.encode(shift_es5, copy.deepcopy(ast), fp, codegen=codegen, tans=True, **extra)
+                for lazy in (False, True):
+                    fp.seek(0)
+                    decoded = format.decode(shift_es5, fp, codegen=codegen, lazy=lazy)
+                    self.assertEqual(json.loads(json.dumps(decoded, default=dict)), expected)
+
+    def test_pipeline(self):
+        ast = script(*[
+            {'type': 'ExpressionStatement', 'expression': {
+                'type': 'CallExpression', 'callee': identifier(f'f{i % 7}'),
+                'arguments': [{'type': 'LiteralStringExpression', 'value': str(i) * 3}]}}
+            for i in range(200)
+        ])
+        expected = json.loads(json.dumps(ast))
+        options = [{}, {'lazy': True}, {'segments': 3}, {'string_refs': True}]
+        for extra in options:
+            with self.subTest(**extra), BytesIO() as fp:
+                format.encode(shift_es5, copy.deepcopy(ast), fp, **extra)
+                data = fp.getvalue()
+                with BytesIO() as pipelined:
+                    format.encode(shift_es5, copy.deepcopy(ast), pipelined, pipeline=True, **extra)
+                    self.assertEqual(pipelined.getvalue(), data)
+
+                for lazy in (False, True):
+                    fp.seek(0)
+                    decoded = format.decode(shift_es5, fp, lazy=lazy, pipeline=True)
+                    self.assertEqual(json.loads(json.dumps(decoded, default=dict)), expected)
+
+    def test_buffers(self):
+        ast = script(*[
+            {'type': 'ExpressionStatement', 'expression': {
+                'type': 'CallExpression', 'callee': identifier(name),
+                'arguments': [{'type': 'LiteralStringExpression', 'value': name * 2}]}}
+            for name in 'abcabd'
+        ], {'type': 'FunctionDeclaration', 'name': {'type': 'Identifier', 'name': 'f'},
+            'parameters': [], 'body': {'type': 'FunctionBody', 'directives': [],
+                                       'statements': [{'type': 'ReturnStatement',
+                                                       'expression': identifier('a')}]}})
+        expected = json.loads(json.dumps(ast))
+        for options in ({}, {'segments': 2}, {'lazy': True, 'string_refs': True}):
+            with self.subTest(**options), tempfile.TemporaryFile() as fp:
+                format.encode(shift_es5, copy.deepcopy(ast), fp, **options)
+                fp.seek(0)
+                data = fp.read()
+                for source in (data, memoryview(data), bytearray(data)):
+                    self.assertEqual(json.loads(json.dumps(format.decode(shift_es5, source))), expected)
+
+                # lazy nodes are only loaded once the mapping is closed
+                for pipeline, lazy in itertools.product((False, True), repeat=2):
+                    with format.map_file(fp) as mapped:
+                        self.assertIsInstance(mapped, mmap.mmap)
+                        decoded = format.decode(shift_es5, mapped, pipeline=pipeline, lazy=lazy)
+                    self.assertEqual(json.loads(json.dumps(decoded, default=dict)), expected)
+
+    def test_header(self):
+        ast = script(*[{'type': 'ExpressionStatement', 'expression': identifier(name)}
+                       for name in 'abcab'])
+        expected = json.loads(json.dumps(ast))
+        for options in ({}, {'segments': 2, 'tans': True}):
+            with self.subTest(**options), BytesIO() as fp:
+                format.encode(shift_es5, copy.deepcopy(ast), fp, **options)
+                data = fp.getvalue()
+
+                fp.seek(0)
+                header = format.read_header(fp)
+                self.assertEqual(header.version, format.FORMAT_VERSION)
+                self.assertEqual(header.spec_name, 'shift_es5')
+                self.assertEqual(header.flags, format.FLAG_SEGMENTED | format.FLAG_TANS if options else 0)
+                self.assertIsNone(header.profile_id)
+                kinds = [format.SECTION_STRINGS, format.SECTION_GRAPH] + [format.SECTION_SEGMENTS] * bool(options)
+                self.assertEqual([x.kind for x in header.sections], kinds)
+                self.assertEqual(header.sections[-1].end, len(data))
+                strings = header.section(format.SECTION_STRINGS)
+                self.assertEqual(strings.size, len(format.decompress_section(data[strings.offset:strings.end])))
+
+                if options:
+                    continue
+
+                # files from before the directory have no flags, and each section is preceded
+                # by its length
+                graph = header.section(format.SECTION_GRAPH)
+                legacy = [format.MAGIC, strings.size.to_bytes(4, 'big'), strings.length.to_bytes(4, 'big'),
+                          data[strings.offset:strings.end], graph.length.to_bytes(4, 'big'),
+                          data[graph.offset:]]
+                legacy_header = format.read_header(b''.join(legacy))
+                self.assertEqual(legacy_header.version, 0)
+                self.assertEqual([x.length for x in legacy_header.sections],
+                                 [x.length for x in header.sections])
+                decoded = format.decode(shift_es5, b''.join(legacy))
+                self.assertEqual(json.loads(json.dumps(decoded)), expected)
+
+        strings_data = format.compress_section(b'')
+        name = len(format.MAGIC_CONTAINER) + 2
+        for pos, value in ((name - 2, format.FORMAT_VERSION + 1), (name + 8, ord('6'))):
+            corrupt = bytearray(data)
+            corrupt[pos] = value
+            with self.assertRaises(ValueError):
+                format.decode(shift_es5, corrupt)
+
+        with BytesIO() as fp:
+            format.write_container(fp, shift_es5, 0, None, [(format.SECTION_STRINGS, strings_data, 0)])
+            for decode in (format.decode, format.decode_table):
+                with self.assertRaisesRegex(ValueError, 'missing section graph'):
+                    decode(shift_es5, fp.getvalue())
+
+    def test_input_unchanged(self):
+        ast = script(*[{'type': 'ExpressionStatement', 'expression': identifier(name)}
+                       for name in 'abab'])
+        expected = copy.deepcopy(ast)
+        for options in ({}, {'segments': 2}, {'string_refs': True}):
+            with self.subTest(**options), BytesIO() as fp:
+                format.encode(shift_es5, ast, fp, **options)
+                self.assertEqual(ast, expected)
+                fp.seek(0)
+                self.assertEqual(format.decode(shift_es5, fp)['body']['statements'][2],
+                                 expected['body']['statements'][0])
+
+
+if __name__ == '__main__':
+    unittest.main()
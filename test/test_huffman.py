@@ -1,23 +1,23 @@
 import unittest
 import string
 from collections import Counter
-from bonsai.huffman import CanonicalCode
+from bonsai.huffman import CanonicalCode, construct_tree, code_lengths, limited_code_lengths
 from bonsai.bits import BitsIO
 
 
-def roundtrip(message, alphabet):
+def roundtrip(message, alphabet, length_bits=10):
     counts = Counter(message)
 
     encoder = CanonicalCode.from_counts(counts)
     bw = BitsIO()
     encoder.write_codebook(alphabet, bw)
-    bw.write_uint(len(message), 10)
+    bw.write_uint(len(message), length_bits)
     for c in message:
         encoder.write_symbol(c, bw)
 
     bw.seek(0)
     decoder = CanonicalCode.read_from_codebook(bw, alphabet)
-    to_read = bw.read_uint(10)
+    to_read = bw.read_uint(length_bits)
     return ''.join(decoder.read_symbol(bw) for _ in range(to_read))
 
 
@@ -37,6 +37,39 @@ class HuffmanTests(unittest.TestCase):
         decoded = roundtrip(message, alphabet)
         self.assertEqual(message, decoded)
 
+    def test_long_codes(self):
+        # Fibonacci weights produce codes longer than the first-level decode table
+        fib = [1, 1]
+        while len(fib) < 20:
+            fib.append(fib[-1] + fib[-2])
+        alphabet = string.ascii_letters[:len(fib)]
+        message = ''.join(c * n for c, n in zip(alphabet, fib))
+        self.assertGreater(len(CanonicalCode.from_counts(Counter(message)).length_counts),
+                           CanonicalCode.TABLE_BITS)
+        decoded = roundtrip(message[::-1], alphabet, length_bits=16)
+        self.assertEqual(message[::-1], decoded)
+
+    def test_length_limit(self):
+        fib = [1, 1]
+        while len(fib) < 20:
+            fib.append(fib[-1] + fib[-2])
+        counts = dict(zip(string.ascii_letters, fib))
+
+        lengths = limited_code_lengths(counts, 8)
+        self.assertEqual(max(lengths.values()), 8)
+        # Kraft equality holds, so the code is complete
+        self.assertEqual(sum(2 ** (8 - x) for x in lengths.values()), 2 ** 8)
+        self.assertEqual(len(CanonicalCode.from_counts(counts, 8).length_counts), 8)
+
+        # a limit that isn't reached gives optimal lengths
+        unlimited = code_lengths(construct_tree(counts))
+        cost = sum(counts[s] * x for s, x in unlimited.items())
+        limited = limited_code_lengths(counts, 19)
+        self.assertEqual(sum(counts[s] * x for s, x in limited.items()), cost)
+
+        with self.assertRaises(ValueError):
+            limited_code_lengths(counts, 4)
+
     def test_construction(self):
         # this generates codes 0, 10, 110, 111
         coder = CanonicalCode('abcd', (1, 1, 2))
@@ -0,0 +1,54 @@
+import io
+import json
+import unittest
+from bonsai.jsonevents import iter_events
+
+
+def build(events):
+    """Rebuilds a document from parse events."""
+    stack = [[]]
+    keys = []
+    for event, value in events:
+        if event == 'start_map':
+            stack.append({})
+        elif event == 'start_array':
+            stack.append([])
+        elif event == 'key':
+            keys.append(value)
+            continue
+        else:
+            if event in ('end_map', 'end_array'):
+                value = stack.pop()
+            if isinstance(stack[-1], dict):
+                stack[-1][keys.pop()] = value
+            else:
+                stack[-1].append(value)
+    return stack[0][0]
+
+
+class JSONEventsTests(unittest.TestCase):
+    doc = {
+        'type': 'Script',
+        'numbers': [0, -1, 12.5, 1e21, 3.0E-7, 123456789012345678901234567890],
+        'strings': ['', 'plain', 'esc\\"aped\n', 'é日😀', ' ' * 40],
+        'literals': [True, False, None, [], {}],
+        'nested': {'a': [{'b': [[None]]}], 'c': {}},
+    }
+
+    def test_roundtrip(self):
+        text = json.dumps(self.doc, ensure_ascii=False, indent=1)
+        expected = json.loads(text, parse_int=str, parse_float=str)
+        for chunk_size in (1, 2, 3, 7, 64, 1 << 16):
+            with self.subTest(chunk_size=chunk_size):
+                events = iter_events(io.StringIO(text), chunk_size)
+                self.assertEqual(build(events), expected)
+
+    def test_errors(self):
+        for text in ('', '{', '[1,]', '{"a" 1}', '{"a": 1} 2', 'nul', '[1 2]', '"abc', '{1: 2}'):
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    list(iter_events(io.StringIO(text), 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import random
+import unittest
+from bonsai.mtf import MoveToFront
+
+
+class MoveToFrontTests(unittest.TestCase):
+    def test_against_list(self):
+        rng = random.Random(0)
+        mtf = MoveToFront()
+        model = []
+
+        for _ in range(5000):
+            item = rng.randrange(300)
+            rank = model.index(item) if item in model else None
+            self.assertEqual(mtf.rank(item), rank)
+
+            if model and rng.random() < 0.2:
+                rank = rng.randrange(len(model))
+                self.assertEqual(mtf.pop(rank), model.pop(rank))
+            else:
+                if rank is not None:
+                    del model[rank]
+                model.insert(0, item)
+                mtf.move_to_front(item)
+
+            self.assertEqual(len(mtf), len(model))
+
+        self.assertEqual(list(mtf), model)
+
+    def test_pop_out_of_range(self):
+        mtf = MoveToFront()
+        mtf.move_to_front('a')
+        with self.assertRaises(IndexError):
+            mtf.pop(1)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import copy
+import json
+import unittest
+from io import BytesIO
+from bonsai import format
+from bonsai.specs import shift_es5
+from test.test_codec import script, identifier
+
+
+class NodeTableTests(unittest.TestCase):
+    ast = script(
+        {'type': 'VariableDeclarationStatement', 'declaration': {
+            'type': 'VariableDeclaration', 'kind': 'let', 'declarators': [
+                {'type': 'VariableDeclarator', 'binding': {'type': 'Identifier', 'name': 'a'},
+                 'init': {'type': 'LiteralNumericExpression', 'value': '2'}},
+                {'type': 'VariableDeclarator', 'binding': {'type': 'Identifier', 'name': 'b'},
+                 'init': None},
+            ]}},
+        {'type': 'ExpressionStatement', 'expression': identifier('a')},
+        {'type': 'ExpressionStatement', 'expression': {
+            'type': 'LiteralBooleanExpression', 'value': False}},
+    )
+
+    def decode_table(self, **kwargs):
+        with BytesIO() as fp:
+            format.encode(shift_es5, copy.deepcopy(self.ast), fp, **kwargs)
+            fp.seek(0)
+            return format.decode_table(shift_es5, fp)
+
+    def test_accessors(self):
+        table = self.decode_table()
+        root = len(table) - 1
+        self.assertIs(table.node_type(root), shift_es5.Script)
+
+        body = table.get(root, 'body')
+        self.assertEqual(table.children(root), [body])
+        statements = table.get(body, 'statements')
+        self.assertEqual(len(statements), 3)
+        self.assertEqual(table.get(body, 'directives'), ())
+
+        declaration = table.get(statements[0], 'declaration')
+        self.assertEqual(table.get(declaration, 'kind'), 'let')
+        first, second = table.get(declaration, 'declarators')
+        self.assertIsNone(table.get(second, 'init'))
+        self.assertEqual(table.get(table.get(first, 'init'), 'value'), 2)
+        self.assertEqual(table.node(table.get(first, 'binding')), {'type': 'Identifier', 'name': 'a'})
+        self.assertIs(table.get(table.get(statements[2], 'expression'), 'value'), False)
+
+        counts = table.type_counts()
+        self.assertEqual(counts['Identifier'], 2)
+        self.assertEqual(counts['ExpressionStatement'], 2)
+        self.assertEqual(sum(counts.values()), len(table))
+
+    def test_to_tree(self):
+        with BytesIO() as fp:
+            format.encode(shift_es5, copy.deepcopy(self.ast), fp)
+            fp.seek(0)
+            expected = json.dumps(format.decode(shift_es5, fp))
+
+        for lazy in (False, True):
+            for string_refs in (False, True):
+                with self.subTest(lazy=lazy, string_refs=string_refs):
+                    table = self.decode_table(lazy=lazy, string_refs=string_refs)
+                    self.assertEqual(json.dumps(table.to_tree()), expected)
@@ -0,0 +1,77 @@
+import unittest
+from decimal import Decimal, DecimalTuple
+from bonsai.bits import BitsIO
+from bonsai.codec.numbers import vardecimal, parse, write_number, read_number
+
+
+def write_decimal(value, writer):
+    """Writes a number one digit at a time through Decimal."""
+    dt = Decimal(value).as_tuple()
+
+    digits = dt.digits if dt.digits != (0,) else ()
+    for d in digits:
+        vardecimal.write_symbol(d, writer)
+    vardecimal.write_symbol(None, writer)
+
+    if digits:
+        writer.write_bool(dt.sign)
+
+    writer.write_se(dt.exponent)
+
+
+def read_decimal(reader):
+    digits = []
+    while True:
+        sym = vardecimal.read_symbol(reader)
+        if sym is None:
+            break
+        digits.append(sym)
+
+    sign = reader.read_bool() if digits else 0
+    exponent = reader.read_se()
+
+    decimal = Decimal(DecimalTuple(sign, digits, exponent))
+    return float(decimal) if exponent else int(decimal)
+
+
+class NumberTests(unittest.TestCase):
+    values = ['0', '-0', '7', '10', '999', '1000', '-42', '0.5', '-0.0', '1.50', '0.0010', '3.0E-7',
+              '1e21', '5e+3', '123456789012345678901234567890', '.5', '5.', '00012',
+              0, 12, -3, 2 ** 70, 1.5, 0.1, True]
+
+    def test_parse(self):
+        for value in self.values:
+            with self.subTest(value=value):
+                if isinstance(value, (float, bool)):
+                    self.assertIsNone(parse(value))
+                    continue
+                dt = Decimal(value).as_tuple()
+                digits = ''.join(map(str, dt.digits)).lstrip('0')
+                self.assertEqual(parse(value), (bool(dt.sign), digits, dt.exponent))
+
+    def test_same_bits(self):
+        expected = BitsIO()
+        actual = BitsIO()
+        for value in self.values:
+            write_decimal(value, expected)
+            write_number(value, actual)
+
+        bits = expected.tell()
+        self.assertEqual(actual.tell(), bits)
+        expected.seek(0)
+        actual.seek(0)
+        self.assertEqual(actual.read_uint(bits), expected.read_uint(bits))
+
+    def test_read(self):
+        bio = BitsIO()
+        for value in self.values:
+            write_decimal(value, bio)
+        bio.seek(0)
+        expected = [read_decimal(bio) for _ in self.values]
+
+        bio.seek(0)
+        for value, decoded in zip(self.values, expected):
+            with self.subTest(value=value):
+                actual = read_number(bio)
+                self.assertEqual(actual, decoded)
+                self.assertIs(type(actual), type(decoded))
@@ -0,0 +1,68 @@
+import os
+import copy
+import json
+import tempfile
+import unittest
+import unittest.mock
+from io import BytesIO
+from bonsai import format, profile as profiles
+from bonsai.specs import shift_es5
+from test.test_codec import script, identifier
+
+
+def call(callee, *names):
+    return {'type': 'ExpressionStatement', 'expression': {
+        'type': 'CallExpression', 'callee': identifier(callee),
+        'arguments': [identifier(x) for x in names]}}
+
+
+class ProfileTests(unittest.TestCase):
+    corpus = [script(call('require', 'module'), call('define', 'exports', f'x{i}'),
+                     {'type': 'ReturnStatement', 'expression': None} if i % 2 else call('f'))
+              for i in range(6)]
+    ast = script(call('require', 'exports'), call('define', 'module', 'y'),
+                 {'type': 'IfStatement', 'test': identifier('y'),
+                  'consequent': {'type': 'EmptyStatement'}, 'alternate': None})
+
+    def setUp(self):
+        self.profile = profiles.train(shift_es5, self.corpus)
+        self.dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.dir.cleanup)
+        self.profile.save(self.dir.name)
+
+    def encode(self, **kwargs):
+        with BytesIO() as fp:
+            format.encode(shift_es5, copy.deepcopy(self.ast), fp, **kwargs)
+            return fp.getvalue()
+
+    def test_train(self):
+        self.assertIn(b'require\0', self.profile.dictionary)
+        self.assertNotIn(b'x1\0', self.profile.dictionary)
+
+        loaded = profiles.find(self.profile.id, self.dir.name)
+        self.assertIs(profiles.find(self.profile.id, self.dir.name), loaded)
+        self.assertEqual(loaded.dumps(), self.profile.dumps())
+        with self.assertRaises(ValueError):
+            profiles.find(self.profile.id ^ 1, self.dir.name)
+
+        # the default directory is read when profiles are looked up
+        with unittest.mock.patch.dict(os.environ, {profiles.PROFILE_DIR_VAR: os.getcwd()}):
+            with self.assertRaises(ValueError):
+                profiles.find(self.profile.id)
+        with unittest.mock.patch.dict(os.environ, {profiles.PROFILE_DIR_VAR: self.dir.name}):
+            self.assertIs(profiles.find(self.profile.id), loaded)
+
+    def test_roundtrip(self):
+        expected = json.dumps(format.decode(shift_es5, BytesIO(self.encode())))
+        self.assertLess(len(self.encode(profile=self.profile)), len(self.encode()))
+
+        for options in ({}, {'string_refs': True}, {'lazy': True}, {'segments': 2}):
+            for codegen in (True, False):
+                with self.subTest(codegen=codegen, **options):
+                    data = self.encode(profile=self.profile, codegen=codegen, **options)
+                    decoded = format.decode(shift_es5, BytesIO(data), codegen=codegen,
+                                            profile_dir=self.dir.name)
+                    self.assertEqual(json.dumps(decoded), expected)
+
+        with self.assertRaises(ValueError):
+            self.encode(profile=self.profile, tans=True)
@@ -0,0 +1,28 @@
+import unittest
+import bonsai.specs as spec_types
+from bonsai.schema import compile_schema
+from bonsai.specs import shift_es5
+
+
+class SchemaTests(unittest.TestCase):
+    def test_cached(self):
+        self.assertIs(compile_schema(shift_es5), compile_schema(shift_es5))
+
+    def test_fields(self):
+        schema = compile_schema(shift_es5)
+        node_type = shift_es5.FunctionDeclaration
+        keys = [key for key, _, _ in schema.fields[node_type]]
+        self.assertEqual(keys, ['parameters', 'name', 'body'])
+        for key, _, slot in schema.fields[node_type]:
+            self.assertEqual(slot, (node_type, key))
+
+    def test_ref_fields(self):
+        schema = compile_schema(shift_es5)
+        used_types = [spec_types.Null, shift_es5.Identifier, shift_es5.BreakStatement]
+        ref_fields = dict(schema.iter_ref_fields(used_types))
+        self.assertEqual(ref_fields[shift_es5.BreakStatement, 'label'],
+                         [spec_types.Null, shift_es5.Identifier])
+
+
+if __name__ == '__main__':
+    unittest.main()
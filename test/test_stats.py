@@ -0,0 +1,42 @@
+import copy
+import unittest
+from io import BytesIO
+from bonsai import format, stats
+from bonsai.specs import shift_es5
+from test.test_codec import script, identifier
+
+
+class StatsTests(unittest.TestCase):
+    ast = script(*[
+        {'type': 'IfStatement', 'test': identifier(name),
+         'consequent': {'type': 'ReturnStatement', 'expression': identifier('a')},
+         'alternate': None if i % 2 else {'type': 'EmptyStatement'}}
+        for i, name in enumerate('abcabcdd')
+    ])
+
+    def test_collect(self):
+        for string_refs in (False, True):
+            with self.subTest(string_refs=string_refs):
+                result = stats.collect(shift_es5, copy.deepcopy(self.ast), string_refs=string_refs)
+                with BytesIO() as fp:
+                    format.encode(shift_es5, copy.deepcopy(self.ast), fp, string_refs=string_refs)
+                    header = format.read_header(fp.getvalue())
+
+                strings_bits = result.bits[stats.STRINGS_FIELD, 'strings']
+                self.assertEqual((result.total - strings_bits + 7) // 8,
+                                 header.section(format.SECTION_GRAPH).length)
+                self.assertEqual(strings_bits // 8, header.section(format.SECTION_STRINGS).length)
+
+                categories = result.by_category()
+                self.assertLessEqual({'type', 'backref', 'list', 'codebooks'}, set(categories))
+                self.assertEqual('string ref' in categories, string_refs)
+                self.assertEqual(sum(categories.values()), result.total)
+                self.assertEqual(sum(result.by_node_type().values()), result.total)
+
+                self.assertEqual(result.ast_nodes, 1 + 1 + 8 * 4 + 4 + 8 + 8)
+                self.assertLess(result.graph_nodes, result.ast_nodes)
+
+                # the tests of the last two statements are the same node as an earlier one
+                hits, misses, nulls = result.refs['IfStatement', 'test']
+                self.assertEqual((hits, misses, nulls), (4, 4, 0))
+                self.assertEqual(result.refs['IfStatement', 'alternate'][2], 4)
@@ -0,0 +1,66 @@
+import time
+import pickle
+import unittest
+from unittest import mock
+import brotli
+from bonsai.stringsection import StringSection, StringCompressor
+
+
+class StringSectionTests(unittest.TestCase):
+    strings = ['a', '', 'bc', '盆栽', 'd']
+    data = b'\0'.join(x.encode('utf-8') for x in strings)
+
+    def test_view(self):
+        section = StringSection(self.data)
+        self.assertEqual(list(section), self.strings)
+        self.assertEqual(section[-1], 'd')
+        self.assertEqual(list(section[1:4]), self.strings[1:4])
+        self.assertEqual(list(section[1:4][1:]), self.strings[2:4])
+        self.assertEqual(len(section[3:1]), 0)
+        self.assertEqual(section[::2], self.strings[::2])
+        with self.assertRaises(IndexError):
+            section[1:3][2]
+
+    def test_cursor(self):
+        cursor = StringSection(self.data)[1:].cursor()
+        self.assertEqual(cursor.popleft(), '')
+        self.assertEqual(list(cursor.take(2)), self.strings[2:4])
+        self.assertEqual(cursor.popleft(), 'd')
+        with self.assertRaises(IndexError):
+            cursor.popleft()
+
+    def test_pickle(self):
+        for view in (StringSection(self.data)[2:4], StringSection(self.data)[2:2]):
+            copy = pickle.loads(pickle.dumps(view))
+            self.assertEqual(list(copy), list(view))
+            self.assertLess(len(copy.data), len(self.data))
+
+    def test_load(self):
+        strings = [f'{i}' * (i % 7) for i in range(5000)]
+        compressed = brotli.compress(b'\0'.join(x.encode('utf-8') for x in strings))
+        with mock.patch('bonsai.stringsection.CHUNK_SIZE', 64):
+            cursor = StringSection.load(brotli.Decompressor(), compressed).cursor()
+            self.assertEqual([cursor.popleft() for _ in range(10)], strings[:10])
+            view = cursor.take(3000)
+            self.assertEqual(cursor.popleft(), strings[3010])
+
+            section = StringSection.load(brotli.Decompressor(), compressed)
+            self.assertEqual(section[4000], strings[4000])
+            self.assertEqual(len(section), len(strings))
+            self.assertEqual(list(section[-3:]), strings[-3:])
+            self.assertEqual(list(pickle.loads(pickle.dumps(view))), strings[10:3010])
+
+        section = StringSection.load(brotli.Decompressor(), compressed[:-10])
+        with self.assertRaises(ValueError):
+            len(section)
+
+    def test_compressor(self):
+        strings = []
+        compressor = StringCompressor(strings, brotli.Compressor())
+        for _ in range(5):
+            strings.extend(self.strings)
+            time.sleep(0.01)
+        data_len, compressed = compressor.finish()
+        data = b'\0'.join([self.data] * 5)
+        self.assertEqual(data_len, len(data))
+        self.assertEqual(compressed, brotli.compress(data))